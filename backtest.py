@@ -0,0 +1,323 @@
+"""NumPy backtest of the CPR + EMA strategy
+
+Usage:
+    python backtest.py --data history/ --pairs EUR/USD GBP/JPY --out results/
+
+For each pair the data directory holds:
+    EURUSD_daily.csv   date,open,high,low,close   (one row per session, dated
+                                                   by the day it closes at 17:00 NY)
+    EURUSD_ticks.csv   timestamp,price            (unix seconds, ascending)
+Ticks may also be given as EURUSD_ticks.npy, an (N, 2) float64 array, or
+read straight from the bot's tick archive with --archive data/ticks.
+
+CPR levels come from the previous session's OHLC, with sessions rolling
+over at 17:00 New York like the live bot. EMAs run over the ticks and every
+tick is classified with the same rules as the live bot (strategy.py, which
+main.py imports too). Results land in the output directory as one
+<PAIR>_backtest.npz per pair plus summary.json.
+"""
+import os
+import csv
+import json
+import time
+import argparse
+from datetime import timedelta
+import numpy as np
+
+from tick_archive import TickArchive
+from strategy import SIGNAL_LABELS, EMAState, classify_signal, session_date_for, session_start
+
+# Codes in the output are indexes into SIGNAL_LABELS
+SIGNAL_CODES = {label: code for code, label in enumerate(SIGNAL_LABELS)}
+
+# Position held while each signal is active: long on BUY, short on SELL
+SIGNAL_POSITIONS = np.array([1, 1, 0, 0, 0, 0, 0, -1, -1], dtype=np.int8)
+
+# ============================================
+# LOADING
+# ============================================
+def pair_file_prefix(pair):
+    return pair.replace('/', '')
+
+def load_daily(path):
+    """Daily OHLC as (day_number, high, low, close) arrays"""
+    days, highs, lows, closes = [], [], [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            day = np.datetime64(row['date'], 'D').astype(np.int64)
+            days.append(day)
+            highs.append(float(row['high']))
+            lows.append(float(row['low']))
+            closes.append(float(row['close']))
+    order = np.argsort(days, kind='stable')
+    return (np.asarray(days, dtype=np.int64)[order], np.asarray(highs)[order],
+            np.asarray(lows)[order], np.asarray(closes)[order])
+
+def load_ticks(data_dir, pair):
+    """Ticks as (timestamps, prices) arrays"""
+    prefix = os.path.join(data_dir, pair_file_prefix(pair))
+    if os.path.exists(f"{prefix}_ticks.npy"):
+        ticks = np.load(f"{prefix}_ticks.npy", mmap_mode='r')
+    else:
+        ticks = np.loadtxt(f"{prefix}_ticks.csv", delimiter=',', skiprows=1, usecols=(0, 1), ndmin=2)
+    return np.ascontiguousarray(ticks[:, 0], dtype=np.float64), np.ascontiguousarray(ticks[:, 1], dtype=np.float64)
+
+def load_archived_ticks(archive_dir, pair, start=None, end=None):
+    """Ticks from the live tick archive, mapped rather than parsed
+
+    A range inside one day's segment comes back without any copy; several
+    segments are joined with one concatenate.
+    """
+    segments = list(TickArchive(archive_dir).segments(pair, start, end))
+    if not segments:
+        return np.empty(0), np.empty(0)
+    timestamps = [np.frombuffer(ts, dtype=np.float64) for ts, _ in segments]
+    prices = [np.frombuffer(px, dtype=np.float64) for _, px in segments]
+    if len(segments) == 1:
+        return timestamps[0], prices[0]
+    return np.concatenate(timestamps), np.concatenate(prices)
+
+# ============================================
+# INDICATORS
+# ============================================
+def cpr_arrays(high, low, close):
+    """calculate_cpr over arrays"""
+    pivot = (high + low + close) / 3.0
+    bc = (high + low) / 2.0
+    tc = pivot - bc + pivot
+    return {
+        'pivot': pivot, 'tc': tc, 'bc': bc,
+        'r1': 2 * pivot - low, 's1': 2 * pivot - high,
+        'r2': pivot + (high - low), 's2': pivot - (high - low),
+        'r3': high + 2 * (pivot - low), 's3': low - 2 * (high - pivot)
+    }
+
+def session_days(timestamps):
+    """Trading session of every tick as a day number (strategy.session_date_for over arrays)
+
+    Session opens are computed once per calendar day in the range, so DST
+    changes in New York move the boundary exactly as they do live.
+    """
+    if not len(timestamps):
+        return np.empty(0, dtype=np.int64)
+    first = session_date_for(float(np.min(timestamps)))
+    last = session_date_for(float(np.max(timestamps)))
+    opens = np.array([session_start(first + timedelta(days=i)) for i in range((last - first).days + 1)])
+    index = np.searchsorted(opens, timestamps, side='right') - 1
+    return np.datetime64(first, 'D').astype(np.int64) + index
+
+def session_levels(timestamps, daily):
+    """CPR levels of the previous session for every tick
+
+    Ticks without a previous session get NaN levels and are reported as
+    WAIT (-1), like the live bot before its first history fetch.
+    """
+    days, highs, lows, closes = daily
+    levels = cpr_arrays(highs, lows, closes)
+    tick_days = session_days(timestamps)
+    index = np.searchsorted(days, tick_days, side='left') - 1
+    valid = index >= 0
+    safe = np.where(valid, index, 0)
+    return {name: np.where(valid, values[safe], np.nan) for name, values in levels.items()}
+
+def ema_array(prices, period, exact=True):
+    """EMA seeded with the SMA of the first `period` prices; 0 while warming up
+
+    The recursion is inherently sequential. `exact` runs it as a plain
+    Python loop with the same float operations as strategy.EMAState, so
+    signals match the live bot bit for bit; otherwise a blocked matrix form
+    is used, which is much faster on long series but can differ in the
+    last ulp.
+    """
+    n = len(prices)
+    out = np.zeros(n)
+    if n < period:
+        return out
+    k = 2 / (period + 1)
+    seed = sum(prices[:period].tolist()) / period
+    out[period - 1] = seed
+    rest = prices[period:]
+    if not len(rest):
+        return out
+
+    if exact:
+        values = [seed] * (len(rest) + 1)
+        ema = seed
+        for i, price in enumerate(rest.tolist(), 1):
+            ema = (price * k) + (ema * (1 - k))
+            values[i] = ema
+        out[period - 1:] = values
+        return out
+
+    # ema[t] = a * ema[t-1] + k * x[t], solved in blocks of B with a B x B kernel
+    a = 1 - k
+    block = 256
+    padded = np.zeros(-(-len(rest) // block) * block)
+    padded[:len(rest)] = rest
+    rows = padded.reshape(-1, block)
+    exponents = np.arange(block)[:, None] - np.arange(block)[None, :]
+    kernel = np.where(exponents >= 0, k * a ** np.maximum(exponents, 0), 0.0)
+    partial = rows @ kernel.T
+    carry_weights = a ** np.arange(1, block + 1)
+
+    result = np.empty_like(rows)
+    previous = seed
+    for i in range(len(rows)):
+        result[i] = partial[i] + carry_weights * previous
+        previous = result[i, -1]
+    out[period:] = result.ravel()[:len(rest)]
+    return out
+
+# ============================================
+# SIGNALS
+# ============================================
+def classify_signals(price, levels, ema_8, ema_20):
+    """strategy.classify_signal over arrays, branch for branch"""
+    above_tc = price > levels['tc']
+    below_bc = price < levels['bc']
+    above_8 = price > ema_8
+    below_8 = price < ema_8
+
+    conditions = [
+        above_tc & (price > levels['r1']) & above_8 & (price > ema_20),
+        above_tc & above_8,
+        above_tc,
+        below_bc & (price < levels['s1']) & below_8 & (price < ema_20),
+        below_bc & below_8,
+        below_bc,
+        (price > levels['pivot']) & above_8,
+        (price < levels['pivot']) & below_8,
+    ]
+    choices = [SIGNAL_CODES[label] for label in (
+        'STRONG BUY', 'BUY', 'BUY (Weak)',
+        'STRONG SELL', 'SELL', 'SELL (Weak)',
+        'NEUTRAL (Bullish)', 'NEUTRAL (Bearish)',
+    )]
+    codes = np.select(conditions, choices, default=SIGNAL_CODES['NEUTRAL']).astype(np.int8)
+    # Same guard as get_trading_signal: no levels yet means WAIT
+    waiting = np.isnan(levels['pivot']) | (levels['pivot'] == 0) | (price == 0)
+    codes[waiting] = -1
+    return codes
+
+# ============================================
+# PERFORMANCE
+# ============================================
+def trade_statistics(prices, codes):
+    """Equity curve and per-trade stats for holding SIGNAL_POSITIONS"""
+    positions = np.where(codes >= 0, SIGNAL_POSITIONS[np.maximum(codes, 0)], 0).astype(np.int8)
+    returns = np.zeros(len(prices))
+    returns[1:] = np.diff(prices) / prices[:-1]
+    # Position decided on a tick earns the next tick's return
+    pnl = np.zeros(len(prices))
+    pnl[1:] = positions[:-1] * returns[1:]
+    log_equity = np.cumsum(np.log1p(pnl))
+    equity = np.exp(log_equity)
+
+    drawdown = 1 - equity / np.maximum.accumulate(equity) if len(equity) else np.zeros(0)
+
+    # A trade is a run of identical non-zero positions
+    changes = np.flatnonzero(np.diff(positions, prepend=0) != 0)
+    starts = changes[positions[changes] != 0]
+    boundaries = np.append(changes, len(positions))
+    ends = boundaries[np.searchsorted(boundaries, starts, side='right')]
+    log_pnl = np.log1p(pnl)
+    # Trade from start..end-1 earns pnl on ticks start+1..end
+    cumulative = np.concatenate(([0.0], np.cumsum(log_pnl)))
+    end_index = np.minimum(ends, len(pnl) - 1)
+    trade_returns = np.expm1(cumulative[end_index + 1] - cumulative[starts + 1])
+
+    counts = np.bincount(codes[codes >= 0], minlength=len(SIGNAL_LABELS))
+    return equity, {
+        'bars': int(len(prices)),
+        'trades': int(len(trade_returns)),
+        'win_rate': float(np.mean(trade_returns > 0)) if len(trade_returns) else 0.0,
+        'avg_trade_return': float(np.mean(trade_returns)) if len(trade_returns) else 0.0,
+        'total_return': float(equity[-1] - 1) if len(equity) else 0.0,
+        'max_drawdown': float(drawdown.max()) if len(drawdown) else 0.0,
+        'signal_counts': {label: int(count) for label, count in zip(SIGNAL_LABELS, counts)},
+        'wait_bars': int(np.sum(codes < 0)),
+    }
+
+# ============================================
+# RUNNING
+# ============================================
+def backtest_pair(timestamps, prices, daily, exact=True):
+    """Signals, equity curve and stats for one pair"""
+    levels = session_levels(timestamps, daily)
+    ema_8 = ema_array(prices, 8, exact)
+    ema_20 = ema_array(prices, 20, exact)
+    codes = classify_signals(prices, levels, ema_8, ema_20)
+    equity, stats = trade_statistics(prices, codes)
+    return {'codes': codes, 'equity': equity, 'ema_8': ema_8, 'ema_20': ema_20, 'levels': levels, 'stats': stats}
+
+def verify_against_live(prices, result, samples=10000):
+    """Reclassify random ticks with the live classify_signal and EMAState
+
+    Returns the number of ticks whose signal differs from the live path.
+    """
+    ema_8 = EMAState(8)
+    ema_20 = EMAState(20)
+    live_8 = np.zeros(len(prices))
+    live_20 = np.zeros(len(prices))
+    for i, price in enumerate(prices.tolist()):
+        live_8[i] = ema_8.update(price) or 0
+        live_20[i] = ema_20.update(price) or 0
+
+    rng = np.random.default_rng(0)
+    indexes = rng.choice(len(prices), size=min(samples, len(prices)), replace=False)
+    levels = result['levels']
+    mismatches = 0
+    for i in indexes.tolist():
+        code = int(result['codes'][i])
+        if np.isnan(levels['pivot'][i]):
+            mismatches += code != -1
+            continue
+        label = classify_signal(prices[i], levels['pivot'][i], levels['tc'][i], levels['bc'][i],
+                                levels['r1'][i], levels['s1'][i], live_8[i], live_20[i])
+        mismatches += code != SIGNAL_CODES[label]
+    return mismatches
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Backtest the CPR + EMA strategy')
+    parser.add_argument('--data', required=True, help='directory with <PAIR>_daily.csv and <PAIR>_ticks.csv/.npy')
+    parser.add_argument('--archive', help='read ticks from this tick archive directory instead of --data')
+    parser.add_argument('--pairs', nargs='+', required=True, help='pairs to test, e.g. EUR/USD GBP/JPY')
+    parser.add_argument('--out', default='backtest_results', help='output directory')
+    parser.add_argument('--fast-ema', action='store_true', help='blocked EMA (faster, may differ from live in the last ulp)')
+    parser.add_argument('--verify', type=int, default=0, metavar='N', help='check N random ticks against the live classifier')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    summary = {}
+    for pair in args.pairs:
+        started = time.perf_counter()
+        daily = load_daily(os.path.join(args.data, f"{pair_file_prefix(pair)}_daily.csv"))
+        if args.archive:
+            timestamps, prices = load_archived_ticks(args.archive, pair)
+        else:
+            timestamps, prices = load_ticks(args.data, pair)
+        loaded = time.perf_counter()
+        result = backtest_pair(timestamps, prices, daily, exact=not args.fast_ema)
+        finished = time.perf_counter()
+
+        stats = result['stats']
+        stats['load_seconds'] = round(loaded - started, 3)
+        stats['compute_seconds'] = round(finished - loaded, 3)
+        if args.verify:
+            stats['verify_mismatches'] = verify_against_live(prices, result, args.verify)
+        summary[pair] = stats
+
+        np.savez_compressed(
+            os.path.join(args.out, f"{pair_file_prefix(pair)}_backtest.npz"),
+            timestamp=timestamps, price=prices, signal=result['codes'], equity=result['equity'],
+            ema_8=result['ema_8'], ema_20=result['ema_20']
+        )
+        print(f"{pair}: {stats['bars']} bars, {stats['trades']} trades, "
+              f"return {stats['total_return']:+.2%}, max DD {stats['max_drawdown']:.2%} "
+              f"({stats['compute_seconds']}s)")
+
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,251 @@
+"""Load test and benchmark suite for the bot's handlers and update pipeline
+
+Usage:
+    python benchmark.py --subscribers 10000 50000 --out bench_results/
+    python benchmark.py --subscribers 10000 --compare bench_results/<old>.json
+
+Runs in a temporary working directory against a fake Telegram API
+(fake_telegram.py) and the synthetic market data provider, so nothing
+touches the network or the real data/ directory. Each run writes one JSON
+file named after the current git commit; --compare flags metrics that got
+more than --tolerance slower than a previous file.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('MARKET_DATA_PROVIDER', 'synthetic')
+os.environ.setdefault('SEND_GLOBAL_RATE', '100000')
+os.environ.setdefault('SEND_PER_CHAT_INTERVAL', '0')
+os.environ.setdefault('SUBSCRIBER_FLUSH_INTERVAL', '3600')
+# Webhook mode runs handlers inline, which is what we want to time
+os.environ.setdefault('WEBHOOK_URL', 'http://127.0.0.1')
+
+from fake_telegram import FakeTelegram, make_update
+
+
+def percentiles(samples):
+    if not samples:
+        return {'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+    return {'p50_ms': round(pick(50) * 1000, 4), 'p99_ms': round(pick(99) * 1000, 4),
+            'max_ms': round(ordered[-1] * 1000, 4)}
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+class Bench:
+    def __init__(self, main, symbols=10, seed=0):
+        self.main = main
+        self.random = random.Random(seed)
+        # Subscribers pick from the first `symbols` registry entries; only those get refreshed
+        self.pairs = main.SYMBOL_LIST[:symbols]
+        self.next_update = 1
+
+    def message(self, chat_id, text):
+        self.next_update += 1
+        return self.main.types.Message.de_json(make_update(self.next_update, chat_id, text)['message'])
+
+    def callback(self, chat_id, data):
+        self.next_update += 1
+        message = make_update(self.next_update, chat_id, '')['message']
+        return self.main.types.CallbackQuery.de_json({
+            'id': str(self.next_update), 'from': message['from'], 'chat_instance': 'bench',
+            'data': data, 'message': message
+        })
+
+    def populate(self, count):
+        """Synthetic subscribers with 1-5 pairs each, a third with alerts on"""
+        main = self.main
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        for i in range(count):
+            chat_id = 1_000_000 + i
+            main.subscribers[chat_id] = {
+                'pairs': self.random.sample(self.pairs, self.random.randint(1, 5)),
+                'alerts': i % 3 == 0
+            }
+            main.index_subscriber(chat_id)
+        elapsed = time.perf_counter() - started
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        return {'seconds': round(elapsed, 4), 'bytes_per_subscriber': round(grown / max(count, 1), 1)}
+
+    def persistence(self, changes):
+        """Cost of marking chats dirty and flushing one batch"""
+        main = self.main
+        chat_ids = self.random.sample(list(main.subscribers), min(changes, len(main.subscribers)))
+        mark = [timed(main.save_subscriber, chat_id) for chat_id in chat_ids]
+        flush = timed(main.subscriber_store.flush)
+        return {'changes': len(chat_ids), 'mark': percentiles(mark), 'flush_seconds': round(flush, 4)}
+
+    def market_cycles(self, cycles):
+        main = self.main
+        durations = []
+        queued = []
+        for _ in range(cycles):
+            depth = main.send_queue.depth()
+            # Cycles run back to back, far faster than the provider's ticks
+            main.market_provider.step()
+            durations.append(timed(main.refresh_market_data))
+            queued.append(main.send_queue.depth() - depth)
+        return {'cycles': cycles, 'cycle': percentiles(durations),
+                'messages_queued_per_cycle': round(sum(queued) / max(cycles, 1), 1)}
+
+    def rendering(self, rounds):
+        main = self.main
+        samples = []
+        for _ in range(rounds):
+            for pair in self.pairs:
+                samples.append(timed(main.render_pair_levels, pair))
+        return percentiles(samples)
+
+    def handlers(self, requests):
+        main = self.main
+        chat_ids = list(main.subscribers)
+        results = {}
+        scenarios = {
+            'send_welcome': lambda c: main.send_welcome(self.message(c, '/start')),
+            'handle_pair_selection': lambda c: main.handle_pair_selection(
+                self.callback(c, main.selector_callback('t', 0, '', self.random.choice(self.pairs)))),
+            'show_all_levels': lambda c: main.show_all_levels(self.message(c, '/levels')),
+            'handle_pair_request': lambda c: main.handle_pair_request(self.message(c, self.random.choice(self.pairs))),
+        }
+        for name, scenario in scenarios.items():
+            samples = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                chat_id = self.random.choice(chat_ids)
+                samples.append(timed(scenario, chat_id))
+            elapsed = time.perf_counter() - started
+            results[name] = dict(percentiles(samples), per_second=round(requests / elapsed, 1))
+        return results
+
+    def send_drain(self, fake, timeout=120):
+        """Start the send workers and time how long the queue takes to empty"""
+        main = self.main
+        pending = main.send_queue.depth()
+        fake.reset()
+        started = time.perf_counter()
+        main.send_queue.start()
+        deadline = time.time() + timeout
+        while main.send_queue.depth() and time.time() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        return {'queued': pending, 'seconds': round(elapsed, 3), 'api_calls': len(fake.sent()),
+                'messages_per_second': round(pending / elapsed, 1) if elapsed else 0.0}
+
+
+def run(subscriber_counts, requests, cycles, symbols):
+    fake = FakeTelegram().start()
+    fake.install()
+
+    workdir = tempfile.mkdtemp(prefix='forexbot-bench-')
+    os.chdir(workdir)
+    import main
+
+    results = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': {}}
+    bench = Bench(main, symbols)
+    # Warm the indicators so signals and alerts behave as in production
+    for _ in range(25):
+        main.market_provider.step()
+        main.refresh_market_data(bench.pairs)
+
+    total = 0
+    for count in sorted(subscriber_counts):
+        run_result = {'population': bench.populate(count - total)}
+        total = count
+        run_result['persistence'] = bench.persistence(1000)
+        run_result['market'] = bench.market_cycles(cycles)
+        run_result['rendering'] = bench.rendering(10)
+        run_result['handlers'] = bench.handlers(requests)
+        results['runs'][str(count)] = run_result
+        print(f"{count} subscribers: cycle p50 {run_result['market']['cycle']['p50_ms']}ms, "
+              f"show_all_levels p99 {run_result['handlers']['show_all_levels']['p99_ms']}ms, "
+              f"{run_result['population']['bytes_per_subscriber']} B/subscriber")
+
+    results['send_drain'] = bench.send_drain(fake)
+    fake.stop()
+    return results
+
+
+def flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            flatten(f"{prefix}.{key}" if prefix else key, inner, out)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    return out
+
+
+def compare(current, previous, tolerance):
+    """Latency/duration metrics that grew by more than `tolerance`"""
+    now = flatten('', current.get('runs', {}), {})
+    before = flatten('', previous.get('runs', {}), {})
+    regressions = []
+    for key, value in now.items():
+        if not (key.endswith('_ms') or key.endswith('seconds') or key.endswith('bytes_per_subscriber')):
+            continue
+        old = before.get(key)
+        if old and value > old * (1 + tolerance):
+            regressions.append((key, old, value))
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark handlers and the update pipeline')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[10000])
+    parser.add_argument('--requests', type=int, default=2000, help='handler calls per scenario')
+    parser.add_argument('--cycles', type=int, default=20, help='refresh cycles per run')
+    parser.add_argument('--symbols', type=int, default=10, help='how many registry symbols subscribers pick from')
+    parser.add_argument('--out', default=os.path.join(REPO_DIR, 'bench_results'))
+    parser.add_argument('--compare', help='previous results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    out_dir = os.path.abspath(args.out)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    results = run(args.subscribers, args.requests, args.cycles, args.symbols)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{results['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+    if compare_path:
+        with open(compare_path) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous, args.tolerance)
+        for key, old, new in regressions:
+            print(f"REGRESSION {key}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,180 @@
+"""Multi-process harness: leader election, shared snapshots and failover
+
+Usage:
+    python cluster_harness.py --processes 3
+
+Starts several copies of main.py in one temporary working directory with
+LEADER_LOCK_FILE set, the synthetic provider and a fake Telegram API.
+Checks that exactly one process leads, that a pair selected through a
+follower's webhook reaches the leader and comes back to every process as
+levels, and that a follower takes over when the leader is stopped.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+from fake_telegram import FakeTelegram, make_update
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRET = 'harness-secret'
+
+# Child processes point telebot at the fake API before running main.py
+BOOT = ("import sys, runpy, telebot; "
+        "telebot.apihelper.API_URL = sys.argv[1] + '/bot{0}/{1}'; "
+        "sys.argv = sys.argv[:1]; "
+        "runpy.run_path(%r, run_name='__main__')" % os.path.join(REPO_DIR, 'main.py'))
+
+
+def first_symbol():
+    with open(os.path.join(REPO_DIR, 'symbols.json')) as f:
+        return json.load(f)['symbols'][0]['symbol']
+
+
+def wait_for(condition, timeout, interval=0.1):
+    """Poll `condition` until it returns something truthy; None on timeout"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            result = condition()
+        except requests.RequestException:
+            result = None
+        if result:
+            return result
+        time.sleep(interval)
+    return None
+
+
+class Worker:
+    def __init__(self, index, port, workdir, api_url, logs):
+        self.index = index
+        self.port = port
+        env = dict(os.environ,
+                   PYTHONPATH=REPO_DIR,
+                   PORT=str(port),
+                   TELEGRAM_BOT_TOKEN='123456:CLUSTER',
+                   MARKET_DATA_PROVIDER='synthetic',
+                   UPDATE_INTERVAL='2',
+                   CLUSTER_SYNC_INTERVAL='0.2',
+                   SUBSCRIBER_FLUSH_INTERVAL='0.2',
+                   LEADER_LOCK_FILE='data/leader.lock',
+                   WEBHOOK_URL=f'http://127.0.0.1:{port}',
+                   WEBHOOK_SECRET=SECRET)
+        self.log = open(os.path.join(logs, f'worker-{index}.log'), 'w')
+        self.process = subprocess.Popen([sys.executable, '-c', BOOT, api_url], cwd=workdir, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stats(self):
+        return requests.get(self.url + '/stats', timeout=2).json()
+
+    def levels(self, key):
+        return requests.get(f'{self.url}/api/levels/{key}', timeout=2).json()
+
+    def post(self, update):
+        return requests.post(self.url + '/telegram/webhook', json=update, timeout=5,
+                             headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+
+    def stop(self):
+        if self.alive():
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+
+def select_update(update_id, chat_id, pair_index):
+    """Callback update that toggles one pair, as the /select keyboard sends it"""
+    message = make_update(update_id, chat_id, '')['message']
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': message['from'], 'chat_instance': 'harness',
+        'data': f'sel:t:0:{pair_index:x}:', 'message': message
+    }}
+
+
+def leaders(workers):
+    return [w for w in workers if w.alive() and w.stats().get('role') == 'leader']
+
+
+def run(count, base_port, timeout):
+    fake = FakeTelegram().start()
+    workdir = tempfile.mkdtemp(prefix='forexbot-cluster-')
+    logs = os.path.join(workdir, 'logs')
+    os.makedirs(logs, exist_ok=True)
+    pair = first_symbol()
+    key = pair.replace('/', '')
+    result = {'processes': count, 'workdir': workdir}
+
+    workers = [Worker(i, base_port + i, workdir, fake.url, logs) for i in range(count)]
+    try:
+        started = time.perf_counter()
+        if not wait_for(lambda: all(w.stats() for w in workers), timeout):
+            raise RuntimeError(f'workers did not come up, see {logs}')
+        elected = wait_for(lambda: leaders(workers), timeout)
+        result['startup_seconds'] = round(time.perf_counter() - started, 3)
+        result['leaders'] = len(elected or [])
+        if len(elected or []) != 1:
+            raise RuntimeError(f'expected one leader, found {len(elected or [])}')
+        leader = elected[0]
+        followers = [w for w in workers if w is not leader]
+
+        # A follower records the selection; the leader must notice and fetch it
+        started = time.perf_counter()
+        response = followers[-1].post(select_update(1, 4242, 0))
+        result['webhook_status'] = response.status_code
+        ready = wait_for(lambda: all(w.levels(key).get('ready') for w in workers), timeout)
+        result['selection_to_levels_seconds'] = round(time.perf_counter() - started, 3) if ready else None
+        versions = wait_for(lambda: len({w.levels(key)['version'] for w in workers}) == 1 and
+                            [w.levels(key)['version'] for w in workers], timeout)
+        result['same_version_everywhere'] = bool(versions)
+        result['selection_synced_processes'] = sum(1 for w in workers if w.stats()['active_pairs'])
+
+        # Stop the leader: a follower should take over and keep the levels moving
+        last_version = max(w.levels(key)['version'] for w in followers)
+        started = time.perf_counter()
+        leader.stop()
+        successor = wait_for(lambda: leaders(followers), timeout)
+        result['failover_seconds'] = round(time.perf_counter() - started, 3) if successor else None
+        advanced = wait_for(lambda: all(w.levels(key)['version'] > last_version for w in followers), timeout)
+        result['levels_after_failover'] = bool(advanced)
+        result['ok'] = bool(ready and versions and successor and advanced and len(successor) == 1)
+    finally:
+        for worker in workers:
+            worker.stop()
+        fake.stop()
+    return result
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Leader election and failover across local processes')
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=18000)
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for each step')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON only')
+    args = parser.parse_args()
+
+    result = run(args.processes, args.base_port, args.timeout)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}")
+    sys.exit(0 if result.get('ok') else 1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,121 @@
+"""Local stand-in for the Telegram Bot API
+
+Accepts every bot method over HTTP, answers with a plausible result and
+records each call with its arrival time, so the bot can be driven without
+network access:
+
+    server = FakeTelegram()
+    server.start()
+    server.install()   # points telebot at http://127.0.0.1:<port>
+"""
+import json
+import time
+import itertools
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import telebot
+
+
+class FakeTelegram:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.lock = Lock()
+        self.message_ids = itertools.count(1)
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                # Photo uploads are multipart with binary parts; ids travel in the query string
+                body = self.rfile.read(length).decode(errors='replace') if length else ''
+                params = {k: v[0] for k, v in parse_qs(body).items()}
+                params.update({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+                self.respond(params)
+
+            do_GET = do_POST
+
+            def respond(self, params):
+                method = self.path.split('?')[0].rsplit('/', 1)[-1]
+                if fake.latency:
+                    time.sleep(fake.latency)
+                result = fake.record(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def record(self, method, params):
+        with self.lock:
+            self.calls.append((time.perf_counter(), method, params))
+        if method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            message = {
+                'message_id': int(params.get('message_id') or next(self.message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+            if method == 'sendPhoto':
+                message['photo'] = [{'file_id': f"fake-{message['message_id']}", 'file_unique_id': 'u',
+                                     'width': 800, 'height': 600}]
+            return message
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        if method == 'getUpdates':
+            return []
+        return True
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def install(self):
+        """Route telebot's API calls to this server"""
+        telebot.apihelper.API_URL = self.url + "/bot{0}/{1}"
+        telebot.apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    def sent(self, method='sendMessage'):
+        with self.lock:
+            return [(t, params) for t, m, params in self.calls if m == method]
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+
+def make_update(update_id, chat_id, text):
+    """Minimal Telegram update JSON for a private text message"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        }
+    }
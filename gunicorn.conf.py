@@ -0,0 +1,21 @@
+"""Gunicorn settings for serving main:app
+
+Run with: gunicorn -c gunicorn.conf.py main:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Threads serve health checks and webhook posts concurrently. With more than
+# one worker, the workers elect a leader that alone fetches market data;
+# the others mirror its snapshots and share subscribers through SQLite.
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+if workers > 1:
+    os.environ.setdefault('LEADER_LOCK_FILE', 'data/leader.lock')
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 60
+
+def post_worker_init(worker):
+    import main
+    main.start_services()
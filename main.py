@@ -1,17 +1,38 @@
+import io
 import os
+import sys
 import time
 import json
+import gzip
+import random
+import atexit
+import heapq
+import hmac
+import hashlib
+import itertools
+import functools
+import sqlite3
+import signal
 import logging
-from datetime import datetime, timedelta
-from threading import Thread
+from array import array
+from collections import deque, defaultdict, OrderedDict
+from datetime import datetime, timedelta, timezone
+from threading import Thread, Lock, BoundedSemaphore, Event, Condition
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from urllib.parse import urlparse
 import telebot
 import requests
+from requests.adapters import HTTPAdapter
 from telebot import types
-from flask import Flask, jsonify
+from telebot.apihelper import ApiTelegramException
+from flask import Flask, jsonify, request, Response
+from tick_archive import TickArchive, pair_dirname
+from strategy import SESSION_TIMEZONE, EMAState, classify_signal, session_date_for, session_start
 
 # ============================================
 # LOGGING SETUP
 # ============================================
+os.makedirs('logs', exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -28,24 +49,270 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 PORT = int(os.environ.get('PORT', 10000))
 
+# Telegram webhook (polling is used when WEBHOOK_URL is unset)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = '/telegram/webhook'
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 8))
+WEBHOOK_MAX_PENDING = int(os.environ.get('WEBHOOK_MAX_PENDING', 256))
+
+# Market data source: live, record (live + write to MARKET_DATA_FILE),
+# replay (serve MARKET_DATA_FILE) or synthetic (random walk)
+MARKET_DATA_PROVIDER = os.environ.get('MARKET_DATA_PROVIDER', 'live')
+MARKET_DATA_FILE = os.environ.get('MARKET_DATA_FILE', 'data/market_recording.jsonl.gz')
+# 1 to 1000; faster would just spin the refresh loop
+REPLAY_SPEED = min(max(float(os.environ.get('REPLAY_SPEED', 1)), 1), 1000)
+
+# Market data refresh
+UPDATE_INTERVAL = int(os.environ.get('UPDATE_INTERVAL', 60))
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 8))
+REFRESH_DEADLINE = float(os.environ.get('REFRESH_DEADLINE', 30))
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 10))
+PROVIDER_MAX_CONCURRENCY = int(os.environ.get('PROVIDER_MAX_CONCURRENCY', 4))
+PROVIDER_RATE_LIMIT = float(os.environ.get('PROVIDER_RATE_LIMIT', 5))
+
+# Rate tables are re-fetched when the provider is expected to have published
+# a new one, but never more often than POLL_MIN_INTERVAL or less often than
+# POLL_MAX_INTERVAL. Failing hosts back off exponentially (with jitter) and
+# their circuit opens after BREAKER_THRESHOLD consecutive failures.
+POLL_MIN_INTERVAL = float(os.environ.get('POLL_MIN_INTERVAL', UPDATE_INTERVAL))
+POLL_MAX_INTERVAL = float(os.environ.get('POLL_MAX_INTERVAL', 3600))
+BACKOFF_BASE = float(os.environ.get('BACKOFF_BASE', 5))
+BACKOFF_MAX = float(os.environ.get('BACKOFF_MAX', 600))
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 3))
+
+# Outbound Telegram sends
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', 4))
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+SEND_PER_CHAT_INTERVAL = float(os.environ.get('SEND_PER_CHAT_INTERVAL', 1.0))
+SEND_MAX_ATTEMPTS = 3
+
+# Seconds between batched subscriber writes
+SUBSCRIBER_FLUSH_INTERVAL = float(os.environ.get('SUBSCRIBER_FLUSH_INTERVAL', 1.0))
+
+# Indicators kept per pair: name -> (kind, period)
+INDICATORS = {
+    'ema_8': ('ema', 8),
+    'ema_20': ('ema', 20),
+    'sma_20': ('sma', 20),
+    'rsi_14': ('rsi', 14),
+    'atr_14': ('atr', 14),
+}
+PRICE_HISTORY_SIZE = int(os.environ.get('PRICE_HISTORY_SIZE', 500))
+
+# Shared cache for per-user indicator settings: entries, and seconds unused before expiry
+INDICATOR_CACHE_SIZE = int(os.environ.get('INDICATOR_CACHE_SIZE', 4096))
+INDICATOR_CACHE_TTL = float(os.environ.get('INDICATOR_CACHE_TTL', 900))
+
+# A bar only counts as a full session if its first tick came this soon after it opened
+SESSION_COVERAGE_GRACE = int(os.environ.get('SESSION_COVERAGE_GRACE', 3600))
+# Bars kept per pair for each timeframe
+BAR_CAPACITY = {'1m': 1440, '1h': 336, '1d': 400, '1w': 104, '1M': 36}
+
+# Warm start: market state is saved every SNAPSHOT_INTERVAL seconds and at exit.
+# On boot prices and indicators are only reused if younger than SNAPSHOT_MAX_AGE.
+MARKET_SNAPSHOT_FILE = os.environ.get('MARKET_SNAPSHOT_FILE', 'data/market_snapshot.json')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 60))
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 3600))
+
+# Every fetched price is also appended to the on-disk tick archive
+TICK_ARCHIVE_DIR = os.environ.get('TICK_ARCHIVE_DIR', 'data/ticks')
+HISTORY_DEFAULT_LIMIT = 1000
+HISTORY_MAX_LIMIT = 10000
+
+# Level-crossing alerts
+ALERT_HYSTERESIS_PIPS = float(os.environ.get('ALERT_HYSTERESIS_PIPS', 2))
+ALERT_COOLDOWN = int(os.environ.get('ALERT_COOLDOWN', 900))
+
+# Symbol registry: every pair users can pick, with pip size, precision and group
+SYMBOLS_FILE = os.environ.get('SYMBOLS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbols.json'))
+SELECT_PAGE_SIZE = 24
+# Pairs per /levels digest page
+DIGEST_PAGE_SIZE = 10
+
+# /chart: render threads and how much recent history a chart shows (seconds)
+CHART_WORKERS = int(os.environ.get('CHART_WORKERS', 2))
+CHART_WINDOW = float(os.environ.get('CHART_WINDOW', 6 * 3600))
+
+# Multi-process mode: set LEADER_LOCK_FILE when several processes share one host
+LEADER_LOCK_FILE = os.environ.get('LEADER_LOCK_FILE', '')
+SHARED_MARKET_FILE = os.environ.get('SHARED_MARKET_FILE', 'data/market_shared.json')
+CLUSTER_SYNC_INTERVAL = float(os.environ.get('CLUSTER_SYNC_INTERVAL', 1.0))
+
 # Data file paths
 USERS_FILE = 'data/users.json'
+SUBSCRIBERS_DB = 'data/subscribers.db'
+PREV_SESSION_FILE = 'data/prev_session.json'
 
 # ============================================
-# TOP 10 FOREX PAIRS
+# SYMBOL REGISTRY
 # ============================================
-FOREX_PAIRS = {
-    'EUR/USD': {'base': 'EUR', 'quote': 'USD', 'name': 'Euro / US Dollar'},
-    'GBP/USD': {'base': 'GBP', 'quote': 'USD', 'name': 'British Pound / US Dollar'},
-    'USD/JPY': {'base': 'USD', 'quote': 'JPY', 'name': 'US Dollar / Japanese Yen'},
-    'USD/CHF': {'base': 'USD', 'quote': 'CHF', 'name': 'US Dollar / Swiss Franc'},
-    'AUD/USD': {'base': 'AUD', 'quote': 'USD', 'name': 'Australian Dollar / US Dollar'},
-    'USD/CAD': {'base': 'USD', 'quote': 'CAD', 'name': 'US Dollar / Canadian Dollar'},
-    'NZD/USD': {'base': 'NZD', 'quote': 'USD', 'name': 'New Zealand Dollar / US Dollar'},
-    'EUR/GBP': {'base': 'EUR', 'quote': 'GBP', 'name': 'Euro / British Pound'},
-    'EUR/JPY': {'base': 'EUR', 'quote': 'JPY', 'name': 'Euro / Japanese Yen'},
-    'GBP/JPY': {'base': 'GBP', 'quote': 'JPY', 'name': 'British Pound / Japanese Yen'}
-}
+def load_symbols(path):
+    """Registry from SYMBOLS_FILE: {pair: {base, quote, name, group, pip, precision, range}}
+
+    `range` is the typical daily range as a fraction of price, used to
+    estimate the previous session before the bot has seen a full one.
+    """
+    with open(path) as f:
+        entries = json.load(f)['symbols']
+    symbols = {}
+    for entry in entries:
+        base, quote = entry['symbol'].split('/')
+        symbols[entry['symbol']] = {
+            'base': base, 'quote': quote, 'name': entry['name'], 'group': entry['group'],
+            'pip': float(entry['pip']), 'precision': int(entry['precision']), 'range': float(entry['range'])
+        }
+    return symbols
+
+FOREX_PAIRS = load_symbols(SYMBOLS_FILE)
+# Stable position of each symbol, used for compact callback data
+SYMBOL_LIST = list(FOREX_PAIRS)
+SYMBOL_INDEX = {pair: i for i, pair in enumerate(SYMBOL_LIST)}
+
+def pip_size(pair):
+    return FOREX_PAIRS[pair]['pip']
+
+def price_format(pair):
+    """Format spec for prices of this pair, e.g. '.5f'"""
+    return f".{FOREX_PAIRS[pair]['precision']}f"
+
+# ============================================
+# METRICS
+# ============================================
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metric:
+    """Base for Prometheus-style metrics with a fixed set of label names"""
+    registry = []
+
+    def __init__(self, name, help_text, kind, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        Metric.registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, 'counter', labels)
+        self.values = {}
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in items]
+
+class Gauge(Metric):
+    """Set directly, or computed at scrape time by `function` returning {labels_tuple: value}"""
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, 'gauge', labels)
+        self.values = {}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def get(self, **labels):
+        if self.function:
+            return self.function().get(self.key(labels), 0)
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        if self.function:
+            items = list(self.function().items())
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in items]
+
+class Histogram(Metric):
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, 'histogram', labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+def render_metrics():
+    lines = []
+    for metric in Metric.registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+PROVIDER_REQUESTS = Counter('forexbot_provider_requests_total', 'Provider HTTP requests by host and outcome', ('host', 'status'))
+PROVIDER_LATENCY = Histogram('forexbot_provider_request_seconds', 'Provider HTTP request latency', ('host',))
+MONITOR_CYCLE = Histogram('forexbot_monitor_cycle_seconds', 'Duration of one monitoring_loop refresh cycle')
+HANDLER_LATENCY = Histogram('forexbot_handler_seconds', 'Telegram handler latency by handler', ('handler',))
+HANDLER_ERRORS = Counter('forexbot_handler_errors_total', 'Telegram handler exceptions by handler', ('handler',))
+ALERTS_TRIGGERED = Counter('forexbot_alerts_triggered_total', 'Level crossings detected', ('pair',))
+ALERTS_QUEUED = Counter('forexbot_alert_messages_total', 'Alert messages queued for delivery')
+MESSAGES_SENT = Counter('forexbot_messages_sent_total', 'Outbound Telegram sends by outcome', ('outcome',))
+API_REQUESTS = Counter('forexbot_api_requests_total', 'JSON API requests by endpoint and status', ('endpoint', 'status'))
+CHART_RENDER_SECONDS = Histogram('forexbot_chart_render_seconds', 'Time to draw one chart PNG')
+CHART_UPLOADS = Counter('forexbot_chart_uploads_total', 'Chart sends by how the image was delivered', ('kind',))
+INDICATOR_CACHE_LOOKUPS = Counter('forexbot_indicator_cache_lookups_total', 'Custom indicator cache lookups by result', ('result',))
+
+def instrumented(handler):
+    """Record latency and errors for a Telegram handler"""
+    name = handler.__name__
+    
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+    return wrapper
 
 # ============================================
 # FLASK WEB SERVER (for Render health checks)
@@ -68,304 +335,2716 @@ def health():
 @app.route('/stats')
 def stats():
     return jsonify({
-        'total_subscribers': len(subscribers),
-        'active_pairs': len([s for s in subscribers.values() if s['pairs']]),
-        'last_update': max([m.last_update.isoformat() if m.last_update else None 
-                           for m in market_data.values()], default=None)
+        'total_subscribers': SUBSCRIBER_COUNT.get(),
+        'active_pairs': ACTIVE_SUBSCRIBER_COUNT.get(),
+        'alert_subscribers': ALERT_SUBSCRIBER_COUNT.get(),
+        'last_update': last_market_update.isoformat() if last_market_update else None,
+        'role': cluster_role
+    })
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+SYMBOL_KEYS = {pair_dirname(pair): pair for pair in FOREX_PAIRS}
+
+def resolve_pair(name):
+    """Pair for a URL segment such as EURUSD, EUR_USD or eur-usd"""
+    return SYMBOL_KEYS.get(pair_dirname(name.replace('_', '').replace('-', '')))
+
+def parse_time_arg(value, default):
+    """Unix seconds or an ISO 8601 timestamp from a query string"""
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/history/<pair>')
+def history(pair):
+    """Archived ticks for a pair, e.g. /history/EURUSD?start=...&end=...&limit=...
+
+    Results are capped at `limit`; when truncated, `next_start` is the
+    timestamp to pass as `start` for the next page.
+    """
+    name, pair = pair, resolve_pair(pair)
+    if not pair:
+        return jsonify({'error': f"unknown pair {name}"}), 404
+    
+    try:
+        end = parse_time_arg(request.args.get('end'), time.time())
+        start = parse_time_arg(request.args.get('start'), end - 86400)
+        limit = int(request.args.get('limit', HISTORY_DEFAULT_LIMIT))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    
+    rows = tick_archive.query(pair, start, end, limit=limit + 1)
+    truncated = len(rows) > limit
+    return jsonify({
+        'pair': pair,
+        'start': start,
+        'end': end,
+        'count': min(len(rows), limit),
+        'truncated': truncated,
+        'next_start': rows[limit][0] if truncated else None,
+        'ticks': rows[:limit]
     })
 
 # ============================================
 # DATA PERSISTENCE
 # ============================================
+class SubscriberStore:
+    """Subscriber records in SQLite (WAL mode), one row per chat
+
+    Handlers only mark a chat dirty; a flusher thread writes all dirty
+    chats in one transaction every SUBSCRIBER_FLUSH_INTERVAL seconds, so a
+    change costs O(1) no matter how many chats exist. WAL keeps every
+    commit atomic across crashes and SQLite checkpoints it on its own.
+    
+    Several processes can share the file: each flush stamps its rows with
+    the next commit version and this process's id, and changes() returns
+    what the others wrote since the last call. The refresh_requests table
+    carries pairs followers want fetched to the leader.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for attempt in range(50):
+            try:
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                break
+            except sqlite3.OperationalError:
+                # Processes starting together on a new file: the switch to WAL needs it alone
+                if attempt == 49:
+                    raise
+                time.sleep(0.1)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS subscribers ('
+            'chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, '
+            'version INTEGER NOT NULL DEFAULT 0, origin INTEGER)'
+        )
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(subscribers)')}
+        for column, spec in (('version', 'INTEGER NOT NULL DEFAULT 0'), ('origin', 'INTEGER')):
+            if column not in columns:
+                try:
+                    self.conn.execute(f'ALTER TABLE subscribers ADD COLUMN {column} {spec}')
+                except sqlite3.OperationalError:
+                    pass  # another process added it first
+        self.conn.execute('CREATE INDEX IF NOT EXISTS subscribers_version ON subscribers (version)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS refresh_requests (pair TEXT PRIMARY KEY, requested_at REAL NOT NULL)'
+        )
+        self.origin = os.getpid()
+        self.synced_version = 0
+        self.lock = Lock()
+        self.dirty = set()
+        self.wake = Event()
+        self.records = None
+        self.flusher = None
+
+    def load(self):
+        rows = self.conn.execute('SELECT chat_id, data, version FROM subscribers').fetchall()
+        self.synced_version = max((version for _, _, version in rows), default=0)
+        return {chat_id: json.loads(data) for chat_id, data, _ in rows}
+
+    def import_json(self, path):
+        """One-off migration from the old users.json, keys coerced to int"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO subscribers (chat_id, data, updated_at) VALUES (?, ?, ?)',
+                [(int(chat_id), json.dumps(user), now) for chat_id, user in data.items()]
+            )
+            self.conn.execute('COMMIT')
+        return len(data)
+
+    def mark_dirty(self, chat_id):
+        with self.lock:
+            self.dirty.add(chat_id)
+
+    def flush(self):
+        """Write every dirty chat in a single transaction"""
+        with self.lock:
+            if not self.dirty:
+                return 0
+            batch, self.dirty = self.dirty, set()
+            try:
+                # IMMEDIATE takes the write lock up front, so versions follow commit order
+                self.conn.execute('BEGIN IMMEDIATE')
+                version = self.conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM subscribers').fetchone()[0]
+                upserts = []
+                deletes = []
+                for chat_id in batch:
+                    user = self.records.get(chat_id)
+                    if user is None:
+                        deletes.append((chat_id,))
+                    else:
+                        upserts.append((chat_id, json.dumps(user), time.time(), version, self.origin))
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO subscribers (chat_id, data, updated_at, version, origin) '
+                    'VALUES (?, ?, ?, ?, ?)', upserts
+                )
+                self.conn.executemany('DELETE FROM subscribers WHERE chat_id = ?', deletes)
+                self.conn.execute('COMMIT')
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
+                self.dirty |= batch
+                raise
+        return len(batch)
+
+    def changes(self):
+        """Records other processes committed since the last call, as {chat_id: record}
+
+        Chats with a local change still waiting for flush are left out; ours
+        is newer and will overwrite theirs.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT chat_id, data, version, origin FROM subscribers WHERE version > ?', (self.synced_version,)
+            ).fetchall()
+            pending = set(self.dirty)
+        changed = {}
+        for chat_id, data, version, origin in rows:
+            self.synced_version = max(self.synced_version, version)
+            if origin != self.origin and chat_id not in pending:
+                changed[chat_id] = json.loads(data)
+        return changed
+
+    def request_pairs(self, pairs):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO refresh_requests (pair, requested_at) VALUES (?, ?)',
+                                  [(pair, now) for pair in pairs])
+
+    def take_requested_pairs(self):
+        """Pairs requested since the last call, removed from the table"""
+        with self.lock:
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+                pairs = [row[0] for row in self.conn.execute('SELECT pair FROM refresh_requests')]
+                self.conn.execute('DELETE FROM refresh_requests')
+                self.conn.execute('COMMIT')
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
+                raise
+        return pairs
+
+    def start(self, records):
+        """Attach the in-memory records and start the write-behind thread"""
+        self.records = records
+        if self.flusher is None:
+            self.flusher = Thread(target=self.flush_loop, daemon=True)
+            self.flusher.start()
+
+    def flush_loop(self):
+        while True:
+            self.wake.wait(SUBSCRIBER_FLUSH_INTERVAL)
+            self.wake.clear()
+            try:
+                count = self.flush()
+                if count:
+                    logger.info(f"💾 Saved {count} subscriber changes")
+            except Exception as e:
+                logger.error(f"❌ Error saving subscribers: {e}")
+
+subscriber_store = SubscriberStore(SUBSCRIBERS_DB)
+
 def load_subscribers():
-    """Load subscribers from JSON file"""
+    """Load subscribers from the database, migrating users.json once"""
     try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r') as f:
-                data = json.load(f)
-                logger.info(f"✅ Loaded {len(data)} subscribers from file")
-                return data
-        else:
-            logger.info("📝 Creating new users file")
-            return {}
+        data = subscriber_store.load()
+        if not data and os.path.exists(USERS_FILE):
+            migrated = subscriber_store.import_json(USERS_FILE)
+            logger.info(f"📦 Migrated {migrated} subscribers from {USERS_FILE}")
+            data = subscriber_store.load()
+        logger.info(f"✅ Loaded {len(data)} subscribers")
+        return data
     except Exception as e:
         logger.error(f"❌ Error loading subscribers: {e}")
         return {}
 
-def save_subscribers():
-    """Save subscribers to JSON file"""
+def save_subscriber(chat_id):
+    """Queue one chat's record for the next batched write"""
+    subscriber_store.mark_dirty(chat_id)
+
+def flush_subscribers():
+    """Write pending subscriber changes now (used at shutdown)"""
     try:
-        os.makedirs('data', exist_ok=True)
-        with open(USERS_FILE, 'w') as f:
-            json.dump(subscribers, f, indent=2)
-        logger.info(f"💾 Saved {len(subscribers)} subscribers")
+        subscriber_store.flush()
     except Exception as e:
         logger.error(f"❌ Error saving subscribers: {e}")
 
+# ============================================
+# INDICATOR ENGINE
+# ============================================
+# EMAState is in strategy.py, shared with backtest.py
+class SMAState:
+    """Running SMA over the last `period` prices"""
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.value = None
+
+    def update(self, price):
+        if len(self.window) == self.period:
+            self.total -= self.window[0]
+        self.window.append(price)
+        self.total += price
+        if len(self.window) == self.period:
+            self.value = self.total / self.period
+        return self.value
+
+class RSIState:
+    """Wilder RSI from tick-to-tick price changes"""
+    def __init__(self, period):
+        self.period = period
+        self.prev_price = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.value = None
+
+    def update(self, price):
+        if self.prev_price is not None:
+            change = price - self.prev_price
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            self.count += 1
+            if self.count <= self.period:
+                self.avg_gain += gain / self.period
+                self.avg_loss += loss / self.period
+            else:
+                self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+                self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+            if self.count >= self.period:
+                if self.avg_loss == 0:
+                    self.value = 100.0
+                else:
+                    self.value = 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+        self.prev_price = price
+        return self.value
+
+class ATRState:
+    """Wilder ATR; with ticks only, the true range is the move from the last price"""
+    def __init__(self, period):
+        self.period = period
+        self.prev_close = None
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = None
+
+    def update(self, price, high=None, low=None):
+        high = price if high is None else high
+        low = price if low is None else low
+        if self.prev_close is not None:
+            true_range = max(high, self.prev_close) - min(low, self.prev_close)
+            self.count += 1
+            if self.value is None:
+                self.seed_sum += true_range
+                if self.count == self.period:
+                    self.value = self.seed_sum / self.period
+            else:
+                self.value = (self.value * (self.period - 1) + true_range) / self.period
+        self.prev_close = price
+        return self.value
+
+INDICATOR_TYPES = {'ema': EMAState, 'sma': SMAState, 'rsi': RSIState, 'atr': ATRState}
+
+class IndicatorSet:
+    """Streaming indicators for one pair, each updated in O(1) per tick"""
+    def __init__(self, config=None):
+        self.config = dict(config or INDICATORS)
+        self.states = {name: INDICATOR_TYPES[kind](period) for name, (kind, period) in self.config.items()}
+        # Indicators we always stream; others come and go with request/release
+        self.base = set(self.config)
+        self.requested = set()
+        self.released = set()
+
+    def request(self, kind, period):
+        """Ask for another indicator to be streamed from the next update on; safe from any thread"""
+        name = f'{kind}_{period}'
+        self.released.discard(name)
+        if name not in self.states:
+            self.requested.add((name, kind, period))
+        return name
+
+    def release(self, kind, period):
+        """Stop streaming an indicator added by request(); safe from any thread"""
+        name = f'{kind}_{period}'
+        self.requested.discard((name, kind, period))
+        if name not in self.base:
+            self.released.add(name)
+
+    def start_requested(self, prices):
+        """Drop released indicators and create requested ones, warmed up from `prices`; updating thread only"""
+        while self.released:
+            name = self.released.pop()
+            self.states.pop(name, None)
+            self.config.pop(name, None)
+        while self.requested:
+            name, kind, period = self.requested.pop()
+            if name in self.states:
+                continue
+            state = INDICATOR_TYPES[kind](period)
+            for price in prices:
+                state.update(price)
+            self.config[name] = (kind, period)
+            self.states[name] = state
+
+    def update(self, price):
+        for state in self.states.values():
+            state.update(price)
+
+    def warm_up(self, prices):
+        """Replay past prices, e.g. from price_history after a restart"""
+        for price in prices:
+            self.update(price)
+
+    def value(self, name):
+        """Indicator value, or 0 while it is still warming up"""
+        value = self.states[name].value
+        return value if value is not None else 0
+
+    def values(self):
+        return {name: self.value(name) for name in self.states}
+
+    def to_dict(self):
+        return {name: {key: list(value) if isinstance(value, deque) else value
+                       for key, value in vars(state).items()}
+                for name, state in self.states.items()}
+
+    def restore(self, saved):
+        """Load to_dict() output; False if the saved indicators don't match ours
+
+        Saved custom indicators are loaded too if they have been requested
+        again; the rest are left out.
+        """
+        if not set(self.states) <= set(saved):
+            return False
+        for name, kind, period in list(self.requested):
+            if name in saved and saved[name].get('period') == period:
+                self.requested.discard((name, kind, period))
+                self.config[name] = (kind, period)
+                self.states[name] = INDICATOR_TYPES[kind](period)
+        if any(saved[name].get('period') != state.period for name, state in self.states.items()):
+            return False
+        for name, state in self.states.items():
+            for key, value in saved[name].items():
+                current = getattr(state, key, None)
+                if isinstance(current, deque):
+                    current.extend(value)
+                else:
+                    setattr(state, key, value)
+        return True
+
+# ============================================
+# OHLC BARS
+# ============================================
+# session_date_for/session_start (17:00 New York rollover) are in strategy.py
+def first_session_of_month(day):
+    """First weekday session of the month `day` falls in"""
+    day = day.replace(day=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+def bar_start(timeframe, ts):
+    """Start time of the bar a tick falls into, or None outside market hours"""
+    if timeframe == '1m':
+        return ts - ts % 60
+    if timeframe == '1h':
+        return ts - ts % 3600
+    
+    day = session_date_for(ts)
+    if day.weekday() >= 5:
+        # Friday 17:00 to Sunday 17:00 NY: market closed
+        return None
+    if timeframe == '1d':
+        return session_start(day)
+    if timeframe == '1w':
+        return session_start(day - timedelta(days=day.weekday()))
+    if timeframe == '1M':
+        return session_start(first_session_of_month(day))
+    raise ValueError(f"Unknown timeframe {timeframe}")
+
+def previous_bar_start(timeframe, start):
+    """Start of the session bar immediately before the one starting at `start`"""
+    day = session_date_for(start)
+    if timeframe == '1d':
+        day -= timedelta(days=1)
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+    elif timeframe == '1w':
+        day -= timedelta(days=7)
+    elif timeframe == '1M':
+        day = first_session_of_month(day.replace(day=1) - timedelta(days=1))
+    else:
+        raise ValueError(f"Not a session timeframe: {timeframe}")
+    return session_start(day)
+
+def bar_end(timeframe, start):
+    """When the session bar starting at `start` closes (after its last weekday session)"""
+    day = session_date_for(start)
+    if timeframe == '1d':
+        last = day
+    elif timeframe == '1w':
+        last = day + timedelta(days=4)
+    elif timeframe == '1M':
+        last = (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        while last.weekday() >= 5:
+            last -= timedelta(days=1)
+    else:
+        raise ValueError(f"Not a session timeframe: {timeframe}")
+    return session_start(last + timedelta(days=1))
+
+class BarSeries:
+    """Fixed-capacity ring of OHLC bars stored in flat float arrays"""
+    FIELDS = ('start', 'opened_at', 'updated_at', 'open', 'high', 'low', 'close')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in self.FIELDS}
+        self.head = -1
+        self.count = 0
+
+    def add(self, start, ts, price):
+        columns = self.columns
+        if self.count and start == columns['start'][self.head]:
+            i = self.head
+            columns['high'][i] = max(columns['high'][i], price)
+            columns['low'][i] = min(columns['low'][i], price)
+            columns['close'][i] = price
+            columns['updated_at'][i] = ts
+            return
+        if self.count and start < columns['start'][self.head]:
+            return
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        i = self.head
+        columns['start'][i] = start
+        columns['opened_at'][i] = columns['updated_at'][i] = ts
+        columns['open'][i] = columns['high'][i] = columns['low'][i] = columns['close'][i] = price
+
+    def bar(self, offset=0):
+        """Bar `offset` places back from the newest, as a dict"""
+        if offset >= self.count:
+            return None
+        i = (self.head - offset) % self.capacity
+        return {field: self.columns[field][i] for field in self.FIELDS}
+
+    def bars(self):
+        """All bars, oldest first, as tuples in FIELDS order"""
+        return [tuple(self.columns[f][(self.head - offset) % self.capacity] for f in self.FIELDS)
+                for offset in range(self.count - 1, -1, -1)]
+
+    def load(self, bars):
+        """Replace the contents with bars() output, keeping the newest that fit"""
+        bars = bars[-self.capacity:]
+        for i, bar in enumerate(bars):
+            for field, value in zip(self.FIELDS, bar):
+                self.columns[field][i] = value
+        self.count = len(bars)
+        self.head = self.count - 1
+
+class OHLCBuilder:
+    """Turns one pair's ticks into 1m/1h/daily/weekly/monthly bars"""
+    def __init__(self, capacity=None):
+        self.series = {tf: BarSeries(size) for tf, size in (capacity or BAR_CAPACITY).items()}
+        self.cpr_cache = {}
+
+    def add_tick(self, price, ts=None):
+        ts = ts or time.time()
+        for timeframe, series in self.series.items():
+            start = bar_start(timeframe, ts)
+            if start is not None:
+                series.add(start, ts, price)
+
+    def previous_session(self, timeframe='1d'):
+        """The session before the current one, if the bot saw it open and close"""
+        series = self.series[timeframe]
+        current = series.bar(0)
+        previous = series.bar(1)
+        if not current or not previous:
+            return None
+        if previous['start'] != previous_bar_start(timeframe, current['start']):
+            return None
+        if previous['opened_at'] - previous['start'] > SESSION_COVERAGE_GRACE:
+            return None
+        if bar_end(timeframe, previous['start']) - previous['updated_at'] > SESSION_COVERAGE_GRACE:
+            return None
+        return previous
+
+    def cpr(self, timeframe='1d'):
+        """CPR levels from the previous completed bar, computed once per bar"""
+        bar = self.previous_session(timeframe)
+        if not bar:
+            return None
+        cached = self.cpr_cache.get(timeframe)
+        if cached and cached[0] == bar['start']:
+            return cached[1]
+        levels = calculate_cpr(bar['high'], bar['low'], bar['close'])
+        self.cpr_cache[timeframe] = (bar['start'], levels)
+        return levels
+
 # ============================================
 # Initialize Bot
 # ============================================
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+# With a webhook, handlers run on our bounded webhook pool instead of telebot's
+bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=not WEBHOOK_URL)
 subscribers = load_subscribers()
+subscriber_store.start(subscribers)
+atexit.register(flush_subscribers)
 
-# Store price history for each pair
-price_history = {pair: [] for pair in FOREX_PAIRS.keys()}
+# Recent prices for each pair (indicators don't need them, warm-up and charts do)
+price_history = defaultdict(lambda: deque(maxlen=PRICE_HISTORY_SIZE))
 
-# Store market data for each pair
-class MarketData:
-    def __init__(self):
-        self.current_price = 0
-        self.pivot = 0
-        self.tc = 0
-        self.bc = 0
-        self.r1 = 0
-        self.r2 = 0
-        self.r3 = 0
-        self.s1 = 0
-        self.s2 = 0
-        self.s3 = 0
-        self.prev_high = 0
-        self.prev_low = 0
-        self.prev_close = 0
-        self.ema_8 = 0
-        self.ema_20 = 0
-        self.last_update = None
-        self.last_alert_time = {}
-
-# Market data for each pair
-market_data = {pair: MarketData() for pair in FOREX_PAIRS.keys()}
+# Session bars built from every fetched price
+bar_builders = defaultdict(OHLCBuilder)
+
+# Every tick on disk, for /history, backtests and charts
+tick_archive = TickArchive(TICK_ARCHIVE_DIR)
+
+class MarketSnapshot:
+    """One pair's market state as of one update; never modified, only replaced
+
+    update_market_data builds a new snapshot and publishes it with a single
+    assignment to market_data[pair]. A reader that takes market_data[pair]
+    once sees price, levels and EMAs from the same update without locking,
+    and can keep using that version for as long as it likes. Dict fields
+    (levels, indicators) are shared between versions and must not be mutated.
+    """
+    FIELDS = (
+        'pair', 'version', 'current_price', 'pivot', 'tc', 'bc', 'r1', 'r2', 'r3', 's1', 's2', 's3',
+        'prev_high', 'prev_low', 'prev_close', 'cpr_source', 'weekly_cpr', 'monthly_cpr',
+        'ema_8', 'ema_20', 'indicators', 'last_update', 'price_source', 'stale', 'history'
+    )
+    DEFAULTS = {'cpr_source': None, 'weekly_cpr': None, 'monthly_cpr': None, 'indicators': None,
+                'last_update': None, 'price_source': None, 'stale': False, 'history': ()}
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            object.__setattr__(self, field, values.get(field, self.DEFAULTS.get(field, 0)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MarketSnapshot is immutable; publish a new one with replace()")
+
+    def replace(self, **changes):
+        """Copy with `changes` applied and the version bumped"""
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values.update(changes)
+        values['version'] = self.version + 1
+        return MarketSnapshot(**values)
+
+    def derive(self, **changes):
+        """Copy with `changes` applied at the same version, for rendering only"""
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values.update(changes)
+        return MarketSnapshot(**values)
+
+# Latest published snapshot for each pair that has been updated at least once.
+# Per-pair state is created on first update, so memory follows watched symbols.
+market_data = {}
+
+def get_market(pair):
+    """Latest snapshot for a pair, or an empty one if it was never updated"""
+    return market_data.get(pair) or MarketSnapshot(pair=pair)
+
+# Streaming indicators per pair; only the updating thread touches these
+indicator_sets = defaultdict(IndicatorSet)
+
+# MarketSnapshot fields saved in the warm-start snapshot
+SNAPSHOT_FIELDS = (
+    'current_price', 'pivot', 'tc', 'bc', 'r1', 'r2', 'r3', 's1', 's2', 's3',
+    'prev_high', 'prev_low', 'prev_close', 'cpr_source', 'weekly_cpr', 'monthly_cpr',
+    'ema_8', 'ema_20'
+)
 
 # ============================================
-# DATA FETCHING
+# HTTP CLIENTS
 # ============================================
-def get_forex_price(base, quote):
-    """Get current forex price"""
-    try:
-        if base == 'USD':
-            url = f"https://api.exchangerate-api.com/v4/latest/{base}"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                return float(data['rates'][quote])
+class RateLimiter:
+    """Spaces calls out to at most `rate` per second (0 disables)"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_time = 0
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+def backoff_delay(failures):
+    """Exponential backoff for the n-th consecutive failure, with equal jitter"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(failures - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Stops calls to a host after repeated failures
+
+    Closed: calls go through. After `threshold` consecutive failures the
+    circuit opens and calls fail fast until a backoff delay passes; then a
+    single probe is let through (half-open). Success closes the circuit,
+    failure opens it again for longer.
+    """
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD):
+        self.host = host
+        self.threshold = threshold
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retry_at = 0
+        self.lock = Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() >= self.retry_at:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"✅ {self.host} recovered, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self, retry_after=None):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold or retry_after:
+                delay = retry_after or backoff_delay(self.failures - self.threshold + 1)
+                if self.state == self.CLOSED:
+                    logger.warning(f"⚠️ {self.host} failing, circuit open for {delay:.0f}s")
+                self.state = self.OPEN
+                self.retry_at = time.monotonic() + delay
+
+class ProviderClient:
+    """Keep-alive session for one host with concurrency and rate limits
+
+    Also remembers ETag/Last-Modified per URL for conditional requests and
+    guards the host with a circuit breaker.
+    """
+    def __init__(self, host, max_concurrency, rate_limit):
+        self.host = host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.slots = BoundedSemaphore(max_concurrency)
+        self.limiter = RateLimiter(rate_limit)
+        self.breaker = CircuitBreaker(host)
+        # url -> (etag, last_modified, parsed body) of the last 200
+        self.validators = {}
+
+    def get(self, url, timeout=None, **kwargs):
+        if not self.breaker.allow():
+            PROVIDER_REQUESTS.inc(host=self.host, status='circuit_open')
+            raise CircuitOpenError(self.host)
+        with self.slots:
+            self.limiter.wait()
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=timeout or REQUEST_TIMEOUT, **kwargs)
+            except Exception:
+                PROVIDER_REQUESTS.inc(host=self.host, status='error')
+                self.breaker.failure()
+                raise
+            finally:
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, host=self.host)
+            PROVIDER_REQUESTS.inc(host=self.host, status=response.status_code)
+        
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get('Retry-After', '')
+            self.breaker.failure(float(retry_after) if retry_after.isdigit() else None)
         else:
-            url = f"https://api.exchangerate-api.com/v4/latest/{base}"
-            response = requests.get(url, timeout=10)
+            self.breaker.success()
+        return response
+
+    def get_json(self, url, timeout=None):
+        """Parsed JSON body, sent as a conditional GET when the URL was seen before
+
+        A 304 returns the very same object as the previous call, so callers
+        can tell "unchanged" with `is`. Other non-200 responses raise.
+        """
+        headers = {}
+        cached = self.validators.get(url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        
+        response = self.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[2]
+        response.raise_for_status()
+        data = response.json()
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.validators[url] = (etag, last_modified, data)
+        return data
+
+provider_clients = {}
+provider_clients_lock = Lock()
+
+def get_provider_client(host):
+    with provider_clients_lock:
+        if host not in provider_clients:
+            provider_clients[host] = ProviderClient(host, PROVIDER_MAX_CONCURRENCY, PROVIDER_RATE_LIMIT)
+        return provider_clients[host]
+
+def http_get(url, timeout=None, **kwargs):
+    """GET through the pooled, rate-limited client for the URL's host"""
+    return get_provider_client(urlparse(url).netloc).get(url, timeout=timeout, **kwargs)
+
+def http_get_json(url, timeout=None):
+    """Conditional GET of a JSON document; see ProviderClient.get_json"""
+    return get_provider_client(urlparse(url).netloc).get_json(url, timeout=timeout)
+
+def breaker_states():
+    with provider_clients_lock:
+        clients = list(provider_clients.values())
+    return {(client.host,): client.breaker.state for client in clients}
+
+PROVIDER_CIRCUIT = Gauge('forexbot_provider_circuit_state', 'Circuit breaker per host: 0 closed, 1 open, 2 half-open',
+                         ('host',), function=breaker_states)
+
+# Two pools so a task never waits on its own pool: refresh_executor runs a
+# cycle's top-level jobs (quotes, previous session) for the monitor loop and
+# on-demand refreshes, fetch_executor runs the per-base requests they fan out to
+refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='refresh')
+fetch_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='fetch')
+
+# ============================================
+# DATA FETCHING
+# ============================================
+RATES_URL = 'https://api.exchangerate-api.com/v4/latest/{base}'
+HISTORY_URL = 'https://api.frankfurter.app/{date}?from={base}&to={quotes}'
+
+# Every pair is priced from this base's rate table (direct or cross rate)
+QUOTE_BASE = 'USD'
+
+class FeedSchedule:
+    """When to poll one rate table again, learned from how often it changes
+
+    The provider stamps each table with `time_last_updated`. The gap between
+    successive stamps (smoothed) predicts the next publication; until then
+    the last table is served from memory. A table that is late is polled
+    every POLL_MIN_INTERVAL. Errors push the next poll out with backoff.
+    """
+    # Seconds after the expected publication before polling, to let it land
+    SETTLE = 5
+
+    def __init__(self):
+        self.data = None
+        self.updated_at = None
+        self.interval = None
+        self.next_due = 0
+        self.failures = 0
+
+    def due(self):
+        return self.data is None or time.monotonic() >= self.next_due
+
+    def success(self, data):
+        now = time.time()
+        self.failures = 0
+        if data is not self.data:
+            updated_at = data.get('time_last_updated') or now
+            if self.updated_at and updated_at > self.updated_at:
+                gap = updated_at - self.updated_at
+                # A gap much longer than usual means we missed publications
+                if self.interval is None:
+                    self.interval = gap
+                elif gap < 1.5 * self.interval:
+                    self.interval = 0.7 * self.interval + 0.3 * gap
+            self.updated_at = updated_at
+            self.data = data
+        
+        expected = data.get('time_next_update') or (self.updated_at + self.interval if self.interval else None)
+        delay = expected - now + self.SETTLE if expected and expected > now else POLL_MIN_INTERVAL
+        self.next_due = time.monotonic() + min(max(delay, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+    def failure(self):
+        self.failures += 1
+        self.next_due = time.monotonic() + backoff_delay(self.failures)
+
+class LiveProvider:
+    """Rates from exchangerate-api (latest) and frankfurter (history)"""
+    def __init__(self):
+        self.feeds = {}
+        self.lock = Lock()
+
+    def latest_rates(self, base):
+        """Provider JSON for the latest `base` table, or None
+
+        Served from memory until the provider should have published a new
+        table. If fetching fails, the last good table is returned with
+        'stale': True.
+        """
+        with self.lock:
+            feed = self.feeds.setdefault(base, FeedSchedule())
+        if not feed.due():
+            return dict(feed.data, stale=True) if feed.failures else feed.data
+        try:
+            data = http_get_json(RATES_URL.format(base=base))
+            feed.success(data)
+            return data
+        except Exception as e:
+            feed.failure()
+            logger.error(f"❌ Error fetching {base} rates (retry in {feed.next_due - time.monotonic():.0f}s): {e}")
+        if feed.data:
+            return dict(feed.data, stale=True)
+        return None
+
+    def history_rates(self, session_date, base, quotes):
+        """{quote: close} for `base` on a past date, or {}"""
+        url = HISTORY_URL.format(date=session_date, base=base, quotes=','.join(quotes))
+        try:
+            response = http_get(url)
             if response.status_code == 200:
-                data = response.json()
-                return float(data['rates'][quote])
+                return response.json().get('rates', {})
+        except Exception as e:
+            logger.error(f"❌ Error fetching {session_date} history for {base}: {e}")
+        return {}
+
+    def next_delay(self, elapsed):
+        """Seconds to wait before the next refresh cycle"""
+        return max(0, UPDATE_INTERVAL - elapsed)
+
+class RecordingProvider:
+    """Wraps another provider and appends every response to a gzip JSON-lines file"""
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write(self, kind, args, data):
+        record = json.dumps({'t': time.time(), 'kind': kind, 'args': args, 'data': data}, separators=(',', ':'))
+        with self.lock:
+            with gzip.open(self.path, 'at') as f:
+                f.write(record + '\n')
+
+    def latest_rates(self, base):
+        data = self.inner.latest_rates(base)
+        if data is not None:
+            self.write('latest', [base], data)
+        return data
+
+    def history_rates(self, session_date, base, quotes):
+        rates = self.inner.history_rates(session_date, base, quotes)
+        if rates:
+            self.write('history', [session_date, base, list(quotes)], rates)
+        return rates
+
+    def next_delay(self, elapsed):
+        return self.inner.next_delay(elapsed)
+
+class ReplayProvider:
+    """Serves a recording back one refresh cycle at a time
+
+    Each latest_rates call for a base returns that base's next recorded
+    table; next_delay sleeps the recorded gap divided by `speed`. History
+    is answered from the latest recorded entry for the base.
+    """
+    def __init__(self, path, speed=1):
+        self.speed = max(speed, 0.001)
+        self.latest = {}
+        self.history = {}
+        self.position = {}
+        self.lock = Lock()
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['kind'] == 'latest':
+                    self.latest.setdefault(record['args'][0], []).append((record['t'], record['data']))
+                else:
+                    self.history[record['args'][1]] = record['data']
+        logger.info(f"📼 Replaying {sum(len(v) for v in self.latest.values())} recorded tables from {path}")
+
+    def latest_rates(self, base):
+        with self.lock:
+            records = self.latest.get(base)
+            if not records:
+                return None
+            index = self.position.get(base, 0)
+            if index >= len(records):
+                return None
+            self.position[base] = index + 1
+            return records[index][1]
+
+    def history_rates(self, session_date, base, quotes):
+        return {q: r for q, r in self.history.get(base, {}).items() if q in quotes}
+
+    def finished(self):
+        return all(self.position.get(base, 0) >= len(records) for base, records in self.latest.items())
+
+    def next_delay(self, elapsed):
+        with self.lock:
+            records = self.latest.get(QUOTE_BASE, [])
+            index = self.position.get(QUOTE_BASE, 0)
+            if 0 < index < len(records):
+                gap = records[index][0] - records[index - 1][0]
+            else:
+                gap = UPDATE_INTERVAL
+        return max(0, gap / self.speed - elapsed)
+
+class SyntheticProvider:
+    """Random-walk rates around typical USD crosses, for offline runs and benchmarks
+
+    The walk steps once per tick (UPDATE_INTERVAL / speed seconds), not per
+    call, so every base fetched in one refresh cycle sees the same rates and
+    cross rates agree.
+    """
+    SEED_RATES = {
+        'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'JPY': 150.0, 'CHF': 0.88,
+        'AUD': 1.52, 'CAD': 1.36, 'NZD': 1.66, 'SEK': 10.5, 'NOK': 10.6,
+        'DKK': 6.87, 'PLN': 4.0, 'CZK': 23.0, 'HUF': 360.0, 'RON': 4.6,
+        'BGN': 1.8, 'TRY': 32.0, 'ZAR': 18.5, 'MXN': 17.0, 'BRL': 5.0,
+        'ILS': 3.7, 'SGD': 1.35, 'HKD': 7.82, 'CNY': 7.2, 'INR': 83.0,
+        'KRW': 1330.0, 'THB': 36.0, 'IDR': 15700.0, 'PHP': 56.0, 'MYR': 4.7,
+        'ISK': 138.0
+    }
+
+    def __init__(self, speed=1, volatility=0.0005, seed=None):
+        self.speed = max(speed, 0.001)
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.rates = dict(self.SEED_RATES)
+        self.tick_seconds = max(UPDATE_INTERVAL, 1) / self.speed
+        self.tick = None
+        self.lock = Lock()
+
+    def advance(self):
+        """Step the walk if a new tick started since the last call; call with lock held"""
+        tick = int(time.monotonic() / self.tick_seconds)
+        if tick == self.tick:
+            return
+        # Ticks nobody asked for are taken as one step of the same total variance
+        steps = tick - self.tick if self.tick is not None else 1
+        self.tick = tick
+        self.walk(steps)
+
+    def walk(self, steps=1):
+        sigma = self.volatility * steps ** 0.5
+        for currency in self.rates:
+            if currency != 'USD':
+                self.rates[currency] *= 1 + self.random.gauss(0, sigma)
+
+    def step(self):
+        """Move the walk one tick now, for drivers that run cycles back to back (benchmarks)"""
+        with self.lock:
+            self.walk()
+
+    def latest_rates(self, base):
+        with self.lock:
+            self.advance()
+            usd_per_base = self.rates.get(base)
+            if not usd_per_base:
+                return None
+            return {'base': base, 'time_last_updated': int(time.time()),
+                    'rates': {c: r / usd_per_base for c, r in self.rates.items()}}
+
+    def history_rates(self, session_date, base, quotes):
+        if base not in self.SEED_RATES:
+            return {}
+        return {q: self.SEED_RATES[q] / self.SEED_RATES[base] for q in quotes if q in self.SEED_RATES}
+
+    def next_delay(self, elapsed):
+        return max(0, UPDATE_INTERVAL / self.speed - elapsed)
+
+def create_market_provider(kind=MARKET_DATA_PROVIDER):
+    if kind == 'record':
+        return RecordingProvider(LiveProvider(), MARKET_DATA_FILE)
+    if kind == 'replay':
+        return ReplayProvider(MARKET_DATA_FILE, REPLAY_SPEED)
+    if kind == 'synthetic':
+        return SyntheticProvider(REPLAY_SPEED)
+    return LiveProvider()
+
+market_provider = create_market_provider()
+
+class RateSnapshot:
+    """One rate table as returned by the provider for a single base"""
+    def __init__(self, base, rates, fetched_at, provider_time=None, stale=False):
+        self.base = base
+        self.rates = rates
+        self.fetched_at = fetched_at
+        self.provider_time = provider_time
+        # True when the provider is failing and this is the last good table
+        self.stale = stale
+        self.id = f"{base}@{fetched_at.strftime('%Y%m%dT%H%M%S')}"
+
+    def covers(self, base, quote):
+        return all(c == self.base or c in self.rates for c in (base, quote))
+
+    def price(self, base, quote):
+        """Direct rate if base matches the table, otherwise a cross rate"""
+        base_rate = 1.0 if base == self.base else float(self.rates[base])
+        quote_rate = 1.0 if quote == self.base else float(self.rates[quote])
+        return quote_rate / base_rate
+
+def fetch_rate_snapshot(base):
+    """Fetch the full rate table for a base currency"""
+    data = market_provider.latest_rates(base)
+    if not data or 'rates' not in data:
         return None
-    except Exception as e:
-        logger.error(f"❌ Error fetching {base}/{quote}: {e}")
+    return RateSnapshot(base, data['rates'], datetime.now(), data.get('time_last_updated'), data.get('stale', False))
+
+def get_forex_quotes(pairs):
+    """Price every pair from the fewest rate snapshots possible
+
+    Returns {pair: (price, snapshot)}. Pairs the QUOTE_BASE table cannot
+    price fall back to a snapshot of their own base currency; those
+    fallback tables are fetched concurrently.
+    """
+    pairs = list(pairs)
+    snapshots = {QUOTE_BASE: fetch_rate_snapshot(QUOTE_BASE)}
+    
+    def covering(pair):
+        base = FOREX_PAIRS[pair]['base']
+        quote = FOREX_PAIRS[pair]['quote']
+        for snapshot in (snapshots.get(QUOTE_BASE), snapshots.get(base)):
+            if snapshot and snapshot.covers(base, quote):
+                return snapshot
         return None
+    
+    missing_bases = sorted({FOREX_PAIRS[p]['base'] for p in pairs if not covering(p)} - set(snapshots))
+    if missing_bases:
+        snapshots.update(zip(missing_bases, fetch_executor.map(fetch_rate_snapshot, missing_bases)))
+    
+    quotes = {}
+    for pair in pairs:
+        snapshot = covering(pair)
+        if not snapshot:
+            continue
+        try:
+            quotes[pair] = (snapshot.price(FOREX_PAIRS[pair]['base'], FOREX_PAIRS[pair]['quote']), snapshot)
+        except Exception as e:
+            logger.error(f"❌ Error pricing {pair}: {e}")
+    return quotes
+
+def get_forex_price(base, quote):
+    """Get current forex price"""
+    snapshot = fetch_rate_snapshot(QUOTE_BASE)
+    if not snapshot or not snapshot.covers(base, quote):
+        snapshot = fetch_rate_snapshot(base)
+    if snapshot and snapshot.covers(base, quote):
+        return snapshot.price(base, quote)
+    return None
+
+def previous_session_date(now=None):
+    """Date of the last completed weekday session at unix time `now` (17:00 New York rollover)"""
+    day = session_date_for(time.time() if now is None else now) - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day.strftime('%Y-%m-%d')
+
+class PrevSessionCache:
+    """Previous-session OHLC and CPR levels keyed by (pair, session date)
+
+    Entries are filled with one request per base currency, persisted to
+    PREV_SESSION_FILE so restarts don't refetch, and dropped when the
+    session date rolls over.
+    """
+    # Seconds to wait before retrying a session that failed to fill
+    RETRY_INTERVAL = 300
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        # (pair, session_date) -> when a fill for it was last tried
+        self.last_fill_attempt = {}
+        self.lock = Lock()
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                self.entries = {tuple(key.split('|', 1)): entry for key, entry in data.items()}
+                logger.info(f"✅ Loaded {len(self.entries)} cached previous-session entries")
+        except Exception as e:
+            logger.error(f"❌ Error loading previous-session cache: {e}")
+            self.entries = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({f"{pair}|{date}": entry for (pair, date), entry in self.entries.items()}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"❌ Error saving previous-session cache: {e}")
 
-def get_historical_data(pair):
+    def get(self, pair, session_date=None):
+        """Cached entry for a pair, filling it on a miss"""
+        session_date = session_date or previous_session_date()
+        self.prefetch([pair], session_date)
+        return self.entries.get((pair, session_date))
+
+    def prefetch(self, pairs, session_date=None):
+        """Fill every missing pair of `pairs` at once, one request per base"""
+        session_date = session_date or previous_session_date()
+        now = time.time()
+        with self.lock:
+            missing = [pair for pair in pairs if (pair, session_date) not in self.entries]
+            if not missing:
+                return
+            self.roll_over(session_date)
+            due = [pair for pair in missing
+                   if now - self.last_fill_attempt.get((pair, session_date), 0) >= self.RETRY_INTERVAL]
+            if due:
+                self.last_fill_attempt.update({(pair, session_date): now for pair in due})
+                self.fill(session_date, due)
+
+    def roll_over(self, session_date):
+        """Drop entries from any other session"""
+        stale = [key for key in self.entries if key[1] != session_date]
+        for key in stale:
+            del self.entries[key]
+        self.last_fill_attempt = {key: t for key, t in self.last_fill_attempt.items() if key[1] == session_date}
+        if stale:
+            logger.info(f"🗓️ Previous session rolled over to {session_date}")
+
+    def fill(self, session_date, pairs):
+        """Fetch the given pairs for a session, one request per base"""
+        by_base = {}
+        for pair in pairs:
+            by_base.setdefault(FOREX_PAIRS[pair]['base'], []).append(pair)
+        
+        def fetch(base):
+            quotes = sorted({FOREX_PAIRS[p]['quote'] for p in by_base[base]})
+            return market_provider.history_rates(session_date, base, quotes)
+        
+        filled = 0
+        bases = list(by_base)
+        for base, rates in zip(bases, fetch_executor.map(fetch, bases)):
+            for pair in by_base[base]:
+                quote = FOREX_PAIRS[pair]['quote']
+                if quote in rates:
+                    self.entries[(pair, session_date)] = self.make_entry(pair, float(rates[quote]))
+                    filled += 1
+        
+        if filled:
+            self.save()
+            logger.info(f"📅 Cached {filled} previous-session closes for {session_date}")
+
+    def make_entry(self, pair, prev_close):
+        spread = FOREX_PAIRS[pair]['range']
+        prev_high = prev_close * (1 + spread)
+        prev_low = prev_close * (1 - spread)
+        return {
+            'prev_high': prev_high,
+            'prev_low': prev_low,
+            'prev_close': prev_close,
+            'levels': calculate_cpr(prev_high, prev_low, prev_close)
+        }
+
+prev_session_cache = PrevSessionCache(PREV_SESSION_FILE)
+
+def get_historical_data(pair, current=None):
     """Get historical data for a pair"""
     try:
         pair_info = FOREX_PAIRS[pair]
         base = pair_info['base']
         quote = pair_info['quote']
         
-        current = get_forex_price(base, quote)
+        if current is None:
+            current = get_forex_price(base, quote)
         if not current:
             return None
         
-        yesterday = (datetime.today() - timedelta(days=1)).strftime('%Y-%m-%d')
+        entry = prev_session_cache.get(pair)
+        if not entry:
+            # Not cached so the next cycle retries the fetch
+            entry = prev_session_cache.make_entry(pair, current * 0.999)
         
-        if base == 'USD':
-            url_hist = f"https://api.frankfurter.app/{yesterday}?from={base}&to={quote}"
+        return {
+            'current': current,
+            'prev_high': entry['prev_high'],
+            'prev_low': entry['prev_low'],
+            'prev_close': entry['prev_close'],
+            'levels': entry['levels']
+        }
+    except Exception as e:
+        logger.error(f"❌ Error getting historical data for {pair}: {e}")
+        return None
+
+# ============================================
+# EMA CALCULATIONS
+# ============================================
+def calculate_ema(prices, period):
+    """Calculate EMA over a full price list
+
+    Batch reference for EMAState: both give the same value for the same
+    prices.
+    """
+    if len(prices) < period:
+        return None
+    k = 2 / (period + 1)
+    ema = sum(prices[:period]) / period
+    for price in prices[period:]:
+        ema = (price * k) + (ema * (1 - k))
+    return ema
+
+def update_ema_values(pair, price):
+    """Feed the latest price into a pair's indicators; returns (ema_8, ema_20)"""
+    indicators = indicator_sets[pair]
+    indicators.update(price)
+    return indicators.value('ema_8'), indicators.value('ema_20')
+
+# ============================================
+# CPR CALCULATIONS
+# ============================================
+def calculate_cpr(high, low, close):
+    """Calculate CPR levels"""
+    pivot = (high + low + close) / 3.0
+    bc = (high + low) / 2.0
+    tc = pivot - bc + pivot
+    
+    r1 = 2 * pivot - low
+    s1 = 2 * pivot - high
+    r2 = pivot + (high - low)
+    s2 = pivot - (high - low)
+    r3 = high + 2 * (pivot - low)
+    s3 = low - 2 * (high - pivot)
+    
+    return {
+        'pivot': pivot, 'tc': tc, 'bc': bc,
+        'r1': r1, 'r2': r2, 'r3': r3,
+        's1': s1, 's2': s2, 's3': s3
+    }
+
+def calculate_camarilla(high, low, close):
+    """CPR band with Camarilla resistance/support (H1-H3, L1-L3)"""
+    levels = calculate_cpr(high, low, close)
+    spread = (high - low) * 1.1
+    levels.update(
+        r1=close + spread / 12, r2=close + spread / 6, r3=close + spread / 4,
+        s1=close - spread / 12, s2=close - spread / 6, s3=close - spread / 4
+    )
+    return levels
+
+def calculate_fibonacci_pivots(high, low, close):
+    """CPR band with Fibonacci resistance/support (38.2%, 61.8%, 100% of range)"""
+    levels = calculate_cpr(high, low, close)
+    pivot = levels['pivot']
+    spread = high - low
+    levels.update(
+        r1=pivot + 0.382 * spread, r2=pivot + 0.618 * spread, r3=pivot + spread,
+        s1=pivot - 0.382 * spread, s2=pivot - 0.618 * spread, s3=pivot - spread
+    )
+    return levels
+
+PIVOT_METHODS = {
+    'classic': calculate_cpr,
+    'camarilla': calculate_camarilla,
+    'fibonacci': calculate_fibonacci_pivots,
+}
+
+# classify_signal is in strategy.py, shared with backtest.py
+def get_trading_signal(pair, market=None, periods=(8, 20)):
+    """Generate trading signal for a pair (from `market` if a snapshot is pinned)
+
+    `periods` only labels the EMAs; the values are market.ema_8/ema_20.
+    """
+    market = market or get_market(pair)
+    fast, slow = periods
+    price = market.current_price
+    
+    if price == 0 or market.pivot == 0:
+        return "WAIT", "⏳ Calculating levels..."
+    if market.ema_8 <= 0 or market.ema_20 <= 0:
+        # An EMA of 0 is one still warming up, not a price to compare against
+        return "WAIT", f"⏳ Warming up the {fast}/{slow} EMAs..."
+    
+    distance = (price - market.pivot) / pip_size(pair)
+    unit = "pips"
+    
+    ema_signal = ""
+    if market.ema_8 > 0 and market.ema_20 > 0:
+        if price > market.ema_8:
+            ema_signal = f"📈 Breakout: Above {fast} EMA"
         else:
-            url_hist = f"https://api.frankfurter.app/{yesterday}?from={base}&to={quote}"
+            ema_signal = f"📉 Breakout: Below {fast} EMA"
         
-        response = requests.get(url_hist, timeout=10)
+        if price > market.ema_20:
+            ema_signal += f"\n📊 Trend: Bullish (Above {slow} EMA)"
+        else:
+            ema_signal += f"\n📊 Trend: Bearish (Below {slow} EMA)"
+    
+    signal = classify_signal(price, market.pivot, market.tc, market.bc,
+                             market.r1, market.s1, market.ema_8, market.ema_20)
+    
+    if signal == "STRONG BUY":
+        return signal, f"🟢 Price above TC, R1 and both EMAs\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
+    elif signal == "BUY":
+        return signal, f"🟢 Price above TC and {fast} EMA\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
+    elif signal == "BUY (Weak)":
+        return signal, f"🟡 Price above TC but below {fast} EMA\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
+    elif signal == "STRONG SELL":
+        return signal, f"🔴 Price below BC, S1 and both EMAs\n{ema_signal}\n{distance:.1f} {unit} from pivot"
+    elif signal == "SELL":
+        return signal, f"🔴 Price below BC and {fast} EMA\n{ema_signal}\n{distance:.1f} {unit} from pivot"
+    elif signal == "SELL (Weak)":
+        return signal, f"🟡 Price below BC but above {fast} EMA\n{ema_signal}\n{distance:.1f} {unit} from pivot"
+    elif signal == "NEUTRAL (Bullish)":
+        return signal, f"⚪ In CPR, above pivot & {fast} EMA\n{ema_signal}\n+{distance:.1f} {unit}"
+    elif signal == "NEUTRAL (Bearish)":
+        return signal, f"⚪ In CPR, below pivot & {fast} EMA\n{ema_signal}\n{distance:.1f} {unit}"
+    else:
+        return signal, f"⚪ In CPR zone\n{ema_signal}\n{distance:+.1f} {unit}"
+
+# ============================================
+# CUSTOM INDICATORS
+# ============================================
+# Settings are (fast EMA, slow EMA, pivot method); stored per chat only when they differ
+DEFAULT_SETTINGS = (8, 20, 'classic')
+EMA_PERIOD_LIMITS = (2, 200)
+
+class IndicatorCache:
+    """Shared, memoized results for per-user indicator settings
+
+    Keys are (pair, indicator, params, snapshot version), so every chat with
+    the same settings shares one computation per update instead of paying
+    for it per request. Entries are kept in LRU order: the least recently
+    used goes once `maxsize` is reached, and anything not read for `ttl`
+    seconds is dropped, so parameter sets nobody uses any more (and old
+    snapshot versions) age out.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = Lock()
+
+    def get(self, key, compute):
+        """Cached value for `key`; concurrent misses on one key share a single compute()"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (entry[0], now)
+                self.entries.move_to_end(key)
+                INDICATOR_CACHE_LOOKUPS.inc(result='hit')
+                return entry[0]
+            in_flight = self.pending.get(key)
+            if in_flight is None:
+                self.pending[key] = future = Future()
+        if in_flight is not None:
+            INDICATOR_CACHE_LOOKUPS.inc(result='wait')
+            return in_flight.result()
         
-        if response.status_code == 200:
-            hist_data = response.json()
-            if 'rates' in hist_data and quote in hist_data['rates']:
-                prev_close = float(hist_data['rates'][quote])
+        INDICATOR_CACHE_LOOKUPS.inc(result='miss')
+        try:
+            value = compute()
+        except Exception as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.entries[key] = (value, now)
+            self.entries.move_to_end(key)
+            del self.pending[key]
+            self.expire(now)
+        future.set_result(value)
+        return value
+
+    def expire(self, now):
+        """Drop idle entries from the LRU end, then trim to maxsize"""
+        while self.entries:
+            _, last_used = next(iter(self.entries.values()))
+            if now - last_used < self.ttl:
+                break
+            self.entries.popitem(last=False)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+indicator_cache = IndicatorCache(INDICATOR_CACHE_SIZE, INDICATOR_CACHE_TTL)
+INDICATOR_CACHE_ENTRIES = Gauge('forexbot_indicator_cache_entries', 'Entries in the custom indicator cache',
+                                function=lambda: {(): len(indicator_cache)})
+
+def user_settings(chat_id):
+    """(fast EMA, slow EMA, pivot method) for a chat"""
+    saved = subscribers.get(chat_id, {}).get('settings')
+    if not saved:
+        return DEFAULT_SETTINGS
+    fast, slow = saved.get('ema', DEFAULT_SETTINGS[:2])
+    return (fast, slow, saved.get('pivots', DEFAULT_SETTINGS[2]))
+
+def custom_ema(market, period):
+    """EMA of `period` for a snapshot, from a streamed EMAState
+
+    Periods in some chat's /settings are streamed on the pairs that chat
+    watches (see track_custom_emas): the next update warms the state up
+    from price history and then feeds it every tick, like the built-in
+    EMAs. Anything else (a pair viewed without watching it, or a period
+    not streamed yet) is computed from the snapshot's recent history,
+    which is what a new state would start from. 0 while warming up (or on
+    a follower until the leader publishes it), like IndicatorSet.value;
+    that is never cached.
+    """
+    streamed = (market.indicators or {}).get(f'ema_{period}')
+    if streamed is not None:
+        return streamed
+    if len(market.history) < period:
+        return 0
+    return indicator_cache.get(
+        (market.pair, 'ema', period, market.version),
+        lambda: calculate_ema(market.history, period)
+    )
+
+# EMA periods IndicatorSet streams for every pair anyway
+BASE_EMA_PERIODS = {period for kind, period in INDICATORS.values() if kind == 'ema'}
+# (pair, period) -> chats whose settings use that EMA on a pair they watch,
+# and chat_id -> the (pair, period) it counts towards
+custom_ema_refs = {}
+custom_emas_by_chat = {}
+
+def track_custom_emas(chat_id, watching):
+    """Stream custom EMAs while some chat's settings use them on a watched pair
+
+    Called from index_subscriber (with alert_index_lock held), so settings
+    changes, subscriber sync from other processes and startup all count.
+    A period that loses its last chat stops being streamed on that pair.
+    """
+    fast, slow, _ = user_settings(chat_id) if chat_id in subscribers else DEFAULT_SETTINGS
+    periods = {fast, slow} - BASE_EMA_PERIODS
+    wanted = {(pair, period) for pair in watching for period in periods}
+    previous = custom_emas_by_chat.get(chat_id, set())
+    for pair, period in previous - wanted:
+        custom_ema_refs[(pair, period)] -= 1
+        if not custom_ema_refs[(pair, period)]:
+            del custom_ema_refs[(pair, period)]
+            indicator_sets[pair].release('ema', period)
+    for pair, period in wanted - previous:
+        custom_ema_refs[(pair, period)] = custom_ema_refs.get((pair, period), 0) + 1
+        if custom_ema_refs[(pair, period)] == 1:
+            indicator_sets[pair].request('ema', period)
+    if wanted:
+        custom_emas_by_chat[chat_id] = wanted
+    else:
+        custom_emas_by_chat.pop(chat_id, None)
+
+def custom_levels(market, method):
+    """Pivot levels by `method` from the snapshot's previous session"""
+    return indicator_cache.get(
+        (market.pair, 'pivots', method, market.version),
+        lambda: PIVOT_METHODS[method](market.prev_high, market.prev_low, market.prev_close)
+    )
+
+def personalize(market, settings):
+    """The snapshot as seen with `settings`; ema_8/ema_20 carry the fast/slow EMA"""
+    fast, slow, pivots = settings
+    changes = {'ema_8': custom_ema(market, fast), 'ema_20': custom_ema(market, slow)}
+    if pivots != 'classic' and market.pivot:
+        changes.update(custom_levels(market, pivots))
+    return market.derive(**changes)
+
+# ============================================
+# UPDATE MARKET DATA
+# ============================================
+# Serializes writers (refresh cycles, snapshot save/restore); readers never take it
+market_lock = Lock()
+last_market_update = None
+
+def pair_staleness():
+    now = datetime.now()
+    return {(pair,): round((now - m.last_update).total_seconds(), 3)
+            for pair, m in market_data.items() if m.last_update}
+
+PAIR_STALENESS = Gauge('forexbot_pair_staleness_seconds', 'Seconds since each pair was last updated',
+                       ('pair',), function=pair_staleness)
+
+def update_market_data(pair, quote=None):
+    """Update data for a specific pair
+
+    `quote` is a (price, snapshot) tuple from get_forex_quotes; without it
+    the price is fetched for this pair alone.
+    """
+    try:
+        price, snapshot = quote if quote else (None, None)
+        data = get_historical_data(pair, current=price)
+        if not data:
+            return False
+        
+        price = data['current']
+        now = time.time()
+        indicator_sets[pair].start_requested(price_history[pair])
+        price_history[pair].append(price)
+        builder = bar_builders[pair]
+        builder.add_tick(price, now)
+        try:
+            tick_archive.append(pair, now, price)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not archive {pair} tick: {e}")
+        
+        # Prefer the real previous session built from our own ticks
+        session = builder.previous_session('1d')
+        if session:
+            prev = {'prev_high': session['high'], 'prev_low': session['low'], 'prev_close': session['close']}
+            cpr_source = 'session'
+            levels = builder.cpr('1d')
+        else:
+            prev = {'prev_high': data['prev_high'], 'prev_low': data['prev_low'], 'prev_close': data['prev_close']}
+            cpr_source = 'estimate'
+            levels = data['levels']
+        
+        ema_8, ema_20 = update_ema_values(pair, price)
+        
+        # Publish everything from this update in one assignment
+        market = get_market(pair).replace(
+            current_price=price,
+            price_source=snapshot.id if snapshot else None,
+            stale=snapshot.stale if snapshot else False,
+            cpr_source=cpr_source,
+            weekly_cpr=builder.cpr('1w'),
+            monthly_cpr=builder.cpr('1M'),
+            ema_8=ema_8,
+            ema_20=ema_20,
+            indicators=indicator_sets[pair].values(),
+            history=tuple(price_history[pair]),
+            last_update=datetime.now(),
+            **prev,
+            **levels
+        )
+        market_data[pair] = market
+        
+        global last_market_update
+        last_market_update = market.last_update
+        
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error updating {pair}: {e}")
+        return False
+
+def refresh_market_data(pairs=None):
+    """Fetch everything a cycle needs concurrently, then apply it at once
+
+    Refreshes `pairs`, or by default every pair at least one chat watches.
+    Returns the list of pairs that were updated. Fetches that miss
+    REFRESH_DEADLINE are dropped for this cycle.
+    """
+    pairs = list(pairs) if pairs is not None else watched_pairs()
+    if not pairs:
+        return []
+    quotes_future = refresh_executor.submit(get_forex_quotes, pairs)
+    history_future = refresh_executor.submit(prev_session_cache.prefetch, pairs)
+    _, not_done = wait([quotes_future, history_future], timeout=REFRESH_DEADLINE)
+    if not_done:
+        logger.warning(f"⚠️ Refresh fetches missed the {REFRESH_DEADLINE:.0f}s deadline")
+        return []
+    quotes = quotes_future.result()
+    
+    updated = []
+    alerts = []
+    with market_lock:
+        for pair in pairs:
+            if pair not in quotes:
+                logger.warning(f"⚠️ No quote for {pair} this cycle")
+                continue
+            if update_market_data(pair, quotes[pair]):
+                updated.append(pair)
+                alerts.extend(check_alerts(pair))
+    
+    render_level_messages(updated)
+    dispatch_alerts(alerts)
+    update_live_digests(updated)
+    if updated and cluster_role == 'leader':
+        publish_shared_market()
+    return updated
+
+# Pairs someone asked for before they had data, refreshed off the monitor loop
+on_demand_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='on-demand')
+# pair -> future of the on-demand refresh that will fetch it
+on_demand_pending = {}
+on_demand_lock = Lock()
+
+def needs_refresh(pair, market=None):
+    """No levels yet, or a pair nobody watches whose on-demand data is a cycle old
+
+    Watched pairs are kept fresh by the monitor loop; the others are only
+    fetched when someone asks, so a request must check their age.
+    """
+    market = market or get_market(pair)
+    if market.pivot == 0 or not market.last_update:
+        return True
+    if pair in pair_watchers:
+        return False
+    return (datetime.now() - market.last_update).total_seconds() > UPDATE_INTERVAL
+
+def request_refresh(pairs):
+    """Refresh pairs that need it without waiting for the next cycle
+
+    Returns the futures of the on-demand refreshes that will fetch any of
+    `pairs`, including ones already running; empty if none is needed here
+    (fresh data, or left to the leader).
+    """
+    if cluster_role == 'follower':
+        # Only the leader talks to the provider; it picks these up on its next sync
+        subscriber_store.request_pairs([pair for pair in pairs if needs_refresh(pair)])
+        return []
+    
+    def run(new):
+        try:
+            refresh_market_data(new)
+        finally:
+            with on_demand_lock:
+                for pair in new:
+                    on_demand_pending.pop(pair, None)
+    
+    with on_demand_lock:
+        futures = {on_demand_pending[pair] for pair in pairs if pair in on_demand_pending}
+        new = [pair for pair in pairs if pair not in on_demand_pending and needs_refresh(pair)]
+        if new:
+            future = on_demand_executor.submit(run, new)
+            on_demand_pending.update(dict.fromkeys(new, future))
+            futures.add(future)
+    return list(futures)
+
+def when_fresh(pairs, reply):
+    """Call `reply` once stale `pairs` are refreshed: right away if none are
+
+    Handlers return straight after this; if a refresh is needed, `reply`
+    runs on the refresh thread when it finishes (or fails) and queues its
+    messages from there.
+    """
+    pending = set(request_refresh([pair for pair in pairs if needs_refresh(pair)]))
+    if not pending:
+        reply()
+        return
+    lock = Lock()
+    
+    def done(future):
+        with lock:
+            pending.discard(future)
+            if pending:
+                return
+        try:
+            reply()
+        except Exception as e:
+            logger.error(f"❌ Error replying after on-demand refresh: {e}")
+    
+    for future in list(pending):
+        future.add_done_callback(done)
+
+# ============================================
+# MARKET SNAPSHOT
+# ============================================
+last_snapshot_time = 0
+
+def market_state():
+    """Everything needed to resume where we stopped, as JSON-ready dicts"""
+    pairs = {}
+    with market_lock:
+        for pair, market in market_data.items():
+            if not market.last_update:
+                continue
+            pairs[pair] = {
+                'market': {field: getattr(market, field) for field in SNAPSHOT_FIELDS},
+                'last_update': market.last_update.timestamp(),
+                'indicators': indicator_sets[pair].to_dict(),
+                'price_history': list(price_history[pair]),
+                'bars': {tf: series.bars() for tf, series in bar_builders[pair].series.items()},
+            }
+    return {'saved_at': time.time(), 'pairs': pairs}
+
+def save_market_snapshot(path=MARKET_SNAPSHOT_FILE):
+    """Write the snapshot atomically (temp file + rename)"""
+    global last_snapshot_time
+    try:
+        snapshot = market_state()
+        if not snapshot['pairs']:
+            return False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        last_snapshot_time = time.monotonic()
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error saving market snapshot: {e}")
+        return False
+
+def maybe_save_market_snapshot():
+    if time.monotonic() - last_snapshot_time >= SNAPSHOT_INTERVAL:
+        save_market_snapshot()
+
+def restore_market_snapshot(path=MARKET_SNAPSHOT_FILE):
+    """Load a saved snapshot before the first refresh; returns the restored pairs
+
+    Bars are always restored (they carry their own timestamps). Prices,
+    indicators and recent history only if the snapshot is younger than
+    SNAPSHOT_MAX_AGE, and CPR levels only if it is from the current session.
+    """
+    global last_market_update
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        logger.error(f"❌ Ignoring unreadable market snapshot: {e}")
+        return []
+    
+    now = time.time()
+    saved_at = snapshot.get('saved_at', 0)
+    fresh = now - saved_at <= SNAPSHOT_MAX_AGE
+    same_session = session_date_for(saved_at) == session_date_for(now)
+    
+    restored = []
+    with market_lock:
+        for pair, saved in snapshot.get('pairs', {}).items():
+            if pair not in FOREX_PAIRS:
+                continue
+            builder = bar_builders[pair]
+            for timeframe, bars in saved.get('bars', {}).items():
+                if timeframe in builder.series:
+                    builder.series[timeframe].load([tuple(bar) for bar in bars])
+            if not fresh:
+                continue
+            
+            indicators = indicator_sets[pair]
+            price_history[pair].extend(saved['price_history'])
+            if not indicators.restore(saved['indicators']):
+                indicators.warm_up(price_history[pair])
+            
+            fields = {k: v for k, v in saved['market'].items() if k in SNAPSHOT_FIELDS}
+            if not same_session:
+                fields = {k: v for k, v in fields.items() if k == 'current_price'}
+            fields.update(
+                ema_8=indicators.value('ema_8'),
+                ema_20=indicators.value('ema_20'),
+                indicators=indicators.values(),
+                history=tuple(price_history[pair]),
+                price_source='snapshot',
+                last_update=datetime.fromtimestamp(saved['last_update'])
+            )
+            market = get_market(pair).replace(**fields)
+            market_data[pair] = market
+            last_market_update = max(last_market_update or market.last_update, market.last_update)
+            restored.append(pair)
+    
+    render_level_messages([pair for pair in restored if market_data[pair].pivot])
+    logger.info(f"♻️ Restored {len(restored)} pairs from a {now - saved_at:.0f}s old market snapshot")
+    return restored
+
+# ============================================
+# CLUSTER MODE
+# ============================================
+# 'standalone' unless LEADER_LOCK_FILE is set; then 'follower' until elected
+cluster_role = 'follower' if LEADER_LOCK_FILE else 'standalone'
+shared_market_seen = None
+shared_market_lock = Lock()
+
+class LeaderLock:
+    """Exclusive flock on a file; the OS releases it when the holder dies"""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def try_acquire(self):
+        """Non-blocking; True once this process holds the lock"""
+        if self.fd is not None:
+            return True
+        import fcntl
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.fd = fd
+        return True
+
+leader_lock = LeaderLock(LEADER_LOCK_FILE) if LEADER_LOCK_FILE else None
+
+# Snapshot fields followers get. Price history stays with the leader: custom
+# EMAs arrive in `indicators` and charts read the shared tick archive.
+SHARED_FIELDS = tuple(field for field in MarketSnapshot.FIELDS if field not in ('pair', 'history'))
+# pair -> (version, JSON member) last written for it
+shared_fragments = {}
+
+def shared_fragment(pair, market):
+    """'"pair":{...}' for the shared file, serialized once per snapshot version"""
+    cached = shared_fragments.get(pair)
+    if cached and cached[0] == market.version:
+        return cached[1]
+    fields = {field: getattr(market, field) for field in SHARED_FIELDS}
+    fields['last_update'] = market.last_update.timestamp()
+    fragment = json.dumps(pair) + ':' + json.dumps(fields, separators=(',', ':'))
+    shared_fragments[pair] = (market.version, fragment)
+    return fragment
+
+def publish_shared_market(path=SHARED_MARKET_FILE):
+    """Leader: write every published snapshot for the followers (temp file + rename)
+
+    Only pairs whose version changed since the last publish are serialized
+    again; the rest reuse their previous JSON.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with shared_market_lock:
+            members = [shared_fragment(pair, market) for pair, market in list(market_data.items())
+                       if market.last_update]
+            with open(tmp_path, 'w') as f:
+                f.write(f'{{"published_at":{time.time()!r},"leader":{os.getpid()},"pairs":{{')
+                f.write(','.join(members))
+                f.write('}}')
+            os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"❌ Error publishing shared market data: {e}")
+
+def load_shared_market(path=SHARED_MARKET_FILE):
+    """Follower: mirror the leader's snapshots if the file changed; returns updated pairs
+
+    Snapshots keep the leader's version numbers, so messages and API
+    bodies cached per version stay consistent across processes.
+    """
+    global shared_market_seen, last_market_update
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return []
+    seen = (stat.st_mtime_ns, stat.st_size)
+    if seen == shared_market_seen:
+        return []
+    with open(path) as f:
+        shared = json.load(f)
+    shared_market_seen = seen
+    
+    updated = []
+    with market_lock:
+        for pair, fields in shared.get('pairs', {}).items():
+            current = market_data.get(pair)
+            if pair not in FOREX_PAIRS or (current and current.version >= fields['version']):
+                continue
+            fields['last_update'] = datetime.fromtimestamp(fields['last_update'])
+            market = MarketSnapshot(pair=pair, **fields)
+            market_data[pair] = market
+            last_market_update = max(last_market_update or market.last_update, market.last_update)
+            updated.append(pair)
+    render_level_messages(updated)
+    return updated
+
+def sync_subscribers():
+    """Apply subscriber changes other processes wrote"""
+    changed = subscriber_store.changes()
+    for chat_id, user in changed.items():
+        subscribers[chat_id] = user
+        index_subscriber(chat_id)
+    if changed:
+        logger.info(f"🔁 Synced {len(changed)} subscriber changes from other processes")
+
+def cluster_loop():
+    """Follow the leader's snapshots until we win the lock, then lead"""
+    global cluster_role
+    logger.info(f"🗳️ Cluster mode, leader lock {LEADER_LOCK_FILE}")
+    while True:
+        try:
+            sync_subscribers()
+            if cluster_role == 'follower' and leader_lock.try_acquire():
+                cluster_role = 'leader'
+                logger.info(f"👑 Elected market-data leader (pid {os.getpid()})")
+                start_leader()
+            elif cluster_role == 'leader':
+                requested = subscriber_store.take_requested_pairs()
+                if requested:
+                    request_refresh(requested)
             else:
-                prev_close = current * 0.999
+                load_shared_market()
+        except Exception as e:
+            logger.error(f"❌ Cluster sync error: {e}")
+        time.sleep(CLUSTER_SYNC_INTERVAL)
+
+# ============================================
+# ALERTS
+# ============================================
+ALERT_LEVELS = {
+    'r3': 'R3', 'r2': 'R2', 'r1': 'R1',
+    'tc': 'TC', 'pivot': 'Pivot', 'bc': 'BC',
+    's1': 'S1', 's2': 'S2', 's3': 'S3',
+    'ema_8': '8 EMA', 'ema_20': '20 EMA'
+}
+
+# Which side of each level the price was last seen on: {pair: {level: +1/-1}}
+alert_sides = defaultdict(dict)
+# Pivot the sides were recorded against, so a new session resets them quietly
+alert_session_pivot = {}
+# When each level last alerted: {pair: {level: datetime}}
+alert_last_sent = defaultdict(dict)
+
+# pair -> chat_ids with alerts enabled that watch the pair
+alert_index = {}
+# chat_id -> pairs it is currently indexed under
+alert_index_pairs = {}
+alert_index_lock = Lock()
+# chat_id -> pairs it watches, and pair -> number of chats watching it;
+# refresh_market_data only fetches pairs in pair_watchers
+watched_by_chat = {}
+pair_watchers = {}
+# Chats with a live /levels digest; refresh cycles only look at these
+live_chats = set()
+
+SUBSCRIBER_COUNT = Gauge('forexbot_subscribers', 'Known chats', function=lambda: {(): len(subscribers)})
+ACTIVE_SUBSCRIBER_COUNT = Gauge('forexbot_subscribers_with_pairs', 'Chats with at least one pair selected',
+                                function=lambda: {(): len(watched_by_chat)})
+ALERT_SUBSCRIBER_COUNT = Gauge('forexbot_alert_subscribers', 'Chats with alerts enabled on at least one pair',
+                               function=lambda: {(): len(alert_index_pairs)})
+
+def index_subscriber(chat_id):
+    """Re-index one chat after its alerts flag or pair selection changed"""
+    user = subscribers.get(chat_id)
+    watching = {p for p in user['pairs'] if p in FOREX_PAIRS} if user else set()
+    wanted = watching if user and user.get('alerts') else set()
+    with alert_index_lock:
+        previous = set(watched_by_chat.get(chat_id, ()))
+        for pair in previous - watching:
+            pair_watchers[pair] -= 1
+            if not pair_watchers[pair]:
+                del pair_watchers[pair]
+        for pair in watching - previous:
+            pair_watchers[pair] = pair_watchers.get(pair, 0) + 1
+        if watching:
+            # A tuple is a third the size of a set, and there is one per chat
+            watched_by_chat[chat_id] = tuple(watching)
+        else:
+            watched_by_chat.pop(chat_id, None)
+        
+        current = alert_index_pairs.get(chat_id, set())
+        for pair in current - wanted:
+            alert_index[pair].discard(chat_id)
+            if not alert_index[pair]:
+                del alert_index[pair]
+        for pair in wanted - current:
+            alert_index.setdefault(pair, set()).add(chat_id)
+        if wanted:
+            alert_index_pairs[chat_id] = wanted
+        else:
+            alert_index_pairs.pop(chat_id, None)
+        
+        if user and user.get('live'):
+            live_chats.add(chat_id)
+        else:
+            live_chats.discard(chat_id)
+        
+        track_custom_emas(chat_id, watching)
+
+def rebuild_alert_index():
+    with alert_index_lock:
+        alert_index.clear()
+        alert_index_pairs.clear()
+        watched_by_chat.clear()
+        pair_watchers.clear()
+        live_chats.clear()
+        streamed = set(custom_ema_refs)
+        custom_ema_refs.clear()
+        custom_emas_by_chat.clear()
+    for chat_id in list(subscribers):
+        index_subscriber(chat_id)
+    for pair, period in streamed - set(custom_ema_refs):
+        indicator_sets[pair].release('ema', period)
+
+def watched_pairs():
+    """Pairs at least one chat has selected, in registry order"""
+    with alert_index_lock:
+        pairs = list(pair_watchers)
+    return sorted(pairs, key=SYMBOL_INDEX.get)
+
+def check_alerts(pair):
+    """Levels the latest price crossed, beyond the hysteresis band and off cooldown
+
+    Returns a list of (pair, level, direction, level_price, price).
+    """
+    market = market_data[pair]
+    price = market.current_price
+    if price == 0 or market.pivot == 0:
+        return []
+    
+    sides = alert_sides[pair]
+    if alert_session_pivot.get(pair) != market.pivot:
+        sides.clear()
+        alert_session_pivot[pair] = market.pivot
+    
+    band = ALERT_HYSTERESIS_PIPS * pip_size(pair)
+    now = datetime.now()
+    crossings = []
+    for level in ALERT_LEVELS:
+        level_price = getattr(market, level)
+        if not level_price:
+            continue
+        if price > level_price + band:
+            side = 1
+        elif price < level_price - band:
+            side = -1
         else:
-            prev_close = current * 0.999
+            continue
         
-        if 'JPY' in pair:
-            prev_high = prev_close * 1.005
-            prev_low = prev_close * 0.995
+        previous = sides.get(level)
+        sides[level] = side
+        if previous is None or previous == side:
+            continue
+        
+        last_alert = alert_last_sent[pair].get(level)
+        if last_alert and (now - last_alert).total_seconds() < ALERT_COOLDOWN:
+            continue
+        alert_last_sent[pair][level] = now
+        ALERTS_TRIGGERED.inc(pair=pair)
+        crossings.append((pair, level, 'above' if side > 0 else 'below', level_price, price))
+    return crossings
+
+def dispatch_alerts(alerts):
+    """Send each crossing to the chats indexed under its pair"""
+    for pair, level, direction, level_price, price in alerts:
+        with alert_index_lock:
+            chat_ids = list(alert_index.get(pair, ()))
+        if not chat_ids:
+            continue
+        
+        price_fmt = price_format(pair)
+        arrow = "🔺" if direction == 'above' else "🔻"
+        text = (f"🔔 *{pair} ALERT*\n"
+                f"{arrow} Price crossed {direction} {ALERT_LEVELS[level]} ({level_price:{price_fmt}})\n"
+                f"💱 Current: {price:{price_fmt}}")
+        logger.info(f"🔔 {pair} crossed {direction} {ALERT_LEVELS[level]}, notifying {len(chat_ids)} chats")
+        for chat_id in chat_ids:
+            enqueue_message(chat_id, text, priority=PRIORITY_ALERT, coalesce=True, parse_mode='Markdown')
+        ALERTS_QUEUED.inc(len(chat_ids))
+
+rebuild_alert_index()
+
+# ============================================
+# OUTBOUND MESSAGES
+# ============================================
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ALERT = 1
+
+# Telegram rejects longer messages, coalescing stops short of it
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    """Allows `rate` events per second with bursts up to `capacity`"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+class OutboundMessage:
+    def __init__(self, chat_id, text, priority, coalesce, kwargs, sequence, photo=None, edit=None, on_done=None):
+        self.chat_id = chat_id
+        self.sequence = sequence
+        self.text = text
+        self.priority = priority
+        self.coalesce = coalesce
+        self.kwargs = kwargs
+        self.photo = photo
+        self.edit = edit
+        self.on_done = on_done
+        self.attempts = 0
+
+    def finish(self, sent, error=None):
+        """Report the sent Message, or None and the last error if we gave up, to whoever queued this"""
+        if self.on_done:
+            try:
+                self.on_done(sent, error)
+            except Exception as e:
+                logger.error(f"❌ Error in send callback for {self.chat_id}: {e}")
+
+class ChatQueue:
+    """Pending messages for one chat plus its per-chat rate limit state"""
+    def __init__(self):
+        self.messages = []
+        self.next_allowed = 0
+        self.scheduled = False
+        self.in_flight = False
+        # (priority, sequence) of this chat's live entry on the ready heap
+        self.ready_key = None
+
+class SendScheduler:
+    """Outbound queue drained by worker threads under Telegram's limits
+
+    A global token bucket caps total sends; each chat is sent to at most
+    once per SEND_PER_CHAT_INTERVAL. Chats are served by the priority of
+    their most urgent message, so interactive replies go out before alert
+    broadcasts. Consecutive coalescable messages to a chat are merged into
+    one send.
+    """
+    def __init__(self, workers, global_rate, per_chat_interval):
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.global_bucket = TokenBucket(global_rate)
+        self.cond = Condition()
+        self.chats = {}
+        self.ready = []
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        for i in range(self.workers):
+            thread = Thread(target=self.worker_loop, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def depth(self):
+        return self.pending
+
+    def enqueue(self, chat_id, text, priority=PRIORITY_INTERACTIVE, coalesce=False, photo=None, edit=None,
+                on_done=None, **kwargs):
+        """Queue a send; `photo` sends an image, `edit` rewrites that message id instead"""
+        message = OutboundMessage(chat_id, text, priority, coalesce, kwargs, next(self.sequence), photo, edit, on_done)
+        with self.cond:
+            chat = self.chats.setdefault(chat_id, ChatQueue())
+            heapq.heappush(chat.messages, (priority, message.sequence, message))
+            self.pending += 1
+            if chat.ready_key and priority < chat.ready_key[0]:
+                # Already queued at a less urgent priority: push it again, take() skips the old entry
+                self.push_ready(chat_id, chat)
+            self.schedule(chat_id, chat)
+            self.cond.notify()
+
+    def schedule(self, chat_id, chat):
+        """Put a chat with pending messages on the ready or waiting heap"""
+        if chat.scheduled or chat.in_flight or not chat.messages:
+            return
+        chat.scheduled = True
+        if chat.next_allowed <= time.monotonic():
+            self.push_ready(chat_id, chat)
         else:
-            prev_high = prev_close * 1.002
-            prev_low = prev_close * 0.998
-        
-        return {
-            'current': current,
-            'prev_high': prev_high,
-            'prev_low': prev_low,
-            'prev_close': prev_close
-        }
-    except Exception as e:
-        logger.error(f"❌ Error getting historical data for {pair}: {e}")
+            heapq.heappush(self.waiting, (chat.next_allowed, next(self.sequence), chat_id))
+
+    def push_ready(self, chat_id, chat):
+        """Put a chat on the ready heap at the priority of its most urgent message"""
+        priority, sequence, _ = chat.messages[0]
+        chat.ready_key = (priority, sequence)
+        heapq.heappush(self.ready, (priority, sequence, chat_id))
+
+    def pop_ready(self):
+        """Most urgent ready chat, skipping entries superseded by a re-push; None if empty"""
+        while self.ready:
+            priority, sequence, chat_id = heapq.heappop(self.ready)
+            chat = self.chats.get(chat_id)
+            if chat is not None and chat.ready_key == (priority, sequence):
+                return chat_id
         return None
 
+    def take(self):
+        """Wait for the most urgent chat that may be sent to, claim its next send"""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                while self.waiting and self.waiting[0][0] <= now:
+                    _, _, chat_id = heapq.heappop(self.waiting)
+                    chat = self.chats[chat_id]
+                    if not chat.messages:
+                        # Idle chat whose rate limit has expired
+                        del self.chats[chat_id]
+                        continue
+                    self.push_ready(chat_id, chat)
+                chat_id = self.pop_ready()
+                if chat_id is not None:
+                    break
+                self.cond.wait(self.waiting[0][0] - now if self.waiting else None)
+            
+            chat = self.chats[chat_id]
+            chat.scheduled = False
+            chat.ready_key = None
+            chat.in_flight = True
+            _, _, message = heapq.heappop(chat.messages)
+            merged = [message]
+            if message.coalesce:
+                length = len(message.text)
+                while chat.messages:
+                    _, _, candidate = chat.messages[0]
+                    if (not candidate.coalesce or candidate.kwargs != message.kwargs
+                            or length + len(candidate.text) + 1 > MAX_MESSAGE_LENGTH):
+                        break
+                    heapq.heappop(chat.messages)
+                    merged.append(candidate)
+                    length += len(candidate.text) + 1
+            self.pending -= len(merged)
+            return chat_id, merged
+
+    def release(self, chat_id, retry=None, delay=0):
+        """Finish a send: requeue failures and re-arm the chat's rate limit"""
+        with self.cond:
+            chat = self.chats[chat_id]
+            chat.in_flight = False
+            chat.next_allowed = time.monotonic() + max(self.per_chat_interval, delay)
+            if retry:
+                for message in retry:
+                    heapq.heappush(chat.messages, (message.priority, message.sequence, message))
+                    self.pending += 1
+            if chat.messages:
+                self.schedule(chat_id, chat)
+                self.cond.notify()
+            elif chat.next_allowed <= time.monotonic():
+                del self.chats[chat_id]
+            else:
+                # Keep the entry so the per-chat limit still applies until it expires
+                heapq.heappush(self.waiting, (chat.next_allowed, next(self.sequence), chat_id))
+                chat.scheduled = True
+
+    def worker_loop(self):
+        while True:
+            try:
+                self.send_next()
+            except Exception as e:
+                # A bug here must not take the worker down with it
+                logger.error(f"❌ Send worker error: {e}")
+                time.sleep(1)
+
+    def send_next(self):
+        """Claim one chat's next send and deliver it"""
+        chat_id, messages = self.take()
+        head = messages[0]
+        text = "\n".join(m.text for m in messages)
+        try:
+            self.global_bucket.acquire()
+            if head.photo is not None:
+                # Photos and edits are never coalesced, so head is the only message
+                sent = bot.send_photo(chat_id, head.photo, caption=text or None, **head.kwargs)
+            elif head.edit is not None:
+                sent = bot.edit_message_text(text, chat_id, head.edit, **head.kwargs)
+            else:
+                sent = bot.send_message(chat_id, text, **head.kwargs)
+            MESSAGES_SENT.inc(outcome='ok')
+            self.release(chat_id)
+            for message in messages:
+                message.finish(sent)
+        except ApiTelegramException as e:
+            MESSAGES_SENT.inc(outcome=e.error_code)
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"⏳ Telegram rate limit for {chat_id}, retrying in {retry_after}s")
+                self.release(chat_id, messages, retry_after)
+            elif e.error_code >= 500:
+                self.release(chat_id, self.retryable(messages, e))
+            else:
+                logger.error(f"❌ Error sending to {chat_id}: {e}")
+                self.release(chat_id)
+                for message in messages:
+                    message.finish(None, e)
+        except Exception as e:
+            MESSAGES_SENT.inc(outcome='error')
+            logger.error(f"❌ Error sending to {chat_id}: {e}")
+            self.release(chat_id, self.retryable(messages, e))
+
+    def retryable(self, messages, error):
+        """Messages that still have attempts left; the rest are finished with `error`"""
+        retry = []
+        for message in messages:
+            message.attempts += 1
+            if message.attempts < SEND_MAX_ATTEMPTS:
+                retry.append(message)
+            else:
+                message.finish(None, error)
+        return retry
+
+send_queue = SendScheduler(SEND_WORKERS, SEND_GLOBAL_RATE, SEND_PER_CHAT_INTERVAL)
+SEND_QUEUE_DEPTH = Gauge('forexbot_send_queue_depth', 'Messages waiting in the outbound queue',
+                         function=lambda: {(): send_queue.depth()})
+
+def enqueue_message(chat_id, text, priority=PRIORITY_INTERACTIVE, coalesce=False, **kwargs):
+    """Queue a send_message call; returns immediately"""
+    send_queue.enqueue(chat_id, text, priority, coalesce, **kwargs)
+
 # ============================================
-# EMA CALCULATIONS
+# CHARTS
 # ============================================
-def calculate_ema(prices, period):
-    """Calculate EMA"""
+chart_executor = ThreadPoolExecutor(max_workers=CHART_WORKERS, thread_name_prefix='chart')
+# Guards ChartEntry state; entries themselves live in indicator_cache
+chart_lock = Lock()
+
+class ChartEntry:
+    """One chart per (pair, settings, snapshot version), shared by every chat that asks
+
+    The PNG is drawn once on chart_executor and uploaded once; chats that
+    ask meanwhile wait in `waiters`, and everyone after the first upload
+    gets Telegram's file_id instead of a new upload.
+    """
+    def __init__(self, pair):
+        self.pair = pair
+        self.state = 'new'
+        self.png = None
+        self.caption = None
+        self.file_id = None
+        self.uploading = False
+        self.waiters = []
+
+def ema_series(prices, period):
+    """EMA at every point of `prices` (None until `period` prices), seeded like calculate_ema"""
+    series = [None] * len(prices)
     if len(prices) < period:
-        return None
+        return series
     k = 2 / (period + 1)
     ema = sum(prices[:period]) / period
-    for price in prices[period:]:
-        ema = (price * k) + (ema * (1 - k))
-    return ema
+    series[period - 1] = ema
+    for i in range(period, len(prices)):
+        ema = (prices[i] * k) + (ema * (1 - k))
+        series[i] = ema
+    return series
 
-def update_ema_values(pair):
-    """Update EMAs for a pair"""
-    global price_history
+def chart_series(pair, market):
+    """(times, prices) to plot: archived ticks over CHART_WINDOW, else the snapshot's history"""
+    end = market.last_update.timestamp()
+    times, prices = [], []
+    for ts, px in tick_archive.segments(pair, end - CHART_WINDOW, end):
+        times.extend(ts.tolist())
+        prices.extend(px.tolist())
+    if len(prices) < 2:
+        return None, list(market.history)
+    return [datetime.fromtimestamp(t, timezone.utc) for t in times], prices
+
+def render_chart(pair, market, settings=DEFAULT_SETTINGS):
+    """PNG of recent prices with the CPR band, R1-R3/S1-S3 and both EMAs"""
+    # Optional heavy import, only paid by processes that draw charts
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.dates import DateFormatter
     
-    if len(price_history[pair]) > 30:
-        price_history[pair] = price_history[pair][-30:]
+    fast, slow, pivots = settings
+    if settings != DEFAULT_SETTINGS:
+        market = personalize(market, settings)
+    times, prices = chart_series(pair, market)
+    x = times if times else list(range(len(prices)))
+    price_fmt = price_format(pair)
     
-    market = market_data[pair]
+    figure = Figure(figsize=(9, 5.5), dpi=100)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    ax.plot(x, prices, color='#222222', linewidth=1.2, label='Price')
+    for period, color in ((fast, '#1f77b4'), (slow, '#ff7f0e')):
+        ax.plot(x, ema_series(prices, period), color=color, linewidth=1, label=f'{period} EMA')
     
-    if len(price_history[pair]) >= 8:
-        market.ema_8 = calculate_ema(price_history[pair], 8)
+    ax.axhspan(min(market.bc, market.tc), max(market.bc, market.tc), color='#9467bd', alpha=0.2, label='CPR')
+    ax.axhline(market.pivot, color='#9467bd', linewidth=1)
+    levels = [('PP', market.pivot, '#9467bd')]
+    for i in (1, 2, 3):
+        levels.append((f'R{i}', getattr(market, f'r{i}'), '#d62728'))
+        levels.append((f'S{i}', getattr(market, f's{i}'), '#2ca02c'))
+    for name, value, color in levels[1:]:
+        ax.axhline(value, color=color, linewidth=0.8, linestyle='--')
+    # Label every level at the right edge; data stays in view, far levels widen the axis
+    for name, value, color in levels:
+        ax.annotate(f' {name} {value:{price_fmt}}', xy=(1, value), xycoords=('axes fraction', 'data'),
+                    color=color, fontsize=8, va='center')
     
-    if len(price_history[pair]) >= 20:
-        market.ema_20 = calculate_ema(price_history[pair], 20)
+    pivot_note = f" ({pivots.title()} pivots)" if pivots != 'classic' else ""
+    updated = datetime.fromtimestamp(market.last_update.timestamp(), timezone.utc)
+    ax.set_title(f"{pair}  {market.current_price:{price_fmt}}{pivot_note}  {updated:%H:%M} UTC")
+    ax.grid(True, alpha=0.3)
+    ax.legend(loc='upper left', fontsize=8)
+    if times:
+        ax.xaxis.set_major_formatter(DateFormatter('%H:%M', tz=timezone.utc))
+        figure.autofmt_xdate()
+    figure.subplots_adjust(right=0.85)
+    
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+def request_chart(chat_id, pair, settings=DEFAULT_SETTINGS):
+    """Send a chart of `pair`'s latest snapshot to a chat, drawing and uploading it at most once"""
+    market = get_market(pair)
+    key = (pair, 'chart', settings, market.version)
+    with chart_lock:
+        entry = indicator_cache.get(key, lambda: ChartEntry(pair))
+        if not entry.file_id:
+            entry.waiters.append(chat_id)
+            if entry.state == 'new':
+                entry.state = 'rendering'
+                chart_executor.submit(draw_chart, entry, pair, market, settings)
+            elif entry.state == 'ready' and not entry.uploading:
+                upload_chart(entry)
+            return
+        file_id, caption = entry.file_id, entry.caption
+    CHART_UPLOADS.inc(kind='file_id')
+    send_queue.enqueue(chat_id, caption, photo=file_id)
+
+def draw_chart(entry, pair, market, settings):
+    try:
+        started = time.monotonic()
+        png = render_chart(pair, market, settings)
+        CHART_RENDER_SECONDS.observe(time.monotonic() - started)
+    except Exception as e:
+        logger.error(f"❌ Error drawing {pair} chart: {e}")
+        with chart_lock:
+            waiters, entry.waiters = entry.waiters, []
+            entry.state = 'new'
+        for chat_id in waiters:
+            enqueue_message(chat_id, f"⚠️ Could not draw the {pair} chart, please try again.")
+        return
+    signal, _ = get_trading_signal(pair, market)
+    with chart_lock:
+        entry.png = png
+        entry.caption = f"{pair} · {signal}"
+        entry.state = 'ready'
+        upload_chart(entry)
+
+def upload_chart(entry):
+    """Upload the PNG to the first waiting chat; call with chart_lock held"""
+    if not entry.waiters:
+        return
+    entry.uploading = True
+    CHART_UPLOADS.inc(kind='upload')
+    chat_id = entry.waiters.pop(0)
+    send_queue.enqueue(chat_id, entry.caption, photo=entry.png,
+                       on_done=lambda sent, error: chart_uploaded(entry, chat_id, sent))
+
+def chart_uploaded(entry, chat_id, sent):
+    """Keep the file_id from the first upload and send it to everyone who waited"""
+    with chart_lock:
+        entry.uploading = False
+        if not sent or not sent.photo:
+            # Upload failed for that chat: tell it, then try the next one with the same PNG
+            enqueue_message(chat_id, f"⚠️ Could not send the {entry.pair} chart, please try again.")
+            upload_chart(entry)
+            return
+        entry.file_id = sent.photo[-1].file_id
+        entry.png = None
+        waiters, entry.waiters = entry.waiters, []
+    for chat_id in waiters:
+        CHART_UPLOADS.inc(kind='file_id')
+        send_queue.enqueue(chat_id, entry.caption, photo=entry.file_id)
 
 # ============================================
-# CPR CALCULATIONS
+# LEVELS DIGEST
 # ============================================
-def calculate_cpr(high, low, close):
-    """Calculate CPR levels"""
-    pivot = (high + low + close) / 3.0
-    bc = (high + low) / 2.0
-    tc = pivot - bc + pivot
-    
-    r1 = 2 * pivot - low
-    s1 = 2 * pivot - high
-    r2 = pivot + (high - low)
-    s2 = pivot - (high - low)
-    r3 = high + 2 * (pivot - low)
-    s3 = low - 2 * (high - pivot)
-    
-    return {
-        'pivot': pivot, 'tc': tc, 'bc': bc,
-        'r1': r1, 'r2': r2, 'r3': r3,
-        's1': s1, 's2': s2, 's3': s3
-    }
+DIGEST_LEVELS = (('R3', 'r3'), ('R2', 'r2'), ('R1', 'r1'), ('TC', 'tc'), ('PP', 'pivot'),
+                 ('BC', 'bc'), ('S1', 's1'), ('S2', 's2'), ('S3', 's3'))
 
-def get_trading_signal(pair):
-    """Generate trading signal for a pair"""
-    market = market_data[pair]
+class LiveDigest:
+    """Send state of one chat's live digest; at most one edit is queued at a time"""
+    def __init__(self):
+        self.state = None
+        self.sending = False
+        self.dirty = False
+
+live_digests = defaultdict(LiveDigest)
+live_lock = Lock()
+LIVE_DIGESTS = Gauge('forexbot_live_digests', 'Chats with a live /levels digest', function=lambda: {(): len(live_chats)})
+
+def render_digest_row(pair, market, settings):
+    """(state, line) for one pair; state is (signal, nearest level), what live mode watches"""
+    if settings != DEFAULT_SETTINGS:
+        market = personalize(market, settings)
     price = market.current_price
+    if market.ema_8 <= 0 or market.ema_20 <= 0:
+        return ('wait',), f"⏳ *{pair}* warming up EMAs..."
+    signal = classify_signal(price, market.pivot, market.tc, market.bc,
+                             market.r1, market.s1, market.ema_8, market.ema_20)
+    name, level = min(((name, getattr(market, field)) for name, field in DIGEST_LEVELS),
+                      key=lambda item: abs(item[1] - price))
+    emoji = "🟢" if "BUY" in signal else "🔴" if "SELL" in signal else "⚪"
+    price_fmt = price_format(pair)
+    distance = (level - price) / pip_size(pair)
+    line = f"{emoji} *{pair}* {price:{price_fmt}} {signal}\n      {name} {level:{price_fmt}} ({distance:+.1f} pips)"
+    return (signal, name), line
+
+def digest_row(pair, settings):
+    """Row for the pair's latest snapshot, computed once per version and settings"""
+    market = get_market(pair)
+    if market.pivot == 0:
+        return ('wait',), f"⏳ *{pair}* calculating..."
+    return indicator_cache.get((pair, 'digest', settings, market.version),
+                               lambda: render_digest_row(pair, market, settings))
+
+def render_digest(chat_id, page, live=False):
+    """(text, state, markup) for one page of a chat's digest"""
+    pairs = subscribers.get(chat_id, {}).get('pairs', [])
+    pages = max(1, -(-len(pairs) // DIGEST_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    settings = user_settings(chat_id)
+    rows = [digest_row(pair, settings) for pair in pairs[page * DIGEST_PAGE_SIZE:(page + 1) * DIGEST_PAGE_SIZE]]
     
-    if price == 0 or market.pivot == 0:
-        return "WAIT", "⏳ Calculating levels..."
-    
-    if 'JPY' in pair:
-        distance = (price - market.pivot) * 100
-        unit = "pips"
-    else:
-        distance = (price - market.pivot) * 10000
-        unit = "pips"
-    
-    ema_signal = ""
-    if market.ema_8 > 0 and market.ema_20 > 0:
-        if price > market.ema_8:
-            ema_signal = "📈 Breakout: Above 8 EMA"
-        else:
-            ema_signal = "📉 Breakout: Below 8 EMA"
-        
-        if price > market.ema_20:
-            ema_signal += "\n📊 Trend: Bullish (Above 20 EMA)"
-        else:
-            ema_signal += "\n📊 Trend: Bearish (Below 20 EMA)"
+    page_note = f" {page + 1}/{pages}" if pages > 1 else ""
+    live_note = " 🔴 live" if live else ""
+    updated = last_market_update.strftime('%H:%M:%S') if last_market_update else '--:--:--'
+    text = f"📋 *Levels{page_note}*{live_note} ⏰ {updated} UTC\n\n" + "\n".join(line for _, line in rows)
+    if live:
+        text += "\n\n_Updates when a signal or nearest level changes. /levels stop to end._"
     
-    if price > market.tc:
-        if price > market.r1 and price > market.ema_8 and price > market.ema_20:
-            return "STRONG BUY", f"🟢 Price above TC, R1 and both EMAs\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
-        elif price > market.ema_8:
-            return "BUY", f"🟢 Price above TC and 8 EMA\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
-        else:
-            return "BUY (Weak)", f"🟡 Price above TC but below 8 EMA\n{ema_signal}\n+{distance:.1f} {unit} from pivot"
+    markup = None
+    if pages > 1:
+        markup = types.InlineKeyboardMarkup()
+        markup.row(
+            types.InlineKeyboardButton("◀️", callback_data=f"dig:{(page - 1) % pages}:{page}"),
+            types.InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"dig:{page}:{page}"),
+            types.InlineKeyboardButton("▶️", callback_data=f"dig:{(page + 1) % pages}:{page}")
+        )
+    return text, (page, tuple(state for state, _ in rows)), markup
+
+def start_live_digest(chat_id):
+    """Send a new digest message and keep it updated from then on"""
+    text, state, markup = render_digest(chat_id, 0, live=True)
     
-    elif price < market.bc:
-        if price < market.s1 and price < market.ema_8 and price < market.ema_20:
-            return "STRONG SELL", f"🔴 Price below BC, S1 and both EMAs\n{ema_signal}\n{distance:.1f} {unit} from pivot"
-        elif price < market.ema_8:
-            return "SELL", f"🔴 Price below BC and 8 EMA\n{ema_signal}\n{distance:.1f} {unit} from pivot"
-        else:
-            return "SELL (Weak)", f"🟡 Price below BC but above 8 EMA\n{ema_signal}\n{distance:.1f} {unit} from pivot"
+    def sent(message, error):
+        if not message:
+            return
+        user = subscribers.setdefault(chat_id, {'pairs': [], 'alerts': False})
+        user['live'] = {'message_id': message.message_id, 'page': 0}
+        with live_lock:
+            digest = live_digests[chat_id]
+            digest.state, digest.sending, digest.dirty = state, False, False
+        index_subscriber(chat_id)
+        save_subscriber(chat_id)
     
-    else:
-        if price > market.pivot and price > market.ema_8:
-            return "NEUTRAL (Bullish)", f"⚪ In CPR, above pivot & 8 EMA\n{ema_signal}\n+{distance:.1f} {unit}"
-        elif price < market.pivot and price < market.ema_8:
-            return "NEUTRAL (Bearish)", f"⚪ In CPR, below pivot & 8 EMA\n{ema_signal}\n{distance:.1f} {unit}"
-        else:
-            return "NEUTRAL", f"⚪ In CPR zone\n{ema_signal}\n{distance:+.1f} {unit}"
+    send_queue.enqueue(chat_id, text, on_done=sent, parse_mode='Markdown', reply_markup=markup)
 
-# ============================================
-# UPDATE MARKET DATA
-# ============================================
-def update_market_data(pair):
-    """Update data for a specific pair"""
-    try:
-        data = get_historical_data(pair)
-        if not data:
-            return False
-        
-        market = market_data[pair]
-        market.current_price = data['current']
-        market.prev_high = data['prev_high']
-        market.prev_low = data['prev_low']
-        market.prev_close = data['prev_close']
-        
-        price_history[pair].append(market.current_price)
-        
-        levels = calculate_cpr(market.prev_high, market.prev_low, market.prev_close)
-        market.pivot = levels['pivot']
-        market.tc = levels['tc']
-        market.bc = levels['bc']
-        market.r1 = levels['r1']
-        market.r2 = levels['r2']
-        market.r3 = levels['r3']
-        market.s1 = levels['s1']
-        market.s2 = levels['s2']
-        market.s3 = levels['s3']
-        
-        update_ema_values(pair)
-        market.last_update = datetime.now()
-        
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error updating {pair}: {e}")
+def stop_live_digest(chat_id):
+    user = subscribers.get(chat_id)
+    if not user or not user.pop('live', None):
+        return False
+    with live_lock:
+        live_digests.pop(chat_id, None)
+    index_subscriber(chat_id)
+    save_subscriber(chat_id)
+    return True
+
+def queue_live_edit(chat_id):
+    """Edit the chat's live message if its digest state changed since the last edit"""
+    live = subscribers.get(chat_id, {}).get('live')
+    if not live:
+        return
+    text, state, markup = render_digest(chat_id, live['page'], live=True)
+    with live_lock:
+        digest = live_digests[chat_id]
+        if state == digest.state:
+            return
+        if digest.sending:
+            # The edit in flight finishes first, then we re-check
+            digest.dirty = True
+            return
+        digest.sending = True
+    send_queue.enqueue(chat_id, text, edit=live['message_id'], parse_mode='Markdown', reply_markup=markup,
+                       on_done=lambda sent, error: live_edit_done(chat_id, state, sent, error))
+
+# Telegram errors after which a message can never be edited again
+PERMANENT_EDIT_ERRORS = ('message to edit not found', "message can't be edited")
+
+def edit_gone(error):
+    """True if `error` means the message is deleted, too old or otherwise uneditable for good"""
+    if not isinstance(error, ApiTelegramException):
         return False
+    if error.error_code == 403:
+        # Bot blocked or removed from the chat
+        return True
+    description = (error.description or '').lower()
+    return any(text in description for text in PERMANENT_EDIT_ERRORS)
+
+def live_edit_done(chat_id, state, sent, error=None):
+    if not sent and isinstance(error, ApiTelegramException) and 'message is not modified' in (error.description or ''):
+        # Telegram already shows this text
+        sent = True
+    with live_lock:
+        digest = live_digests[chat_id]
+        digest.sending = False
+        again, digest.dirty = digest.dirty, False
+        if sent:
+            digest.state = state
+    if not sent and edit_gone(error):
+        # The user can start a new one
+        logger.info(f"📋 Stopping live digest for {chat_id}: {error.description}")
+        stop_live_digest(chat_id)
+    elif not sent:
+        # Transient failure: the digest state is unchanged, so the next update edits again
+        logger.warning(f"⚠️ Live digest edit for {chat_id} failed: {error}")
+    elif again:
+        queue_live_edit(chat_id)
+
+def update_live_digests(updated):
+    """After a refresh, edit live digests whose pairs changed signal or nearest level"""
+    if not updated or not live_chats:
+        return
+    updated = set(updated)
+    for chat_id in list(live_chats):
+        try:
+            if not updated.isdisjoint(subscribers.get(chat_id, {}).get('pairs', ())):
+                queue_live_edit(chat_id)
+        except Exception as e:
+            logger.error(f"❌ Error updating live digest for {chat_id}: {e}")
 
 # ============================================
 # TELEGRAM BOT COMMANDS
 # ============================================
 @bot.message_handler(commands=['start'])
+@instrumented
 def send_welcome(message):
     chat_id = message.chat.id
     if chat_id not in subscribers:
         subscribers[chat_id] = {'pairs': [], 'alerts': False}
-        save_subscribers()
+        save_subscriber(chat_id)
     
-    welcome_text = """
+    welcome_text = f"""
 🎯 *Multi-Currency Forex Trading Bot*
 
-*Top 10 Forex Pairs Available:*
-EUR/USD, GBP/USD, USD/JPY, USD/CHF
-AUD/USD, USD/CAD, NZD/USD, EUR/GBP
-EUR/JPY, GBP/JPY
+*{len(FOREX_PAIRS)} Pairs Available:*
+Majors (EUR/USD, GBP/USD, USD/JPY...), crosses and exotics
+Search with /select, e.g. /select JPY or /select exotic
 
 *Commands:*
 /select - Choose currency pairs to track
-/levels - Get levels for selected pairs
+/levels - Digest of your pairs (/levels full, /levels live)
+/chart EUR/USD - Price chart with CPR levels and EMAs
 /subscribe - Enable alerts
 /unsubscribe - Disable alerts
 /mypairs - Show your selected pairs
+/settings - Your EMA periods and pivot method
 /help - Show this help
 
 *Quick Access:*
@@ -373,82 +3052,203 @@ Just type pair name (e.g., EUR/USD) to get instant levels!
 
 Ready to trade! 🚀
     """
-    bot.send_message(chat_id, welcome_text, parse_mode='Markdown')
+    enqueue_message(chat_id, welcome_text, parse_mode='Markdown')
+
+def search_symbols(query):
+    """Symbols whose name, code or group contains `query`, in registry order"""
+    if not query:
+        return SYMBOL_LIST
+    return _search_symbols(query)
+
+@functools.lru_cache(maxsize=256)
+def _search_symbols(query):
+    compact = query.replace('/', '').replace(' ', '')
+    return [pair for pair, info in FOREX_PAIRS.items()
+            if compact in pair.replace('/', '') or query in info['name'].upper() or query == info['group'].upper()]
+
+def clean_query(text):
+    """Search text as it is carried in callback data: short, upper case, no separators"""
+    return ''.join(c for c in text.upper() if c.isalnum() or c in '/ ')[:20].strip()
+
+def selector_callback(action, page=0, query='', pair=None):
+    """Compact callback data (Telegram allows 64 bytes): sel:<action>:<page>:<symbol index>:<query>"""
+    index = format(SYMBOL_INDEX[pair], 'x') if pair else ''
+    return f"sel:{action}:{page}:{index}:{query}"
+
+def selector_markup(chat_id, page, query):
+    """One page of the pair keyboard, with the chat's pairs ticked"""
+    symbols = search_symbols(query)
+    pages = max(1, -(-len(symbols) // SELECT_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    selected = set(subscribers.get(chat_id, {}).get('pairs', ()))
+    
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    markup.add(*[
+        types.InlineKeyboardButton(f"✅ {pair}" if pair in selected else pair,
+                                   callback_data=selector_callback('t', page, query, pair))
+        for pair in symbols[page * SELECT_PAGE_SIZE:(page + 1) * SELECT_PAGE_SIZE]
+    ])
+    if pages > 1:
+        markup.row(
+            types.InlineKeyboardButton("◀️", callback_data=selector_callback('p', (page - 1) % pages, query)),
+            types.InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=selector_callback('p', page, query)),
+            types.InlineKeyboardButton("▶️", callback_data=selector_callback('p', (page + 1) % pages, query))
+        )
+    markup.row(types.InlineKeyboardButton("✅ Done", callback_data=selector_callback('d')))
+    return markup, len(symbols)
 
 @bot.message_handler(commands=['select'])
+@instrumented
 def select_pairs(message):
     chat_id = message.chat.id
+    query = clean_query(message.text.partition(' ')[2])
+    markup, count = selector_markup(chat_id, 0, query)
     
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    buttons = []
-    
-    for pair in FOREX_PAIRS.keys():
-        callback_data = f"pair_{pair.replace('/', '_')}"
-        buttons.append(types.InlineKeyboardButton(pair, callback_data=callback_data))
-    
-    markup.add(*buttons)
-    markup.add(types.InlineKeyboardButton("✅ Done", callback_data="pair_done"))
+    if query and not count:
+        enqueue_message(chat_id, f"🔍 No pairs match '{query}'. Try /select EUR, /select JPY or /select exotic.")
+        return
     
-    bot.send_message(
+    found = f"{count} pairs matching '{query}'" if query else f"{count} pairs"
+    enqueue_message(
         chat_id,
-        "🔍 *Select Currency Pairs to Track:*\n\nClick on pairs you want to follow:",
+        f"🔍 *Select Currency Pairs to Track:*\n\n{found}. Tap to add or remove, "
+        f"or search with /select <text>:",
         reply_markup=markup,
         parse_mode='Markdown'
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('pair_'))
+def toggle_pair(chat_id, pair):
+    """Add or remove a pair from a chat's selection; True if it was added"""
+    pairs = subscribers[chat_id]['pairs']
+    added = pair not in pairs
+    if added:
+        pairs.append(pair)
+    else:
+        pairs.remove(pair)
+    index_subscriber(chat_id)
+    save_subscriber(chat_id)
+    if added:
+        request_refresh([pair])
+    return added
+
+def finish_selection(call, chat_id):
+    bot.answer_callback_query(call.id, "Selection saved!")
+    save_subscriber(chat_id)
+    pairs_list = "\n".join([f"• {p}" for p in subscribers[chat_id]['pairs']])
+    if pairs_list:
+        enqueue_message(chat_id, f"✅ *Your Selected Pairs:*\n{pairs_list}\n\nUse /levels to see analysis!", parse_mode='Markdown')
+    else:
+        enqueue_message(chat_id, "⚠️ No pairs selected. Use /select to choose pairs.")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(('sel:', 'pair_')))
+@instrumented
 def handle_pair_selection(call):
     chat_id = call.message.chat.id
     
     if chat_id not in subscribers:
         subscribers[chat_id] = {'pairs': [], 'alerts': False}
     
-    if call.data == 'pair_done':
-        bot.answer_callback_query(call.id, "Selection saved!")
-        save_subscribers()
-        pairs_list = "\n".join([f"• {p}" for p in subscribers[chat_id]['pairs']])
-        if pairs_list:
-            bot.send_message(chat_id, f"✅ *Your Selected Pairs:*\n{pairs_list}\n\nUse /levels to see analysis!", parse_mode='Markdown')
-        else:
-            bot.send_message(chat_id, "⚠️ No pairs selected. Use /select to choose pairs.")
+    # Keyboards sent before pagination use pair_<BASE>_<QUOTE> and pair_done
+    if call.data.startswith('pair_'):
+        if call.data == 'pair_done':
+            finish_selection(call, chat_id)
+            return
+        pair = call.data.replace('pair_', '').replace('_', '/')
+        if pair in FOREX_PAIRS:
+            added = toggle_pair(chat_id, pair)
+            bot.answer_callback_query(call.id, f"✅ Added {pair}" if added else f"❌ Removed {pair}")
         return
     
-    pair = call.data.replace('pair_', '').replace('_', '/')
+    _, action, page, index, query = call.data.split(':', 4)
+    if action == 'd':
+        finish_selection(call, chat_id)
+        return
     
-    if pair in subscribers[chat_id]['pairs']:
-        subscribers[chat_id]['pairs'].remove(pair)
-        bot.answer_callback_query(call.id, f"❌ Removed {pair}")
+    if action == 't':
+        position = int(index, 16)
+        if position >= len(SYMBOL_LIST):
+            bot.answer_callback_query(call.id, "⚠️ Pair list changed, please /select again")
+            return
+        pair = SYMBOL_LIST[position]
+        added = toggle_pair(chat_id, pair)
+        bot.answer_callback_query(call.id, f"✅ Added {pair}" if added else f"❌ Removed {pair}")
     else:
-        subscribers[chat_id]['pairs'].append(pair)
-        bot.answer_callback_query(call.id, f"✅ Added {pair}")
+        bot.answer_callback_query(call.id)
+    
+    markup, _ = selector_markup(chat_id, int(page), query)
+    try:
+        bot.edit_message_reply_markup(chat_id, call.message.message_id, reply_markup=markup)
+    except ApiTelegramException as e:
+        # "message is not modified" when the page didn't change
+        logger.debug(f"Keyboard not updated for {chat_id}: {e}")
 
 @bot.message_handler(commands=['levels'])
+@instrumented
 def show_all_levels(message):
+    """/levels digest, /levels full, /levels live, /levels stop"""
     chat_id = message.chat.id
+    mode = (message.text.split()[1:] or ['digest'])[0].lower()
+    
+    if mode == 'stop':
+        stopped = stop_live_digest(chat_id)
+        enqueue_message(chat_id, "⏹ Live digest stopped." if stopped else "⚠️ No live digest running.")
+        return
     
     if chat_id not in subscribers or not subscribers[chat_id]['pairs']:
-        bot.send_message(chat_id, "⚠️ No pairs selected! Use /select to choose pairs first.")
+        enqueue_message(chat_id, "⚠️ No pairs selected! Use /select to choose pairs first.")
         return
     
-    for pair in subscribers[chat_id]['pairs']:
-        show_pair_levels(chat_id, pair)
-        time.sleep(1)
-
-def show_pair_levels(chat_id, pair):
-    """Show levels for a specific pair"""
-    market = market_data[pair]
+    pairs = list(subscribers[chat_id]['pairs'])
     
-    if market.pivot == 0:
-        bot.send_message(chat_id, f"⏳ Calculating levels for {pair}... Try again in 10 seconds.")
+    def reply():
+        if mode == 'full':
+            for pair in pairs:
+                send_pair_levels(chat_id, pair, coalesce=True)
+        elif mode == 'live':
+            start_live_digest(chat_id)
+        else:
+            text, _, markup = render_digest(chat_id, 0)
+            enqueue_message(chat_id, text, parse_mode='Markdown', reply_markup=markup)
+    
+    when_fresh(pairs, reply)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('dig:'))
+@instrumented
+def handle_digest_page(call):
+    chat_id = call.message.chat.id
+    bot.answer_callback_query(call.id)
+    # dig:<page to show>:<page shown>; older buttons only carry the first
+    pages = call.data.split(':')[1:]
+    page = int(pages[0])
+    live = subscribers.get(chat_id, {}).get('live')
+    if live and live['message_id'] == call.message.message_id:
+        live['page'] = page
+        save_subscriber(chat_id)
+        queue_live_edit(chat_id)
         return
+    if len(pages) > 1 and int(pages[1]) == page:
+        # Same page: Telegram rejects an edit that changes nothing
+        return
+    text, _, markup = render_digest(chat_id, page)
+    send_queue.enqueue(chat_id, text, edit=call.message.message_id, parse_mode='Markdown', reply_markup=markup)
+
+def render_pair_levels(pair, market=None, settings=DEFAULT_SETTINGS):
+    """Build the levels message for a pair from its current (or the given) snapshot"""
+    market = market or get_market(pair)
+    fast, slow, pivots = settings
+    if settings != DEFAULT_SETTINGS:
+        market = personalize(market, settings)
+    pip = pip_size(pair)
     
     def distance_format(level):
-        if 'JPY' in pair:
-            return (level - market.current_price) * 100
-        else:
-            return (level - market.current_price) * 10000
+        return (level - market.current_price) / pip
+    
+    def ema_text(value):
+        if value <= 0:
+            return "⏳ warming up"
+        return f"{value:{price_fmt}} ({distance_format(value):+.1f} {pip_unit})"
     
-    signal, reason = get_trading_signal(pair)
+    signal, reason = get_trading_signal(pair, market, (fast, slow))
     
     if "BUY" in signal:
         signal_emoji = "🟢"
@@ -457,16 +3257,29 @@ def show_pair_levels(chat_id, pair):
     else:
         signal_emoji = "⚪"
     
-    if 'JPY' in pair:
-        price_fmt = ".2f"
-        pip_unit = "pips"
-    else:
-        price_fmt = ".5f"
-        pip_unit = "pips"
+    price_fmt = price_format(pair)
+    pip_unit = "pips"
+    
+    cpr_note = " (estimated)" if market.cpr_source == 'estimate' else ""
+    pivot_note = f" ({pivots.title()})" if pivots != 'classic' else ""
+    
+    periodic_text = ""
+    for label, levels in (("W", market.weekly_cpr), ("M", market.monthly_cpr)):
+        if levels:
+            periodic_text += (f"{label}: PP {levels['pivot']:{price_fmt}} | "
+                              f"TC {levels['tc']:{price_fmt}} | BC {levels['bc']:{price_fmt}}\n")
+    if periodic_text:
+        periodic_text = f"""
+━━━━━━━━━━━━━━━━━━━━
+📆 *WEEKLY / MONTHLY CPR*
+━━━━━━━━━━━━━━━━━━━━
+{periodic_text}"""
+    
+    stale_note = "\n⚠️ Rate provider unreachable, showing last known prices" if market.stale else ""
     
     levels_text = f"""
 {signal_emoji} *{pair} ANALYSIS* {signal_emoji}
-⏰ {datetime.now().strftime('%H:%M:%S')} UTC
+⏰ {market.last_update.strftime('%H:%M:%S')} UTC{stale_note}
 
 💱 *Current: {market.current_price:{price_fmt}}*
 
@@ -476,38 +3289,110 @@ def show_pair_levels(chat_id, pair):
 ━━━━━━━━━━━━━━━━━━━━
 📊 *EMA INDICATORS*
 ━━━━━━━━━━━━━━━━━━━━
-📈 8 EMA: {market.ema_8:{price_fmt}} ({distance_format(market.ema_8):+.1f} {pip_unit})
-📊 20 EMA: {market.ema_20:{price_fmt}} ({distance_format(market.ema_20):+.1f} {pip_unit})
+📈 {fast} EMA: {ema_text(market.ema_8)}
+📊 {slow} EMA: {ema_text(market.ema_20)}
 
 ━━━━━━━━━━━━━━━━━━━━
-📍 *CPR LEVELS*
+📍 *CPR LEVELS*{cpr_note}
 ━━━━━━━━━━━━━━━━━━━━
 🔴 TC: {market.tc:{price_fmt}} ({distance_format(market.tc):+.1f} {pip_unit})
 🟢 PP: {market.pivot:{price_fmt}} ({distance_format(market.pivot):+.1f} {pip_unit})
 🔵 BC: {market.bc:{price_fmt}} ({distance_format(market.bc):+.1f} {pip_unit})
 
 ━━━━━━━━━━━━━━━━━━━━
-🔺 *RESISTANCE*
+🔺 *RESISTANCE*{pivot_note}
 ━━━━━━━━━━━━━━━━━━━━
 R3: {market.r3:{price_fmt}} ({distance_format(market.r3):+.1f})
 R2: {market.r2:{price_fmt}} ({distance_format(market.r2):+.1f})
 R1: {market.r1:{price_fmt}} ({distance_format(market.r1):+.1f})
 
 ━━━━━━━━━━━━━━━━━━━━
-🔻 *SUPPORT*
+🔻 *SUPPORT*{pivot_note}
 ━━━━━━━━━━━━━━━━━━━━
 S1: {market.s1:{price_fmt}} ({distance_format(market.s1):+.1f})
 S2: {market.s2:{price_fmt}} ({distance_format(market.s2):+.1f})
 S3: {market.s3:{price_fmt}} ({distance_format(market.s3):+.1f})
+{periodic_text}    """
+    return levels_text
+
+# Rendered levels messages: {pair: (market version, text)}
+level_messages = {}
+level_messages_lock = Lock()
+
+def get_level_message(pair, market=None, settings=DEFAULT_SETTINGS):
+    """Levels message for a market snapshot (the latest by default), rendered once per version
+
+    Custom settings render through the shared indicator cache, once per
+    version for everyone who uses them.
     """
-    bot.send_message(chat_id, levels_text, parse_mode='Markdown')
+    market = market or get_market(pair)
+    if settings != DEFAULT_SETTINGS:
+        return indicator_cache.get((pair, 'message', settings, market.version),
+                                   lambda: render_pair_levels(pair, market, settings))
+    cached = level_messages.get(pair)
+    if cached and cached[0] == market.version:
+        return cached[1]
+    with level_messages_lock:
+        cached = level_messages.get(pair)
+        if cached and cached[0] == market.version:
+            return cached[1]
+        text = render_pair_levels(pair, market)
+        # A reader pinned to an older version must not evict a newer message
+        if not cached or cached[0] < market.version:
+            level_messages[pair] = (market.version, text)
+        return text
+
+def render_level_messages(pairs):
+    """Pre-render messages right after an update so handlers only look up"""
+    for pair in pairs:
+        try:
+            get_level_message(pair)
+        except Exception as e:
+            logger.error(f"❌ Error rendering {pair} levels: {e}")
+
+def show_pair_levels(chat_id, pair, coalesce=False):
+    """Show levels for a specific pair, once a stale one has been refreshed"""
+    when_fresh([pair], lambda: send_pair_levels(chat_id, pair, coalesce))
+
+def send_pair_levels(chat_id, pair, coalesce=False):
+    """Queue the levels message for a pair's latest snapshot"""
+    market = get_market(pair)
+    if market.pivot == 0:
+        enqueue_message(chat_id, f"⏳ Calculating levels for {pair}... Try again in 10 seconds.", coalesce=coalesce)
+        return
+    
+    text = get_level_message(pair, market, user_settings(chat_id))
+    enqueue_message(chat_id, text, coalesce=coalesce, parse_mode='Markdown')
+
+@bot.message_handler(commands=['chart'])
+@instrumented
+def show_chart(message):
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+    if args:
+        pair = resolve_pair(args[0])
+    else:
+        pairs = subscribers.get(chat_id, {}).get('pairs') or [None]
+        pair = pairs[0]
+    if not pair:
+        enqueue_message(chat_id, "⚠️ Usage: /chart EUR/USD")
+        return
+    
+    def reply():
+        if get_market(pair).pivot == 0:
+            enqueue_message(chat_id, f"⏳ Calculating levels for {pair}... Try again in 10 seconds.")
+            return
+        request_chart(chat_id, pair, user_settings(chat_id))
+    
+    when_fresh([pair], reply)
 
 @bot.message_handler(commands=['mypairs'])
+@instrumented
 def show_my_pairs(message):
     chat_id = message.chat.id
     
     if chat_id not in subscribers or not subscribers[chat_id]['pairs']:
-        bot.send_message(chat_id, "⚠️ No pairs selected. Use /select to choose pairs.")
+        enqueue_message(chat_id, "⚠️ No pairs selected. Use /select to choose pairs.")
         return
     
     pairs_list = "\n".join([f"• {p}" for p in subscribers[chat_id]['pairs']])
@@ -521,36 +3406,187 @@ def show_my_pairs(message):
 
 Use /levels to see analysis for all pairs!
     """
-    bot.send_message(chat_id, text, parse_mode='Markdown')
+    enqueue_message(chat_id, text, parse_mode='Markdown')
 
 @bot.message_handler(commands=['subscribe'])
+@instrumented
 def subscribe_alerts(message):
     chat_id = message.chat.id
     if chat_id not in subscribers:
         subscribers[chat_id] = {'pairs': [], 'alerts': True}
     else:
         subscribers[chat_id]['alerts'] = True
-    save_subscribers()
-    bot.send_message(chat_id, "✅ Alerts enabled! You'll get notifications when price touches key levels.")
+    index_subscriber(chat_id)
+    save_subscriber(chat_id)
+    enqueue_message(chat_id, "✅ Alerts enabled! You'll get notifications when price touches key levels.")
 
 @bot.message_handler(commands=['unsubscribe'])
+@instrumented
 def unsubscribe_alerts(message):
     chat_id = message.chat.id
     if chat_id in subscribers:
         subscribers[chat_id]['alerts'] = False
-    save_subscribers()
-    bot.send_message(chat_id, "❌ Alerts disabled.")
+    index_subscriber(chat_id)
+    save_subscriber(chat_id)
+    enqueue_message(chat_id, "❌ Alerts disabled.")
+
+SETTINGS_USAGE = """Usage:
+/settings ema 9 21 - fast and slow EMA periods
+/settings pivots camarilla - classic, camarilla or fibonacci
+/settings reset - back to 8/20 EMA and classic pivots"""
+
+def settings_text(settings):
+    fast, slow, pivots = settings
+    return f"⚙️ *Your indicators:* {fast}/{slow} EMA, {pivots.title()} pivots"
+
+@bot.message_handler(commands=['settings'])
+@instrumented
+def indicator_settings(message):
+    chat_id = message.chat.id
+    args = message.text.lower().split()[1:]
+    fast, slow, pivots = user_settings(chat_id)
+    
+    if not args:
+        enqueue_message(chat_id, f"{settings_text((fast, slow, pivots))}\n\n{SETTINGS_USAGE}", parse_mode='Markdown')
+        return
+    
+    if args[0] == 'reset' and len(args) == 1:
+        fast, slow, pivots = DEFAULT_SETTINGS
+    elif args[0] == 'ema' and len(args) == 3 and args[1].isdigit() and args[2].isdigit():
+        fast, slow = int(args[1]), int(args[2])
+        low, high = EMA_PERIOD_LIMITS
+        if not (low <= fast < slow <= high):
+            enqueue_message(chat_id, f"⚠️ EMA periods must satisfy {low} <= fast < slow <= {high}")
+            return
+    elif args[0] == 'pivots' and len(args) == 2 and args[1] in PIVOT_METHODS:
+        pivots = args[1]
+    else:
+        enqueue_message(chat_id, f"⚠️ Unknown setting.\n\n{SETTINGS_USAGE}")
+        return
+    
+    user = subscribers.setdefault(chat_id, {'pairs': [], 'alerts': False})
+    if (fast, slow, pivots) == DEFAULT_SETTINGS:
+        user.pop('settings', None)
+    else:
+        user['settings'] = {'ema': [fast, slow], 'pivots': pivots}
+    index_subscriber(chat_id)
+    save_subscriber(chat_id)
+    enqueue_message(chat_id, f"✅ {settings_text((fast, slow, pivots))}", parse_mode='Markdown')
 
 @bot.message_handler(commands=['help'])
+@instrumented
 def help_command(message):
     send_welcome(message)
 
 @bot.message_handler(func=lambda message: message.text.upper() in FOREX_PAIRS.keys())
+@instrumented
 def handle_pair_request(message):
     pair = message.text.upper()
     chat_id = message.chat.id
     show_pair_levels(chat_id, pair)
 
+# ============================================
+# JSON API
+# ============================================
+class ApiBody:
+    """One serialized response: JSON bytes, their gzip form and an ETag"""
+    def __init__(self, version, payload):
+        self.version = version
+        self.body = json.dumps(payload, separators=(',', ':')).encode()
+        self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+# Endpoint key -> ApiBody, rebuilt only when the market versions it covers change
+api_bodies = {}
+api_bodies_lock = Lock()
+
+def pair_payload(market):
+    pair = market.pair
+    if not market.last_update:
+        return {'pair': pair, 'ready': False}
+    if market.current_price and market.pivot:
+        signal = classify_signal(market.current_price, market.pivot, market.tc, market.bc,
+                                 market.r1, market.s1, market.ema_8, market.ema_20)
+    else:
+        signal = 'WAIT'
+    return {
+        'pair': pair,
+        'ready': bool(market.pivot),
+        'price': market.current_price,
+        'stale': market.stale,
+        'signal': signal,
+        'levels': {name: getattr(market, name) for name in ('pivot', 'tc', 'bc', 'r1', 'r2', 'r3', 's1', 's2', 's3')},
+        'cpr_source': market.cpr_source,
+        'prev_session': {'high': market.prev_high, 'low': market.prev_low, 'close': market.prev_close},
+        'weekly_cpr': market.weekly_cpr,
+        'monthly_cpr': market.monthly_cpr,
+        'indicators': market.indicators,
+        'last_update': market.last_update.isoformat(),
+        'version': market.version,
+    }
+
+def signal_payload(market):
+    payload = pair_payload(market)
+    return {key: payload[key] for key in ('pair', 'ready', 'price', 'stale', 'signal', 'last_update', 'version') if key in payload}
+
+def build_api_payload(key, markets):
+    if key == 'levels':
+        return {'pairs': {market.pair: pair_payload(market) for market in markets}}
+    if key == 'signals':
+        return {'pairs': {market.pair: signal_payload(market) for market in markets}}
+    return pair_payload(markets[0])
+
+def get_api_body(key):
+    """Serialized response for `key`, built once per market update"""
+    if key in ('levels', 'signals'):
+        markets = list(market_data.values())
+    else:
+        markets = [get_market(key)]
+    version = tuple((market.pair, market.version) for market in markets)
+    cached = api_bodies.get(key)
+    if cached and cached.version == version:
+        return cached
+    with api_bodies_lock:
+        cached = api_bodies.get(key)
+        if cached and cached.version == version:
+            return cached
+        body = ApiBody(version, build_api_payload(key, markets))
+        # Versions only grow and pairs are only added, so a larger sum is newer
+        if not cached or sum(v for _, v in cached.version) < sum(v for _, v in version):
+            api_bodies[key] = body
+        return body
+
+def api_response(endpoint, key):
+    """304 when the client's ETag still matches, otherwise the cached (gzipped) body"""
+    cached = get_api_body(key)
+    headers = {'ETag': f'"{cached.etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains_weak(cached.etag):
+        API_REQUESTS.inc(endpoint=endpoint, status=304)
+        return Response(status=304, headers=headers)
+    
+    body = cached.body
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = cached.gzipped
+        headers['Content-Encoding'] = 'gzip'
+    API_REQUESTS.inc(endpoint=endpoint, status=200)
+    return Response(body, status=200, headers=headers, mimetype='application/json')
+
+@app.route('/api/levels')
+def api_levels():
+    return api_response('levels', 'levels')
+
+@app.route('/api/levels/<pair>')
+def api_pair_levels(pair):
+    name, pair = pair, resolve_pair(pair)
+    if not pair:
+        API_REQUESTS.inc(endpoint='pair_levels', status=404)
+        return jsonify({'error': f"unknown pair {name}"}), 404
+    return api_response('pair_levels', pair)
+
+@app.route('/api/signals')
+def api_signals():
+    return api_response('signals', 'signals')
+
 # ============================================
 # MONITORING LOOP
 # ============================================
@@ -560,16 +3596,18 @@ def monitoring_loop():
     
     while True:
         try:
-            for pair in FOREX_PAIRS.keys():
-                update_market_data(pair)
-                time.sleep(2)
+            started = time.monotonic()
+            updated = refresh_market_data()
+            elapsed = time.monotonic() - started
+            MONITOR_CYCLE.observe(elapsed)
+            maybe_save_market_snapshot()
             
-            logger.info(f"✅ All pairs updated at {datetime.now().strftime('%H:%M:%S')}")
-            time.sleep(60)
+            logger.info(f"✅ {len(updated)} pairs updated in {elapsed:.1f}s at {datetime.now().strftime('%H:%M:%S')}")
+            time.sleep(market_provider.next_delay(elapsed))
             
         except Exception as e:
             logger.error(f"❌ Monitoring error: {e}")
-            time.sleep(60)
+            time.sleep(UPDATE_INTERVAL)
 
 def bot_polling():
     """Run bot polling in a thread"""
@@ -582,33 +3620,115 @@ def bot_polling():
             time.sleep(15)
 
 # ============================================
-# MAIN
+# TELEGRAM WEBHOOK
 # ============================================
-if __name__ == '__main__':
-    logger.info("=" * 50)
-    logger.info("🤖 Multi-Currency Forex Bot Starting...")
-    logger.info("=" * 50)
-    logger.info("💱 Tracking 10 Major Forex Pairs")
-    logger.info("📊 Strategy: CPR + 8/20 EMA")
-    logger.info(f"⏰ Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    logger.info("=" * 50)
+webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='webhook')
+webhook_slots = BoundedSemaphore(WEBHOOK_MAX_PENDING)
+
+def process_update(update):
+    try:
+        bot.process_new_updates([update])
+    except Exception as e:
+        logger.error(f"❌ Error handling update {update.update_id}: {e}")
+    finally:
+        webhook_slots.release()
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Receive an update from Telegram and hand it to the worker pool"""
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return jsonify({'error': 'forbidden'}), 403
+    
+    try:
+        update = types.Update.de_json(request.get_data(as_text=True))
+    except Exception as e:
+        logger.error(f"❌ Bad webhook payload: {e}")
+        return jsonify({'error': 'bad request'}), 400
+    
+    # Full pool: let Telegram redeliver later instead of queueing without bound
+    if not webhook_slots.acquire(blocking=False):
+        return jsonify({'error': 'busy'}), 503
+    webhook_executor.submit(process_update, update)
+    return jsonify({'ok': True}), 200
+
+def start_webhook():
+    """Register the webhook with Telegram; False means fall back to polling"""
+    if not WEBHOOK_URL:
+        return False
+    if not WEBHOOK_SECRET:
+        logger.error("❌ WEBHOOK_SECRET is required for webhook mode, falling back to polling")
+        return False
+    try:
+        bot.remove_webhook()
+        bot.set_webhook(url=f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                        max_connections=WEBHOOK_WORKERS)
+        logger.info(f"🪝 Webhook set to {WEBHOOK_URL}{WEBHOOK_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Could not set webhook, falling back to polling: {e}")
+        return False
+
+def start_polling():
+    try:
+        bot.remove_webhook()
+    except Exception as e:
+        # The polling loop keeps retrying, so start it anyway
+        logger.error(f"❌ Could not remove webhook before polling: {e}")
+    bot_thread = Thread(target=bot_polling, daemon=True)
+    bot_thread.start()
+
+services_started = False
+
+def start_services():
+    """Start background work; called by __main__ or the gunicorn worker hook"""
+    global services_started
+    if services_started:
+        return
+    services_started = True
     
     # Create necessary directories
     os.makedirs('data', exist_ok=True)
     os.makedirs('logs', exist_ok=True)
     
-    # Initialize users.json if it doesn't exist
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w') as f:
-            json.dump({}, f)
+    # Start outbound message workers
+    send_queue.start()
+    
+    if LEADER_LOCK_FILE:
+        # Several processes on this host: the elected one fetches, the rest follow
+        Thread(target=cluster_loop, daemon=True).start()
+    else:
+        start_leader()
+
+def start_leader():
+    """Fetch market data and take Telegram updates in this process"""
+    # Serve the last known levels right away instead of waiting for a full cycle
+    restore_market_snapshot()
+    atexit.register(save_market_snapshot)
     
     # Start monitoring thread
     monitor_thread = Thread(target=monitoring_loop, daemon=True)
     monitor_thread.start()
     
-    # Start bot polling thread
-    bot_thread = Thread(target=bot_polling, daemon=True)
-    bot_thread.start()
+    # Receive updates by webhook, or poll in a thread
+    if not start_webhook():
+        start_polling()
+
+# ============================================
+# MAIN
+# ============================================
+if __name__ == '__main__':
+    logger.info("=" * 50)
+    logger.info("🤖 Multi-Currency Forex Bot Starting...")
+    logger.info("=" * 50)
+    logger.info(f"💱 {len(FOREX_PAIRS)} symbols configured, refreshing the ones subscribers watch")
+    logger.info("📊 Strategy: CPR + 8/20 EMA")
+    logger.info(f"⏰ Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info("=" * 50)
+    
+    # Render stops instances with SIGTERM; exit normally so atexit hooks save state
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_services()
     
     logger.info("✅ Bot running! Starting web server...")
     logger.info("=" * 50)
@@ -616,4 +3736,3 @@ if __name__ == '__main__':
     # Run Flask web server (required for Render)
 
     app.run(host='0.0.0.0', port=PORT, debug=False)
-
@@ -0,0 +1,79 @@
+"""Signal rules and session boundaries shared by the live bot and backtest.py
+
+Importing this module has no side effects (no bot, files or threads), so
+offline tools can use exactly the rules main.py trades on:
+
+    from strategy import EMAState, classify_signal, session_date_for
+"""
+import os
+from datetime import datetime, timedelta, time as dtime
+from zoneinfo import ZoneInfo
+
+# FX sessions roll over at 17:00 New York time
+SESSION_TIMEZONE = ZoneInfo(os.environ.get('SESSION_TIMEZONE', 'America/New_York'))
+SESSION_ROLLOVER_HOUR = int(os.environ.get('SESSION_ROLLOVER_HOUR', 17))
+
+# Every label classify_signal can return, from most bullish to most bearish
+SIGNAL_LABELS = [
+    'STRONG BUY', 'BUY', 'BUY (Weak)',
+    'NEUTRAL (Bullish)', 'NEUTRAL', 'NEUTRAL (Bearish)',
+    'SELL (Weak)', 'SELL', 'STRONG SELL'
+]
+
+def classify_signal(price, pivot, tc, bc, r1, s1, ema_8, ema_20):
+    """Signal label for a price against CPR levels and EMAs
+
+    backtest.py mirrors these branches in array form, so keep them in sync.
+    """
+    if price > tc:
+        if price > r1 and price > ema_8 and price > ema_20:
+            return "STRONG BUY"
+        elif price > ema_8:
+            return "BUY"
+        else:
+            return "BUY (Weak)"
+    
+    elif price < bc:
+        if price < s1 and price < ema_8 and price < ema_20:
+            return "STRONG SELL"
+        elif price < ema_8:
+            return "SELL"
+        else:
+            return "SELL (Weak)"
+    
+    else:
+        if price > pivot and price > ema_8:
+            return "NEUTRAL (Bullish)"
+        elif price < pivot and price < ema_8:
+            return "NEUTRAL (Bearish)"
+        else:
+            return "NEUTRAL"
+
+class EMAState:
+    """Running EMA, seeded with the SMA of the first `period` prices"""
+    def __init__(self, period):
+        self.period = period
+        self.k = 2 / (period + 1)
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = None
+
+    def update(self, price):
+        self.count += 1
+        if self.value is None:
+            self.seed_sum += price
+            if self.count == self.period:
+                self.value = self.seed_sum / self.period
+        else:
+            self.value = (price * self.k) + (self.value * (1 - self.k))
+        return self.value
+
+def session_date_for(ts):
+    """Trading session a unix timestamp belongs to (the day after a 17:00 NY open)"""
+    local = datetime.fromtimestamp(ts, SESSION_TIMEZONE)
+    return (local + timedelta(hours=24 - SESSION_ROLLOVER_HOUR)).date()
+
+def session_start(session_date):
+    """Unix time the given session opened"""
+    opened = datetime.combine(session_date - timedelta(days=1), dtime(SESSION_ROLLOVER_HOUR), tzinfo=SESSION_TIMEZONE)
+    return opened.timestamp()
@@ -0,0 +1,12 @@
+"""Shared setup: import main in a scratch directory with the synthetic provider"""
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# main.py reads its config and opens data/ and logs/ at import time
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TESTS')
+os.environ.setdefault('MARKET_DATA_PROVIDER', 'synthetic')
+os.chdir(tempfile.mkdtemp(prefix='forexbot-tests-'))
@@ -0,0 +1,97 @@
+"""Level-crossing alerts and the pair -> subscriber index"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+PAIR = 'EUR/USD'
+
+
+class FakeDatetime(datetime):
+    current = datetime(2026, 3, 2, 9, 0)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    """Empty alert state, a fixed clock and a quote setter for PAIR"""
+    monkeypatch.setattr(main, 'alert_sides', defaultdict(dict))
+    monkeypatch.setattr(main, 'alert_session_pivot', {})
+    monkeypatch.setattr(main, 'alert_last_sent', defaultdict(dict))
+    monkeypatch.setattr(main, 'ALERT_HYSTERESIS_PIPS', 2)
+    monkeypatch.setattr(main, 'ALERT_COOLDOWN', 900)
+    monkeypatch.setattr(main, 'datetime', FakeDatetime)
+    monkeypatch.setattr(FakeDatetime, 'current', FakeDatetime.current)
+
+    def quote(price, r1=1.1000, pivot=1.0950):
+        monkeypatch.setitem(main.market_data, PAIR,
+                            main.MarketSnapshot(pair=PAIR, current_price=price, pivot=pivot, r1=r1))
+        return [(level, direction) for _, level, direction, _, _ in main.check_alerts(PAIR)]
+    return quote
+
+
+def test_crossing_needs_to_clear_the_hysteresis_band(alerts):
+    assert alerts(1.0990) == []
+    # 1 pip above R1 is inside the 2 pip band: not a crossing yet
+    assert alerts(1.1001) == []
+    assert alerts(1.0999) == []
+    assert alerts(1.1003) == [('r1', 'above')]
+    assert alerts(1.1003) == []
+
+
+def test_level_is_quiet_during_cooldown(alerts):
+    alerts(1.0990)
+    assert alerts(1.1003) == [('r1', 'above')]
+    FakeDatetime.current += timedelta(seconds=600)
+    assert alerts(1.0990) == []
+    FakeDatetime.current += timedelta(seconds=300)
+    assert alerts(1.1003) == [('r1', 'above')]
+
+
+def test_new_session_resets_sides_without_alerting(alerts):
+    alerts(1.0990)
+    # New pivot: the price is now above the new R1, but that is not a crossing
+    assert alerts(1.1060, r1=1.1050, pivot=1.1000) == []
+    assert alerts(1.1040, r1=1.1050, pivot=1.1000) == [('r1', 'below')]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    for name in ('alert_index', 'alert_index_pairs', 'watched_by_chat', 'pair_watchers'):
+        monkeypatch.setattr(main, name, {})
+    monkeypatch.setattr(main, 'live_chats', set())
+
+    def subscribe(chat_id, pairs, alerts=True):
+        monkeypatch.setitem(main.subscribers, chat_id, {'pairs': list(pairs), 'alerts': alerts})
+        main.index_subscriber(chat_id)
+    return subscribe
+
+
+def test_index_follows_pairs_and_alerts_flag(index):
+    index(501, ['EUR/USD', 'GBP/USD'])
+    index(502, ['EUR/USD'], alerts=False)
+    assert main.alert_index == {'EUR/USD': {501}, 'GBP/USD': {501}}
+    assert main.pair_watchers == {'EUR/USD': 2, 'GBP/USD': 1}
+
+    index(501, ['GBP/USD', 'USD/JPY'])
+    assert main.alert_index == {'GBP/USD': {501}, 'USD/JPY': {501}}
+    assert main.pair_watchers == {'EUR/USD': 1, 'GBP/USD': 1, 'USD/JPY': 1}
+
+    index(502, ['EUR/USD'], alerts=True)
+    index(501, ['GBP/USD', 'USD/JPY'], alerts=False)
+    assert main.alert_index == {'EUR/USD': {502}}
+    assert main.alert_index_pairs == {502: {'EUR/USD'}}
+
+
+def test_index_drops_removed_chats_and_unknown_pairs(index):
+    index(501, ['EUR/USD', 'XXX/YYY'])
+    assert main.alert_index == {'EUR/USD': {501}}
+    del main.subscribers[501]
+    main.index_subscriber(501)
+    assert main.alert_index == {} and main.alert_index_pairs == {}
+    assert main.watched_by_chat == {} and main.pair_watchers == {}
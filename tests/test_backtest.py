@@ -0,0 +1,66 @@
+"""backtest.py against the live rules in strategy.py"""
+import os
+import sys
+import subprocess
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+import backtest
+from strategy import EMAState, SESSION_TIMEZONE
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(7)
+    return 1.1 + np.cumsum(rng.normal(0, 0.0004, 5000))
+
+
+def ny(*args):
+    return datetime(*args, tzinfo=SESSION_TIMEZONE).timestamp()
+
+
+def day_number(day):
+    return np.datetime64(day, 'D').astype(np.int64)
+
+
+def test_exact_ema_matches_streamed_bit_for_bit(prices):
+    state = EMAState(20)
+    streamed = np.array([state.update(p) or 0 for p in prices.tolist()])
+    assert np.array_equal(backtest.ema_array(prices, 20), streamed)
+    assert np.allclose(backtest.ema_array(prices, 20, exact=False), streamed, rtol=1e-12)
+
+
+def test_signals_match_live_classifier(prices):
+    days = np.arange(day_number(date(2024, 3, 1)), day_number(date(2024, 3, 12)))
+    daily = (days, np.full(len(days), 1.112), np.full(len(days), 1.095), np.full(len(days), 1.101))
+    timestamps = ny(2024, 3, 4, 17) + np.arange(len(prices)) * 60.0
+    result = backtest.backtest_pair(timestamps, prices, daily)
+    assert backtest.verify_against_live(prices, result, samples=len(prices)) == 0
+
+
+def test_sessions_roll_over_at_17_new_york():
+    timestamps = np.array([
+        ny(2024, 3, 5, 16, 59),   # Tuesday session
+        ny(2024, 3, 5, 17, 1),    # Wednesday session
+        ny(2024, 3, 10, 17, 1),   # Monday session, first evening of US daylight time
+        ny(2024, 3, 11, 16, 59),
+    ])
+    expected = [date(2024, 3, 5), date(2024, 3, 6), date(2024, 3, 11), date(2024, 3, 11)]
+    assert backtest.session_days(timestamps).tolist() == [day_number(d) for d in expected]
+
+
+def test_levels_come_from_the_previous_session():
+    days = np.array([day_number(date(2024, 3, 4)), day_number(date(2024, 3, 5))])
+    daily = (days, np.array([1.2, 1.4]), np.array([1.0, 1.1]), np.array([1.1, 1.3]))
+    levels = backtest.session_levels(np.array([ny(2024, 3, 5, 16, 59), ny(2024, 3, 5, 17, 1)]), daily)
+    assert levels['pivot'][0] == pytest.approx((1.2 + 1.0 + 1.1) / 3)
+    assert levels['pivot'][1] == pytest.approx((1.4 + 1.1 + 1.3) / 3)
+
+
+def test_backtest_does_not_import_main():
+    code = "import sys, backtest; sys.exit('main' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR).returncode == 0
@@ -0,0 +1,46 @@
+"""Session bars: boundaries and previous-session lookup"""
+from datetime import date, datetime
+
+import main
+
+
+def hourly_ticks(start, end):
+    """One tick per hour from `start` to `end` (timezone-aware datetimes)"""
+    ts = start.timestamp()
+    while ts <= end.timestamp():
+        yield ts
+        ts += 3600
+
+
+def test_month_starting_on_saturday_opens_with_first_trading_session():
+    # 1 June 2024 is a Saturday; the first session opens Sunday 2 June 17:00 New York
+    june = main.first_session_of_month(date(2024, 6, 1))
+    assert june == date(2024, 6, 3)
+    sunday_open = datetime(2024, 6, 2, 17, tzinfo=main.SESSION_TIMEZONE).timestamp()
+    assert main.bar_start('1M', sunday_open + 60) == sunday_open
+    assert main.bar_start('1M', sunday_open - 60) is None
+
+
+def test_previous_month_after_weekend_start():
+    tz = main.SESSION_TIMEZONE
+    builder = main.OHLCBuilder()
+    for i, ts in enumerate(hourly_ticks(datetime(2024, 6, 2, 17, 1, tzinfo=tz),
+                                        datetime(2024, 7, 1, 12, tzinfo=tz))):
+        builder.add_tick(1.08 + (i % 24) / 1000, ts)
+
+    june = builder.previous_session('1M')
+    assert june is not None
+    assert june['start'] == datetime(2024, 6, 2, 17, tzinfo=tz).timestamp()
+    assert builder.series['1M'].bar(0)['start'] == datetime(2024, 6, 30, 17, tzinfo=tz).timestamp()
+
+
+def test_previous_bar_start_skips_weekend_first():
+    tz = main.SESSION_TIMEZONE
+    july = datetime(2024, 6, 30, 17, tzinfo=tz).timestamp()
+    assert main.previous_bar_start('1M', july) == datetime(2024, 6, 2, 17, tzinfo=tz).timestamp()
+    # March 2024 starts on a Friday, so its bar opens the Thursday evening before
+    april = datetime(2024, 3, 31, 17, tzinfo=tz).timestamp()
+    assert main.previous_bar_start('1M', april) == datetime(2024, 2, 29, 17, tzinfo=tz).timestamp()
+    # June closes with the Friday 28 June session, before July's Sunday open
+    june = main.previous_bar_start('1M', july)
+    assert main.bar_end('1M', june) == datetime(2024, 6, 28, 17, tzinfo=tz).timestamp()
@@ -0,0 +1,84 @@
+"""Per-user indicator settings"""
+from datetime import datetime
+
+import main
+
+
+def snapshot(**changes):
+    values = dict(pair='EUR/USD', version=7, current_price=1.0850, pivot=1.0840, tc=1.0845, bc=1.0835,
+                  r1=1.0870, r2=1.0890, r3=1.0910, s1=1.0810, s2=1.0790, s3=1.0770,
+                  prev_high=1.0880, prev_low=1.0800, prev_close=1.0840,
+                  ema_8=1.0846, ema_20=1.0842, indicators={'ema_8': 1.0846, 'ema_20': 1.0842},
+                  last_update=datetime.now())
+    values.update(changes)
+    return main.MarketSnapshot(**values)
+
+
+def test_missing_custom_ema_is_warming_up_and_not_cached():
+    # A follower's snapshot: no history, and the leader has not published ema_9 yet
+    market = snapshot()
+    before = len(main.indicator_cache)
+    assert main.custom_ema(market, 9) == 0
+    assert len(main.indicator_cache) == before
+
+    text = main.render_pair_levels('EUR/USD', market, (9, 21, 'classic'))
+    assert '9 EMA: ⏳ warming up' in text
+    assert 'WAIT' in text
+    assert '-10' not in text.split('EMA INDICATORS')[1].split('CPR LEVELS')[0]
+
+
+def test_streamed_custom_ema_is_used():
+    market = snapshot(indicators={'ema_8': 1.0846, 'ema_20': 1.0842, 'ema_9': 1.0847, 'ema_21': 1.0841})
+    text = main.render_pair_levels('EUR/USD', market, (9, 21, 'classic'))
+    assert '9 EMA: 1.08470' in text
+    assert 'WAIT' not in text
+
+
+def test_custom_ema_from_history_until_streamed():
+    history = tuple(1.08 + i / 10000 for i in range(30))
+    market = snapshot(history=history, version=8)
+    assert main.custom_ema(market, 9) == main.calculate_ema(history, 9)
+
+
+def watch(monkeypatch, chat_id, pair, ema=None):
+    user = {'pairs': [pair], 'alerts': False}
+    if ema:
+        user['settings'] = {'ema': list(ema), 'pivots': 'classic'}
+    monkeypatch.setitem(main.subscribers, chat_id, user)
+    main.index_subscriber(chat_id)
+
+
+def test_custom_ema_streams_while_a_chat_uses_it(monkeypatch):
+    pair = next(iter(main.FOREX_PAIRS))
+    indicators = main.indicator_sets[pair]
+    watch(monkeypatch, 9101, pair, (9, 21))
+    watch(monkeypatch, 9102, pair, (9, 30))
+    indicators.start_requested([1.08] * 40)
+    assert {'ema_9', 'ema_21', 'ema_30'} <= set(indicators.states)
+
+    # 9 is still used by the second chat; 21 is not used by anyone any more
+    watch(monkeypatch, 9101, pair)
+    indicators.start_requested([])
+    assert 'ema_9' in indicators.states and 'ema_21' not in indicators.states
+
+    main.subscribers.pop(9102)
+    main.index_subscriber(9102)
+    indicators.start_requested([])
+    assert not {'ema_9', 'ema_30'} & set(indicators.states)
+    assert set(main.INDICATORS) <= set(indicators.states)
+    assert not any(key[0] == pair for key in main.custom_ema_refs)
+
+
+def test_restore_keeps_only_requested_custom_emas():
+    saved = main.IndicatorSet()
+    saved.request('ema', 9)
+    saved.request('ema', 21)
+    saved.start_requested([])
+    saved.warm_up([1.08 + i / 10000 for i in range(50)])
+
+    restored = main.IndicatorSet()
+    restored.request('ema', 9)
+    assert restored.restore(saved.to_dict())
+    assert restored.value('ema_9') == saved.value('ema_9')
+    assert 'ema_21' not in restored.states
+    assert not restored.requested
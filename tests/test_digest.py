@@ -0,0 +1,51 @@
+"""Live /levels digest edits"""
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import main
+
+
+def telegram_error(code, description):
+    return ApiTelegramException('editMessageText', None, {'error_code': code, 'description': description})
+
+
+@pytest.fixture
+def live_chat(monkeypatch):
+    chat_id = 777
+    stopped = []
+    monkeypatch.setitem(main.subscribers, chat_id, {'pairs': [], 'alerts': False,
+                                                    'live': {'message_id': 5, 'page': 0}})
+    monkeypatch.setattr(main, 'stop_live_digest', stopped.append)
+    main.live_digests[chat_id].sending = True
+    yield chat_id, stopped
+    main.live_digests.pop(chat_id, None)
+
+
+@pytest.mark.parametrize('error', [
+    telegram_error(400, 'Bad Request: message to edit not found'),
+    telegram_error(400, "Bad Request: message can't be edited"),
+    telegram_error(403, 'Forbidden: bot was blocked by the user'),
+])
+def test_permanent_edit_errors_stop_live_mode(live_chat, error):
+    chat_id, stopped = live_chat
+    main.live_edit_done(chat_id, ('state',), None, error)
+    assert stopped == [chat_id]
+
+
+@pytest.mark.parametrize('error', [
+    telegram_error(502, 'Bad Gateway'),
+    TimeoutError('read timed out'),
+])
+def test_transient_edit_errors_keep_live_mode(live_chat, error):
+    chat_id, stopped = live_chat
+    main.live_edit_done(chat_id, ('state',), None, error)
+    assert stopped == []
+    assert not main.live_digests[chat_id].sending
+    assert main.live_digests[chat_id].state != ('state',)
+
+
+def test_not_modified_counts_as_sent(live_chat):
+    chat_id, stopped = live_chat
+    main.live_edit_done(chat_id, ('state',), None, telegram_error(400, 'Bad Request: message is not modified'))
+    assert stopped == []
+    assert main.live_digests[chat_id].state == ('state',)
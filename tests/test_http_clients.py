@@ -0,0 +1,153 @@
+"""Provider HTTP clients: circuit breaker, conditional GETs and poll scheduling"""
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic and wall clocks that only move when the test says so"""
+    now = [1000.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(main.time, 'time', lambda: 1_700_000_000 + now[0])
+    # No jitter: each backoff is the full exponential delay
+    monkeypatch.setattr(main.random, 'uniform', lambda low, high: high)
+    monkeypatch.setattr(main, 'BACKOFF_BASE', 5)
+    monkeypatch.setattr(main, 'BACKOFF_MAX', 600)
+    return now
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise main.requests.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, timeout=None, headers=None, **kwargs):
+        self.sent_headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+def client(*responses):
+    provider = main.ProviderClient('rates.test', max_concurrency=1, rate_limit=0)
+    provider.session = FakeSession(*responses)
+    return provider
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    breaker = main.CircuitBreaker('rates.test', threshold=3)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+    clock[0] += 4.9
+    assert not breaker.allow()
+
+    # After the backoff a single probe goes through
+    clock[0] += 0.1
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit again for twice as long
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    clock[0] += 9.9
+    assert not breaker.allow()
+    clock[0] += 0.1
+    assert breaker.allow()
+
+    breaker.success()
+    assert breaker.state == breaker.CLOSED and breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_retry_after_opens_the_circuit_for_that_long(clock):
+    provider = client(FakeResponse(429, headers={'Retry-After': '120'}), FakeResponse(200, {}))
+    assert provider.get('https://rates.test/latest').status_code == 429
+    assert provider.breaker.state == provider.breaker.OPEN
+
+    clock[0] += 119
+    with pytest.raises(main.CircuitOpenError):
+        provider.get('https://rates.test/latest')
+    clock[0] += 1
+    assert provider.get('https://rates.test/latest').status_code == 200
+    assert provider.breaker.state == provider.breaker.CLOSED
+
+
+def test_not_modified_returns_the_previous_table(clock):
+    table = {'base': 'USD', 'rates': {'EUR': 0.9}}
+    provider = client(FakeResponse(200, table, {'ETag': '"v1"'}), FakeResponse(304))
+    url = 'https://rates.test/latest/USD'
+    assert provider.get_json(url) is table
+    assert provider.get_json(url) is table
+    assert provider.session.sent_headers[1] == {'If-None-Match': '"v1"'}
+
+
+def test_feed_polls_after_the_expected_publication(clock, monkeypatch):
+    monkeypatch.setattr(main, 'POLL_MIN_INTERVAL', 10)
+    monkeypatch.setattr(main, 'POLL_MAX_INTERVAL', 3600)
+    feed = main.FeedSchedule()
+    assert feed.due()
+
+    stamp = main.time.time()
+    first = {'time_last_updated': stamp}
+    feed.success(first)
+    # No publication interval learned yet: poll again at the minimum
+    assert feed.next_due == clock[0] + 10
+
+    clock[0] += 310
+    second = {'time_last_updated': stamp + 300}
+    feed.success(second)
+    assert feed.interval == 300
+    # Next table expected 300s after the last stamp, polled SETTLE seconds later
+    assert feed.next_due == pytest.approx(clock[0] + 290 + feed.SETTLE)
+
+    # A 304 hands back the same table: nothing new is learned
+    clock[0] += 300
+    feed.success(second)
+    assert feed.data is second and feed.interval == 300
+    assert feed.next_due == clock[0] + 10
+
+
+def test_feed_backs_off_and_serves_the_last_table(clock, monkeypatch):
+    table = {'base': 'USD', 'rates': {'EUR': 0.9}, 'time_last_updated': main.time.time()}
+    responses = [table]
+
+    def fetch(url, timeout=None):
+        if responses:
+            return responses.pop(0)
+        raise main.requests.ConnectionError('down')
+
+    monkeypatch.setattr(main, 'http_get_json', fetch)
+    provider = main.LiveProvider()
+    assert provider.latest_rates('USD') is table
+    feed = provider.feeds['USD']
+
+    delays = []
+    for _ in range(3):
+        clock[0] = feed.next_due
+        stale = provider.latest_rates('USD')
+        assert stale['stale'] and stale['rates'] == table['rates']
+        delays.append(feed.next_due - clock[0])
+    assert delays == [5, 10, 20]
+
+    # Between polls the stale table is served without a request
+    assert not feed.due()
+    assert provider.latest_rates('USD')['stale']
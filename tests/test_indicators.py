@@ -0,0 +1,105 @@
+"""Streaming indicators against batch recomputation"""
+import json
+import random
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def prices():
+    rng = random.Random(4)
+    price, out = 1.1, []
+    for _ in range(400):
+        price += rng.gauss(0, 0.0004)
+        out.append(price)
+    return out
+
+
+def batch_sma(prices, period):
+    if len(prices) < period:
+        return None
+    return sum(prices[-period:]) / period
+
+
+def batch_rsi(prices, period):
+    """Wilder RSI: simple average of the first `period` changes, then smoothed"""
+    changes = [b - a for a, b in zip(prices, prices[1:])]
+    if len(changes) < period:
+        return None
+    gains = [max(c, 0.0) for c in changes]
+    losses = [max(-c, 0.0) for c in changes]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    for gain, loss in zip(gains[period:], losses[period:]):
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+    if avg_loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+
+def batch_atr(prices, period):
+    """Wilder ATR where each true range is the move from the previous price"""
+    ranges = [abs(b - a) for a, b in zip(prices, prices[1:])]
+    if len(ranges) < period:
+        return None
+    atr = sum(ranges[:period]) / period
+    for true_range in ranges[period:]:
+        atr = (atr * (period - 1) + true_range) / period
+    return atr
+
+
+BATCH = {
+    'ema': main.calculate_ema,
+    'sma': batch_sma,
+    'rsi': batch_rsi,
+    'atr': batch_atr,
+}
+
+
+@pytest.mark.parametrize('kind,period', [('ema', 8), ('sma', 20), ('rsi', 14), ('atr', 14)])
+def test_streaming_matches_batch_at_every_tick(prices, kind, period):
+    state = main.INDICATOR_TYPES[kind](period)
+    for i, price in enumerate(prices):
+        streamed = state.update(price)
+        expected = BATCH[kind](prices[:i + 1], period)
+        if expected is None:
+            assert streamed is None
+        else:
+            assert streamed == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+def test_warm_up_matches_full_recompute(prices):
+    live = main.IndicatorSet()
+    for price in prices:
+        live.update(price)
+
+    warmed = main.IndicatorSet()
+    warmed.warm_up(prices)
+    assert warmed.values() == pytest.approx(live.values(), rel=1e-12)
+
+
+def test_restore_then_continue_matches_full_recompute(prices):
+    first, rest = prices[:250], prices[250:]
+    before = main.IndicatorSet()
+    before.warm_up(first)
+
+    restored = main.IndicatorSet()
+    # Round-trip through JSON as the market snapshot does
+    assert restored.restore(json.loads(json.dumps(before.to_dict())))
+    restored.warm_up(rest)
+
+    full = main.IndicatorSet()
+    full.warm_up(prices)
+    assert restored.values() == pytest.approx(full.values(), rel=1e-9)
+    for name, (kind, period) in main.INDICATORS.items():
+        assert restored.value(name) == pytest.approx(BATCH[kind](prices, period), rel=1e-9)
+
+
+def test_restore_rejects_mismatched_periods(prices):
+    saved = main.IndicatorSet({'ema_8': ('ema', 8)})
+    saved.warm_up(prices)
+    other = main.IndicatorSet({'ema_8': ('ema', 9)})
+    assert not other.restore(saved.to_dict())
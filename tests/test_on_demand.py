@@ -0,0 +1,50 @@
+"""On-demand refreshes for pairs nobody watches"""
+import time
+from concurrent.futures import wait
+
+import main
+
+
+def unfetched_pair():
+    return next(pair for pair in main.FOREX_PAIRS if pair not in main.market_data and pair not in main.pair_watchers)
+
+
+def capture(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main.send_queue, 'enqueue', lambda chat_id, text, *args, **kwargs: sent.append(text))
+    return sent
+
+
+def test_handler_returns_before_the_refresh_and_replies_after(monkeypatch):
+    sent = capture(monkeypatch)
+    pair = unfetched_pair()
+    release = main.Event()
+    refresh = main.refresh_market_data
+    monkeypatch.setattr(main, 'refresh_market_data', lambda pairs: release.wait(5) and refresh(pairs))
+
+    started = time.monotonic()
+    main.show_pair_levels(4242, pair)
+    assert time.monotonic() - started < 1
+    assert sent == []
+
+    future = main.on_demand_pending[pair]
+    release.set()
+    wait([future], timeout=5)
+    deadline = time.monotonic() + 5
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(sent) == 1
+    assert pair in sent[0] and 'Try again' not in sent[0]
+
+
+def test_second_request_joins_the_running_refresh(monkeypatch):
+    pair = unfetched_pair()
+    release = main.Event()
+    refresh = main.refresh_market_data
+    monkeypatch.setattr(main, 'refresh_market_data', lambda pairs: release.wait(5) and refresh(pairs))
+    first = main.request_refresh([pair])
+    second = main.request_refresh([pair])
+    release.set()
+    assert first == second and len(first) == 1
+    wait(first, timeout=5)
+    assert main.request_refresh([pair]) == []
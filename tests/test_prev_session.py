@@ -0,0 +1,31 @@
+"""Previous-session cache"""
+from datetime import datetime
+
+import main
+
+
+def ny(*args):
+    return datetime(*args, tzinfo=main.SESSION_TIMEZONE).timestamp()
+
+
+def test_previous_session_rolls_over_at_17_new_york():
+    # Tuesday 5 March 2024: before 17:00 the Tuesday session is still open
+    assert main.previous_session_date(ny(2024, 3, 5, 16, 59)) == '2024-03-04'
+    assert main.previous_session_date(ny(2024, 3, 5, 17, 1)) == '2024-03-05'
+
+
+def test_previous_session_skips_the_weekend():
+    # Sunday evening opens Monday's session; the last completed one is Friday's
+    assert main.previous_session_date(ny(2024, 3, 10, 18)) == '2024-03-08'
+    assert main.previous_session_date(ny(2024, 3, 9, 12)) == '2024-03-08'
+
+
+def test_cache_drops_entries_on_rollover(tmp_path):
+    cache = main.PrevSessionCache(str(tmp_path / 'prev_session.json'))
+    pair = next(iter(main.FOREX_PAIRS))
+    assert cache.get(pair, '2024-03-04')['prev_close'] > 0
+    assert cache.get(pair, '2024-03-05')['prev_close'] > 0
+    assert set(cache.entries) == {(pair, '2024-03-05')}
+
+    reloaded = main.PrevSessionCache(str(tmp_path / 'prev_session.json'))
+    assert set(reloaded.entries) == {(pair, '2024-03-05')}
@@ -0,0 +1,28 @@
+"""Market data providers"""
+import pytest
+
+import main
+
+
+def test_synthetic_cross_rates_agree_within_a_tick(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    provider = main.SyntheticProvider(speed=1, seed=3)
+
+    eur = provider.latest_rates('EUR')['rates']
+    jpy = provider.latest_rates('JPY')['rates']
+    usd = provider.latest_rates('USD')['rates']
+    assert eur['JPY'] == pytest.approx(1 / jpy['EUR'], rel=1e-12)
+    assert eur['JPY'] == pytest.approx(usd['JPY'] / usd['EUR'], rel=1e-12)
+
+    now[0] += provider.tick_seconds
+    assert provider.latest_rates('EUR')['rates']['JPY'] != eur['JPY']
+
+
+def test_step_moves_the_walk_within_a_tick(monkeypatch):
+    monkeypatch.setattr(main.time, 'monotonic', lambda: 1000.0)
+    provider = main.SyntheticProvider(speed=1, seed=3)
+    before = provider.latest_rates('EUR')['rates']['JPY']
+    assert provider.latest_rates('EUR')['rates']['JPY'] == before
+    provider.step()
+    assert provider.latest_rates('EUR')['rates']['JPY'] != before
@@ -0,0 +1,45 @@
+"""Outbound send scheduling"""
+import main
+
+
+def scheduler():
+    return main.SendScheduler(workers=0, global_rate=1000, per_chat_interval=0)
+
+
+def test_interactive_message_moves_queued_chat_ahead():
+    queue = scheduler()
+    queue.enqueue(1, 'alert 1', main.PRIORITY_ALERT)
+    queue.enqueue(2, 'alert 2', main.PRIORITY_ALERT)
+    queue.enqueue(2, 'reply 2', main.PRIORITY_INTERACTIVE)
+
+    chat_id, messages = queue.take()
+    assert chat_id == 2
+    assert [m.text for m in messages] == ['reply 2']
+    queue.release(chat_id)
+
+    # The superseded alert-priority entry for chat 2 is skipped, not served twice
+    chat_id, messages = queue.take()
+    assert chat_id == 1
+    queue.release(chat_id)
+    chat_id, messages = queue.take()
+    assert (chat_id, [m.text for m in messages]) == (2, ['alert 2'])
+    assert queue.depth() == 0
+
+
+def test_worker_survives_errors(monkeypatch):
+    queue = scheduler()
+    calls = []
+
+    def send_next():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        raise SystemExit
+
+    monkeypatch.setattr(queue, 'send_next', send_next)
+    monkeypatch.setattr(main.time, 'sleep', lambda seconds: None)
+    try:
+        queue.worker_loop()
+    except SystemExit:
+        pass
+    assert len(calls) == 2
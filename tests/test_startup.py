@@ -0,0 +1,23 @@
+"""Service startup"""
+import requests
+
+import main
+
+
+def test_polling_starts_when_telegram_is_unreachable(monkeypatch):
+    started = []
+
+    def unreachable():
+        raise requests.ConnectionError('api.telegram.org unreachable')
+
+    class FakeThread:
+        def __init__(self, target, daemon=False):
+            self.target = target
+
+        def start(self):
+            started.append(self.target)
+
+    monkeypatch.setattr(main.bot, 'remove_webhook', unreachable)
+    monkeypatch.setattr(main, 'Thread', FakeThread)
+    main.start_polling()
+    assert started == [main.bot_polling]
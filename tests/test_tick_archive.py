@@ -0,0 +1,62 @@
+"""On-disk tick archive"""
+import os
+
+from tick_archive import TickArchive, repair_segment, segment_day
+
+PAIR = 'EUR/USD'
+DAY = segment_day('2026-03-02')
+
+
+def test_ticks_across_midnight_go_to_two_segments(tmp_path):
+    archive = TickArchive(str(tmp_path))
+    ticks = [(DAY - 20, 1.0850), (DAY - 10, 1.0851), (DAY + 10, 1.0852), (DAY + 20, 1.0853)]
+    assert archive.append_many(PAIR, ticks) == 4
+    assert archive.segment_names(PAIR) == ['2026-03-01', '2026-03-02']
+
+    assert archive.query(PAIR) == ticks
+    assert archive.query(PAIR, DAY - 15, DAY + 15) == ticks[1:3]
+    assert archive.count(PAIR, DAY - 15, DAY + 15) == 2
+    assert archive.query(PAIR, DAY, None) == ticks[2:]
+
+
+def test_limit_stops_at_the_oldest_rows(tmp_path):
+    archive = TickArchive(str(tmp_path))
+    ticks = [(DAY - 20 + 10 * i, 1.085 + i / 10000) for i in range(5)]
+    archive.append_many(PAIR, ticks)
+    assert archive.query(PAIR, limit=3) == ticks[:3]
+    assert archive.query(PAIR, DAY - 15, limit=2) == ticks[1:3]
+    assert archive.query(PAIR, limit=0) == []
+
+
+def test_older_ticks_are_dropped(tmp_path):
+    archive = TickArchive(str(tmp_path))
+    assert archive.append(PAIR, DAY + 10, 1.0850) == 1
+    assert archive.append_many(PAIR, [(DAY + 5, 1.0), (DAY + 10, 1.0851), (DAY + 8, 1.0), (DAY + 12, 1.0852)]) == 2
+    assert archive.query(PAIR) == [(DAY + 10, 1.0850), (DAY + 10, 1.0851), (DAY + 12, 1.0852)]
+
+    # A new archive on the same directory picks the last timestamp up from disk
+    reopened = TickArchive(str(tmp_path))
+    assert reopened.append(PAIR, DAY + 11, 1.0) == 0
+    assert reopened.last_timestamp(PAIR) == DAY + 12
+
+
+def test_torn_row_is_cut_before_appending(tmp_path):
+    archive = TickArchive(str(tmp_path))
+    archive.append_many(PAIR, [(DAY + 1, 1.0850), (DAY + 2, 1.0851)])
+    path = os.path.join(archive.pair_dir(PAIR), '2026-03-02')
+    # A crash mid-append: the price landed but only part of its timestamp did
+    with open(path + '.px', 'ab') as f:
+        f.write(b'\x00' * 8)
+    with open(path + '.ts', 'ab') as f:
+        f.write(b'\x00' * 3)
+    assert archive.query(PAIR) == [(DAY + 1, 1.0850), (DAY + 2, 1.0851)]
+
+    repair_segment(path)
+    assert os.path.getsize(path + '.ts') == os.path.getsize(path + '.px') == 16
+
+    # A fresh writer repairs the segment itself before its first append
+    with open(path + '.px', 'ab') as f:
+        f.write(b'\x00' * 8)
+    writer = TickArchive(str(tmp_path))
+    writer.append(PAIR, DAY + 3, 1.0852)
+    assert writer.query(PAIR) == [(DAY + 1, 1.0850), (DAY + 2, 1.0851), (DAY + 3, 1.0852)]
@@ -0,0 +1,204 @@
+"""Append-only columnar tick archive
+
+Layout, one directory per pair and one segment per UTC day:
+
+    data/ticks/EURUSD/2024-03-05.ts   float64 unix timestamps, ascending
+    data/ticks/EURUSD/2024-03-05.px   float64 prices, same row order
+
+Every row is 8 bytes per column, little-endian, so row i of a segment
+sits at byte 8*i of both files. Readers memory-map the files and get
+memoryview slices back (found by binary search on the timestamp
+column), so numpy can wrap a range with np.frombuffer without copying:
+
+    archive = TickArchive('data/ticks')
+    archive.append('EUR/USD', time.time(), 1.0853)
+    for ts, px in archive.segments('EUR/USD', start, end):
+        prices = np.frombuffer(px)
+"""
+import os
+import sys
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+
+SECONDS_PER_DAY = 86400
+ROW = struct.Struct('<d')
+# Mapped segments kept open; each holds two mmaps (and their fds)
+MAX_OPEN_SEGMENTS = 64
+
+# Readers map the files as native doubles
+if sys.byteorder != 'little':
+    raise ImportError('tick_archive needs a little-endian host')
+
+def pair_dirname(pair):
+    return pair.replace('/', '').upper()
+
+def segment_name(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+def segment_day(name):
+    return datetime.strptime(name, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+class Segment:
+    """Read-only mapping of one segment's two columns"""
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.ts = self.px = memoryview(b'').cast('d')
+        self.maps = []
+
+    def refresh(self):
+        """Re-map if the writer appended since the last look"""
+        try:
+            ts_size = os.path.getsize(self.path + '.ts')
+            px_size = os.path.getsize(self.path + '.px')
+        except OSError:
+            return self
+        # A crash between the two writes can leave one column longer
+        size = min(ts_size, px_size) // 8 * 8
+        if size == self.size:
+            return self
+        columns = []
+        maps = []
+        for suffix in ('.ts', '.px'):
+            with open(self.path + suffix, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            maps.append(mapped)
+            columns.append(memoryview(mapped).cast('d'))
+        # Old maps close once the last slice handed out is released
+        self.ts, self.px = columns
+        self.maps = maps
+        self.size = size
+        return self
+
+    def __len__(self):
+        return len(self.ts)
+
+    def slice(self, start=None, end=None):
+        """(timestamps, prices) memoryviews for start <= ts <= end"""
+        lo = 0 if start is None else bisect_left(self.ts, start)
+        hi = len(self.ts) if end is None else bisect_right(self.ts, end)
+        return self.ts[lo:hi], self.px[lo:hi]
+
+def repair_segment(path):
+    """Cut both columns back to their common whole-row length
+
+    A crash between the two column writes leaves one file longer (or a
+    partial row); appending after that would misalign the rows for good.
+    """
+    try:
+        sizes = [os.path.getsize(path + suffix) for suffix in ('.ts', '.px')]
+    except OSError:
+        return
+    size = min(sizes) // 8 * 8
+    for suffix, current in zip(('.ts', '.px'), sizes):
+        if current != size:
+            os.truncate(path + suffix, size)
+
+class TickArchive:
+    def __init__(self, root, max_open=MAX_OPEN_SEGMENTS):
+        self.root = root
+        self.max_open = max_open
+        self.write_lock = Lock()
+        self.cache_lock = Lock()
+        self.cache = OrderedDict()
+        self.last_ts = {}
+        self.repaired = set()
+
+    def pair_dir(self, pair):
+        return os.path.join(self.root, pair_dirname(pair))
+
+    def append(self, pair, ts, price):
+        """Add one tick; ticks older than the pair's last one are dropped"""
+        return self.append_many(pair, [(ts, price)])
+
+    def append_many(self, pair, ticks):
+        """Add (ts, price) rows in time order; returns how many were written"""
+        with self.write_lock:
+            last = self.last_ts.get(pair)
+            if last is None:
+                last = self.last_timestamp(pair) or 0.0
+            rows = {}
+            for ts, price in ticks:
+                if ts < last:
+                    continue
+                last = ts
+                rows.setdefault(segment_name(ts), []).append((ts, price))
+            if not rows:
+                return 0
+            directory = self.pair_dir(pair)
+            os.makedirs(directory, exist_ok=True)
+            for name, segment_rows in rows.items():
+                path = os.path.join(directory, name)
+                if path not in self.repaired:
+                    repair_segment(path)
+                    self.repaired.add(path)
+                # Prices first: a row only becomes visible once its timestamp lands
+                with open(path + '.px', 'ab') as f:
+                    f.write(b''.join(ROW.pack(price) for _, price in segment_rows))
+                with open(path + '.ts', 'ab') as f:
+                    f.write(b''.join(ROW.pack(ts) for ts, _ in segment_rows))
+            self.last_ts[pair] = last
+            return sum(len(r) for r in rows.values())
+
+    def segment_names(self, pair):
+        try:
+            names = os.listdir(self.pair_dir(pair))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-3] for name in names if name.endswith('.ts'))
+
+    def segment(self, pair, name):
+        key = (pair_dirname(pair), name)
+        with self.cache_lock:
+            segment = self.cache.get(key)
+            if segment is None:
+                segment = self.cache[key] = Segment(os.path.join(self.pair_dir(pair), name))
+                # Evicted maps close once the last slice handed out is released
+                while len(self.cache) > self.max_open:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.move_to_end(key)
+            return segment.refresh()
+
+    def segments(self, pair, start=None, end=None):
+        """Yield (timestamps, prices) memoryviews covering start..end, oldest first"""
+        for name in self.segment_names(pair):
+            day = segment_day(name)
+            if start is not None and day + SECONDS_PER_DAY <= start:
+                continue
+            if end is not None and day > end:
+                break
+            ts, px = self.segment(pair, name).slice(start, end)
+            if len(ts):
+                yield ts, px
+
+    def count(self, pair, start=None, end=None):
+        return sum(len(ts) for ts, _ in self.segments(pair, start, end))
+
+    def query(self, pair, start=None, end=None, limit=None):
+        """Ticks in start..end as a list of (ts, price), at most `limit` of them"""
+        rows = []
+        for ts, px in self.segments(pair, start, end):
+            take = len(ts) if limit is None else min(len(ts), limit - len(rows))
+            rows.extend(zip(ts[:take].tolist(), px[:take].tolist()))
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+    def last_timestamp(self, pair):
+        for name in reversed(self.segment_names(pair)):
+            segment = self.segment(pair, name)
+            if len(segment):
+                return segment.ts[-1]
+        return None
+
+    def pairs(self):
+        try:
+            return sorted(name for name in os.listdir(self.root)
+                          if os.path.isdir(os.path.join(self.root, name)))
+        except FileNotFoundError:
+            return []
@@ -0,0 +1,113 @@
+"""Webhook throughput and latency against a fake Telegram API
+
+Usage:
+    python webhook_harness.py --updates 2000 --concurrency 32 --text /start
+
+POSTs synthetic updates to the Flask webhook route (in-process test
+client) and waits for the resulting sendMessage calls at the fake API.
+Reports webhook ack latency and end-to-end latency from POST to reply.
+Runs in a temporary working directory, so the synthetic chats never reach
+the real data/ or logs/ directories.
+"""
+import os
+import json
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+# Webhook mode must be configured before main is imported
+os.environ.setdefault('WEBHOOK_URL', 'http://127.0.0.1')
+os.environ.setdefault('WEBHOOK_SECRET', 'harness-secret')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:HARNESS')
+os.environ.setdefault('SEND_GLOBAL_RATE', '100000')
+
+from fake_telegram import FakeTelegram, make_update
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(updates, concurrency, text, timeout):
+    fake = FakeTelegram().start()
+    fake.install()
+
+    os.chdir(tempfile.mkdtemp(prefix='forexbot-webhook-'))
+    import main
+    main.send_queue.start()
+    client = main.app.test_client()
+    headers = {'X-Telegram-Bot-Api-Secret-Token': main.WEBHOOK_SECRET}
+
+    posted = {}
+    acks = []
+    statuses = {}
+
+    def post(i):
+        chat_id = 10_000_000 + i
+        body = json.dumps(make_update(i + 1, chat_id, text))
+        started = time.perf_counter()
+        response = client.post(main.WEBHOOK_PATH, data=body, headers=headers, content_type='application/json')
+        acked = time.perf_counter()
+        posted[chat_id] = started
+        acks.append(acked - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, range(updates)))
+    posting_done = time.perf_counter()
+
+    expected = statuses.get(200, 0)
+    deadline = time.time() + timeout
+    while len(fake.sent()) < expected and time.time() < deadline:
+        time.sleep(0.05)
+    finished = time.perf_counter()
+
+    replies = {}
+    for t, params in fake.sent():
+        chat_id = int(params['chat_id'])
+        replies.setdefault(chat_id, t)
+    end_to_end = [replies[c] - posted[c] for c in replies if c in posted]
+
+    fake.stop()
+    return {
+        'updates': updates,
+        'concurrency': concurrency,
+        'statuses': statuses,
+        'replies': len(replies),
+        'post_seconds': round(posting_done - started, 3),
+        'total_seconds': round(finished - started, 3),
+        'updates_per_second': round(updates / (posting_done - started), 1),
+        'ack_ms': {'p50': round(percentile(acks, 50) * 1000, 2), 'p99': round(percentile(acks, 99) * 1000, 2)},
+        'end_to_end_ms': {'p50': round(percentile(end_to_end, 50) * 1000, 2),
+                          'p99': round(percentile(end_to_end, 99) * 1000, 2)},
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Webhook throughput/latency harness')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--text', default='/start', help='message text each synthetic user sends')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for replies')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON only')
+    args = parser.parse_args()
+
+    result = run(args.updates, args.concurrency, args.text, args.timeout)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main_cli()